@@ -0,0 +1,69 @@
+"""
+Gunicorn Configuration
+
+Runs gthread workers by default: a worker process per CPU of the container
+quota, each serving as many interactive requests at once as its database
+pool has connections, and as many bulk requests as the bulk lane admits on
+its own pool, since requests spend most of their time waiting on Postgres.
+Every request pushes its own app context and therefore gets its own
+SQLAlchemy session, so the threads of a worker share nothing else than the
+connection pools.
+
+Set GUNICORN_WORKER_CLASS=gevent to serve many long lived change feed
+streams: a gthread worker holds a thread for every open stream, and so
+serves at most CHANGE_FEED_MAX_STREAMS of them, a gevent worker only a
+greenlet, and CHANGE_FEED_MAX_STREAMS=0 lifts the limit. psycopg2 is made
+cooperative with psycogreen, and the pool still bounds the queries a
+worker runs at once.
+
+Environment:
+    GUNICORN_WORKER_CLASS        gthread (default), gevent or sync
+    WEB_CONCURRENCY              worker processes, from the CPU quota by default
+    GUNICORN_THREADS             threads of a gthread worker, by default
+                                 DB_POOL_SIZE + DB_MAX_OVERFLOW + LANE_BULK_MAX_IN_FLIGHT
+    GUNICORN_WORKER_CONNECTIONS  concurrent requests of a gevent worker
+"""
+import os
+
+# same defaults as service/config.py, which cannot be imported without loading the app
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+LANE_BULK_MAX_IN_FLIGHT = int(os.getenv("LANE_BULK_MAX_IN_FLIGHT", "2"))
+
+
+def cpu_quota() -> float:
+    """ CPUs the container may use: its cgroup quota, or every CPU of the host """
+    for path in ("/sys/fs/cgroup/cpu.max", "/sys/fs/cgroup/cpu/cpu.cfs_quota_us"):
+        try:
+            with open(path, encoding="ascii") as quota_file:
+                fields = quota_file.read().split()
+            if path.endswith("cpu.max"):
+                quota, period = fields
+            else:
+                quota = fields[0]
+                with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", encoding="ascii") as period_file:
+                    period = period_file.read().strip()
+            if quota not in ("max", "-1"):
+                return int(quota) / int(period)
+        except (OSError, ValueError):
+            continue
+    return float(os.cpu_count() or 1)
+
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+# threads already cover the time spent waiting on Postgres, so a 0.2 CPU pod runs a single worker
+workers = int(os.getenv("WEB_CONCURRENCY", "0")) or max(1, round(cpu_quota()))
+# bulk requests wait on their own pool and threads, never on those of the interactive ones
+threads = int(os.getenv("GUNICORN_THREADS", "0")) or DB_POOL_SIZE + DB_MAX_OVERFLOW + LANE_BULK_MAX_IN_FLIGHT
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "100"))
+
+# the app connects to the database on import, which must happen in each worker
+preload_app = False
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """ Make psycopg2 wait for Postgres cooperatively in gevent workers """
+    if worker_class == "gevent":
+        from psycogreen.gevent import patch_psycopg  # pylint: disable=import-outside-toplevel
+
+        patch_psycopg()
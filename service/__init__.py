@@ -10,7 +10,10 @@ from flask import Flask
 from flask_restx import Api
 
 from service import config
-from service.common import log_handlers
+from service.common import (
+    admission, archive, change_feed, deadline, expiry, group_commit, lanes, log_handlers, outbox, replicas,
+    sharding, statement_cache, timing
+)
 
 # Create Flask application
 app = Flask(__name__)
@@ -25,7 +28,8 @@ api = Api(app,
           default="Shopcart",
           default_label="Shopcarts Service Operations",
           doc=app.config["PREFIX_API_DOCS"],
-          prefix=app.config["PREFIX_API"])
+          prefix=app.config["PREFIX_API"],
+          decorators=[timing.timed("marshal")])
 
 # Dependencies require we import the routes AFTER the Flask app is created
 # pylint: disable=wrong-import-position, wrong-import-order, cyclic-import
@@ -35,6 +39,14 @@ from service.common import error_handlers, cli_commands  # noqa: F401, E402
 
 # Set up logging for production
 log_handlers.init_logging(app, "gunicorn.error")
+timing.init_timing(app, api)
+deadline.init_deadline(app)
+admission.init_admission(app)
+statement_cache.init_statement_cache(app)
+lanes.init_lanes(app)
+replicas.init_replicas(app)
+sharding.init_sharding(app)
+change_feed.init_change_feed(app)
 
 app.logger.info(70 * "*")
 app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
@@ -47,4 +59,9 @@ except Exception as error:  # pylint: disable=broad-except
     # gunicorn requires exit code 4 to stop spawning workers when they die
     sys.exit(4)
 
+group_commit.init_group_commit(app)
+outbox.init_outbox(app)
+expiry.init_expiry(app)
+archive.init_archive(app)
+
 app.logger.info("Service initialized!")
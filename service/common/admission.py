@@ -0,0 +1,212 @@
+"""
+Admission Control
+
+Per client token bucket rate limiting and load shedding. Requests over their
+client's rate get 429_TOO_MANY_REQUESTS and requests arriving while the worker
+is overloaded (too many requests in flight or connection pool waits too long)
+get 503_SERVICE_UNAVAILABLE, both with a Retry-After header.
+
+Clients are told apart by their address, the one X-Forwarded-For gives
+behind TRUSTED_PROXIES proxies. The CLIENT_ID_HEADER a client sends is only
+used with TRUST_CLIENT_ID_HEADER, when a gateway in front of the service sets
+it: otherwise a client would get a new bucket with every id it makes up.
+
+The token buckets live in memory by default. Setting RATE_LIMIT_STORE to a
+file path keeps them in a SQLite file so every gunicorn worker of a node
+shares the same limits.
+"""
+import math
+import sqlite3
+import threading
+import time
+
+from flask import request
+from sqlalchemy.pool import QueuePool
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from service.common import metrics
+
+EXEMPT_PATHS = ("/health", "/metrics")
+ENVIRON_KEY = "service.admitted"
+POOL_WAIT_DECAY_SECONDS = 1.0
+
+
+class MemoryBucketStore:
+    """ Token buckets of a single process """
+
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, key, rate, burst, now) -> float:
+        """ Take a token and return how long to wait when none is left """
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens, wait = _refill_and_take(tokens, updated, rate, burst, now)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.MAX_KEYS:
+                self._prune(rate, burst, now)
+            return wait
+
+    def _prune(self, rate, burst, now):
+        """ Forget the buckets that have refilled, they behave as new ones """
+        for key, (tokens, updated) in list(self._buckets.items()):
+            if tokens + (now - updated) * rate >= burst:
+                del self._buckets[key]
+
+
+class SqliteBucketStore:
+    """ Token buckets in a SQLite file shared by the workers of a node """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS bucket "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst, now) -> float:
+        """ Take a token and return how long to wait when none is left """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM bucket WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens, wait = _refill_and_take(tokens, updated, rate, burst, now)
+            conn.execute("INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            self._takes += 1
+            if self._takes % self.PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM bucket WHERE tokens + (? - updated) * ? >= ?", (now, rate, burst))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+
+def _refill_and_take(tokens, updated, rate, burst, now):
+    """ Refill a bucket for the elapsed time and take one token from it """
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class MeteredQueuePool(QueuePool):
+    """ QueuePool that keeps a decaying average of the connection checkout wait """
+
+    wait_lock = threading.Lock()
+    wait_average = 0.0
+    wait_updated = 0.0
+
+    def connect(self):
+        started = time.monotonic()
+        connection = super().connect()
+        MeteredQueuePool.record_wait(time.monotonic() - started)
+        return connection
+
+    @classmethod
+    def record_wait(cls, seconds):
+        """ Fold one checkout wait into the average """
+        with cls.wait_lock:
+            cls.wait_average = 0.8 * cls.current_wait() + 0.2 * seconds
+            cls.wait_updated = time.monotonic()
+
+    @classmethod
+    def current_wait(cls) -> float:
+        """ Average checkout wait in seconds, decaying while nothing checks out """
+        idle = time.monotonic() - cls.wait_updated
+        return cls.wait_average * math.exp(-idle / POOL_WAIT_DECAY_SECONDS)
+
+
+class AdmissionControl:
+    """ Decides whether a request is admitted """
+
+    def __init__(self, config):
+        self.rate = float(config.get("RATE_LIMIT_PER_SECOND", 0))
+        self.burst = float(config.get("RATE_LIMIT_BURST", 20))
+        self.client_header = config.get("CLIENT_ID_HEADER", "X-Client-Id") if config.get("TRUST_CLIENT_ID_HEADER") else None
+        self.max_in_flight = int(config.get("SHED_MAX_IN_FLIGHT", 0))
+        self.max_pool_wait = float(config.get("SHED_MAX_POOL_WAIT_MS", 0)) / 1000
+        store_path = config.get("RATE_LIMIT_STORE")
+        self.store = SqliteBucketStore(store_path) if store_path else MemoryBucketStore()
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def client_key(self) -> str:
+        """ The key the rate limit of the current request is counted against """
+        client_id = request.headers.get(self.client_header) if self.client_header else None
+        return client_id or request.remote_addr or "anonymous"
+
+    def check_rate(self):
+        """ Abort with 429 when the client has used up its tokens """
+        if self.rate <= 0:
+            return
+        wait = self.store.take(self.client_key(), self.rate, self.burst, time.time())
+        if wait > 0:
+            metrics.increment("admission.rate_limited")
+            raise TooManyRequests("Rate limit exceeded, slow down.", retry_after=math.ceil(wait))
+
+    def enter(self):
+        """ Admit the request or abort with 503 when the worker is overloaded """
+        if self.max_pool_wait and MeteredQueuePool.current_wait() > self.max_pool_wait:
+            metrics.increment("admission.shed_pool_wait")
+            raise ServiceUnavailable("Database pool is saturated, try again later.", retry_after=1)
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                metrics.increment("admission.shed_in_flight")
+                raise ServiceUnavailable("Too many requests in flight, try again later.", retry_after=1)
+            self.in_flight += 1
+        # the operations of a batch run in requests of their own, which must not release the slot
+        request.environ[ENVIRON_KEY] = True
+
+    def leave(self):
+        """ Release the in flight slot of an admitted request """
+        if request.environ.pop(ENVIRON_KEY, False):
+            with self._lock:
+                self.in_flight -= 1
+
+
+def init_admission(app):
+    """ Check every API request against the rate limits and load thresholds """
+    if ":memory:" not in app.config.get("SQLALCHEMY_DATABASE_URI", ""):
+        options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+        options.setdefault("poolclass", MeteredQueuePool)
+        options.setdefault("pool_size", app.config.get("DB_POOL_SIZE", 5))
+        options.setdefault("max_overflow", app.config.get("DB_MAX_OVERFLOW", 10))
+        options.setdefault("pool_timeout", app.config.get("DB_POOL_TIMEOUT", 30))
+    if app.config.get("TRUSTED_PROXIES"):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"])
+    app.extensions["admission"] = AdmissionControl(app.config)
+    metrics.register_gauge("admission.in_flight", lambda: app.extensions["admission"].in_flight)
+    metrics.register_gauge("db.pool_wait_ms", lambda: round(MeteredQueuePool.current_wait() * 1000, 3))
+
+    @app.before_request
+    def admit():  # pylint: disable=unused-variable
+        """ Rate limit and shed load before any work is done """
+        if request.path in EXEMPT_PATHS:
+            return
+        control = app.extensions["admission"]
+        control.check_rate()
+        control.enter()
+
+    @app.teardown_request
+    def release(_error):  # pylint: disable=unused-variable
+        """ Free the in flight slot whatever the outcome """
+        app.extensions["admission"].leave()
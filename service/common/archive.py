@@ -0,0 +1,48 @@
+"""
+Shopcart Archive
+
+Shopcarts left unchanged for ARCHIVE_AFTER_SECONDS are moved, with their
+items, out of the hot shopcart and item tables to the compressed rows of
+the archived_shopcart table, keeping the tables and indexes the requests
+use small enough to stay in cache. The analytics keep reading them there.
+
+GET /api/shopcarts/{id} and its items fall back to the archive when the
+shopcart is not in the hot tables, and PUT /api/shopcarts/{id}/restore
+moves an archived shopcart back before it is changed again.
+
+The archiver moves ARCHIVE_BATCH_SIZE shopcarts at a time, each batch in a
+transaction of its own claiming its shopcarts like the expiry sweeper. It
+runs in a thread of each worker every ARCHIVE_SWEEP_SECONDS when set, or
+in its own process with `flask archive-stale`.
+"""
+import atexit
+
+from service.common.expiry import ChunkedSweeper
+from service.models import Shopcart
+
+
+class ArchiveSweeper(ChunkedSweeper):
+    """ Moves the stale shopcarts to the archive in batches """
+
+    metric = "archive"
+    counter = "archived"
+
+    def __init__(self, app, age: float, batch_size: int = 100, poll_seconds: float = 60.0):
+        super().__init__(app, batch_size, poll_seconds)
+        self.age = age
+
+    def process_chunk(self) -> int:
+        """ Archive the next batch of stale shopcarts """
+        return Shopcart.archive_stale(self.age, self.chunk_size)
+
+
+def init_archive(app):
+    """ Start the archiver thread as configured """
+    if not (app.config["ARCHIVE_SWEEP_SECONDS"] and app.config["ARCHIVE_AFTER_SECONDS"]):
+        return None
+    archiver = ArchiveSweeper(
+        app, app.config["ARCHIVE_AFTER_SECONDS"], app.config["ARCHIVE_BATCH_SIZE"], app.config["ARCHIVE_SWEEP_SECONDS"]
+    )
+    archiver.start()
+    atexit.register(archiver.stop)
+    return archiver
@@ -0,0 +1,158 @@
+"""
+Change Feed
+
+The cart and item changes recorded by the models are published to the broker
+once their transaction commits, and streamed to clients as Server-Sent Events
+by GET /api/shopcarts/events and GET /api/shopcarts/{shopcart_id}/events.
+
+The broker lives in the worker process: a stream sees the changes committed
+by the worker serving it. Recent events are kept so a client reconnecting
+with Last-Event-ID gets the changes it missed; a client whose Last-Event-ID
+is no longer known, or which reads too slowly to keep up, gets a "reset"
+event telling it to reload its carts.
+
+An open stream holds a thread of a gthread worker, so a worker serves at most
+CHANGE_FEED_MAX_STREAMS streams at once and answers 503 to the others, which
+retry later. gevent workers, where a stream only holds a greenlet, can lift
+the limit with CHANGE_FEED_MAX_STREAMS=0.
+"""
+import collections
+import itertools
+import json
+import queue
+import threading
+import time
+import uuid
+
+from werkzeug.exceptions import ServiceUnavailable
+
+from service.common import metrics
+
+RETRY_MILLISECONDS = 3000
+RESET_EVENT = "event: reset\ndata: {}\n\n"
+
+
+def format_event(event: dict) -> str:
+    """ Encode a change as a Server-Sent Event """
+    data = {key: value for key, value in event.items() if key != "event_id"}
+    return (
+        f"id: {event['event_id']}\n"
+        f"event: {event['type']}.{event['action']}\n"
+        f"data: {json.dumps(data)}\n\n"
+    )
+
+
+class Subscription:
+    """ The queue of events waiting to be sent to one stream """
+
+    def __init__(self, shopcart_id, size: int):
+        self.shopcart_id = shopcart_id
+        self.events = queue.Queue(size)
+        self.overflowed = False
+
+    def wants(self, event: dict) -> bool:
+        """ True if the event is about the carts the stream follows """
+        return self.shopcart_id is None or event["shopcart_id"] == self.shopcart_id
+
+    def put(self, event: dict):
+        """ Queue an event, or flag the subscription when the client is too slow """
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+
+class ChangeBroker:
+    """ Fans the committed changes out to the subscribed streams """
+
+    def __init__(self, history: int = 1000, queue_size: int = 1000, max_subscriptions: int = 0):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._history = collections.deque(maxlen=history)
+        self._prefix = uuid.uuid4().hex[:8]
+        self._ids = itertools.count(1)
+        self.queue_size = queue_size
+        self.max_subscriptions = max_subscriptions  # 0 for no limit
+
+    def configure(self, history: int, queue_size: int, max_subscriptions: int = 0):
+        """ Resize the history and the queue of new subscriptions, and limit the open subscriptions """
+        with self._lock:
+            self._history = collections.deque(self._history, maxlen=history)
+            self.queue_size = queue_size
+            self.max_subscriptions = max_subscriptions
+
+    @property
+    def subscriber_count(self) -> int:
+        """ The number of open streams """
+        return len(self._subscriptions)
+
+    def publish(self, changes: list):
+        """ Number the changes and queue them on every interested subscription """
+        with self._lock:
+            for change in changes:
+                event = dict(change, event_id=f"{self._prefix}-{next(self._ids)}")
+                self._history.append(event)
+                for subscription in self._subscriptions:
+                    if subscription.wants(event):
+                        subscription.put(event)
+        metrics.increment("change_feed.published", len(changes))
+
+    def subscribe(self, shopcart_id=None, last_event_id=None) -> Subscription:
+        """ Open a subscription, replaying the events after last_event_id, or abort with 503 when too many are open """
+        subscription = Subscription(shopcart_id, self.queue_size)
+        with self._lock:
+            if self.max_subscriptions and len(self._subscriptions) >= self.max_subscriptions:
+                metrics.increment("change_feed.rejected")
+                raise ServiceUnavailable("Too many change feed streams open, try again later.",
+                                         retry_after=RETRY_MILLISECONDS // 1000)
+            if last_event_id:
+                ids = [event["event_id"] for event in self._history]
+                if last_event_id in ids:
+                    for event in itertools.islice(self._history, ids.index(last_event_id) + 1, None):
+                        if subscription.wants(event):
+                            subscription.put(event)
+                else:
+                    subscription.overflowed = True
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """ Close a subscription """
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def stream(self, subscription: Subscription, heartbeat_seconds: float, max_seconds: float):
+        """ Generate the Server-Sent Events of a subscription until max_seconds have passed """
+        deadline = time.monotonic() + max_seconds
+        try:
+            yield f"retry: {RETRY_MILLISECONDS}\n\n"
+            while True:
+                if subscription.overflowed:
+                    metrics.increment("change_feed.reset")
+                    yield RESET_EVENT
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # send what is already queued rather than have the client replay it
+                    while not subscription.events.empty():
+                        yield format_event(subscription.events.get_nowait())
+                    return
+                try:
+                    event = subscription.events.get(timeout=min(heartbeat_seconds, remaining))
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_event(event)
+        finally:
+            self.unsubscribe(subscription)
+
+
+broker = ChangeBroker()
+
+
+def init_change_feed(app):
+    """ Size the broker from the configuration """
+    broker.configure(
+        app.config["CHANGE_FEED_HISTORY"], app.config["CHANGE_FEED_QUEUE_SIZE"], app.config["CHANGE_FEED_MAX_STREAMS"]
+    )
+    metrics.register_gauge("change_feed.subscribers", lambda: broker.subscriber_count)
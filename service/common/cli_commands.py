@@ -1,8 +1,13 @@
 """
 Flask CLI Command Extensions
 """
+import click
+
 from service import app
-from service.models import db
+from service.common import archive, expiry, outbox, partitioning, sharding, snapshot
+from service.models import (
+    db, add_columns, create_tables, drop_tables, migrate_money, ArchivedShopcart, IdBlock, Item, ItemStat, Shopcart
+)
 
 
 ######################################################################
@@ -16,6 +21,263 @@ def db_create():
     Recreates a local database. You probably should not use this on
     production. ;-)
     """
-    db.drop_all()
-    db.create_all()
+    drop_tables()
+    create_tables(app.config["ITEM_PARTITIONS"])
     db.session.commit()
+
+
+######################################################################
+# Commands to export the shopcarts and items to a snapshot and to load it
+# Usage:
+#   flask db-export [--path snapshot] [--chunk-size 10000]
+#   flask db-import [--path snapshot] [--replace] [--chunk-size 10000]
+######################################################################
+@app.cli.command("db-export")
+@click.option("--path", default="snapshot", help="Directory of the snapshot files")
+@click.option("--chunk-size", type=click.IntRange(min=1), default=10000, help="Rows read at a time without COPY")
+def db_export(path, chunk_size):
+    """
+    Writes the shopcart and item tables of every shard to gzip compressed
+    CSV files, with COPY on PostgreSQL.
+    """
+    progress = snapshot.export_snapshot(sharding.engines(db.engines), db.metadata, path, click.echo, chunk_size)
+    click.echo(progress.summary(snapshot.snapshot_size(path)))
+
+
+@app.cli.command("db-import")
+@click.option("--path", default="snapshot", help="Directory of the snapshot files")
+@click.option("--replace", is_flag=True, help="Delete the shopcarts and items already there first")
+@click.option("--chunk-size", type=click.IntRange(min=1), default=10000, help="Rows written at a time without COPY")
+def db_import(path, replace, chunk_size):
+    """
+    Loads a snapshot written by db-export into empty shopcart and item
+    tables, or over them with --replace, with COPY on a PostgreSQL database
+    without shards. Stop the workers first.
+    """
+    try:
+        progress = snapshot.import_snapshot(
+            sharding.engines(db.engines), sharding.router.shard_of, db.metadata, path, click.echo, replace, chunk_size
+        )
+    except ValueError as error:
+        raise click.ClickException(str(error)) from error
+    if sharding.router.sharded:
+        # the next id blocks start after the ids loaded
+        db.session.query(IdBlock).delete()
+        db.session.commit()
+    if ItemStat.enabled:
+        for shard in sharding.router.shards():
+            with sharding.on_shard(shard):
+                ItemStat.rebuild()
+    click.echo(progress.summary(snapshot.snapshot_size(path)))
+
+
+######################################################################
+# Command to publish the outbox from a dedicated process
+# Usage:
+#   flask outbox-publish --sink file:///var/log/shopcarts/events.jsonl
+######################################################################
+@app.cli.command("outbox-publish")
+@click.option("--sink", default=lambda: app.config["OUTBOX_SINK"], help="file:// or unix:// URL of the sink")
+@click.option("--once", is_flag=True, help="Publish the pending events and exit")
+def outbox_publish(sink, once):
+    """
+    Drains the outbox to the sink in batches, until interrupted or, with
+    --once, until it is empty.
+    """
+    if not sink:
+        raise click.UsageError("Set --sink or OUTBOX_SINK")
+    publisher = outbox.OutboxPublisher(
+        app, outbox.make_sink(sink), app.config["OUTBOX_BATCH_SIZE"], app.config["OUTBOX_POLL_SECONDS"]
+    )
+    if once:
+        click.echo(f"Published {publisher.drain()} events")
+        return
+    try:
+        publisher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+######################################################################
+# Command to verify or repair the shopcart totals
+# Usage:
+#   flask recompute-totals [--fix]
+######################################################################
+@app.cli.command("recompute-totals")
+@click.option("--fix", is_flag=True, help="Overwrite the totals that differ")
+def recompute_totals(fix):
+    """
+    Compares the item_count, total_quantity and total_price of every
+    shopcart with its items, and exits with 1 when some differ unless they
+    were fixed.
+    """
+    drifted = []
+    for shard in sharding.router.shards():
+        with sharding.on_shard(shard):
+            drifted += Shopcart.recompute_totals(fix=fix)
+    click.echo(f"{len(drifted)} shopcarts with wrong totals{' fixed' if fix else ''}: {drifted}")
+    if drifted and not fix:
+        raise SystemExit(1)
+
+
+######################################################################
+# Command to recompute the item statistics after a backfill
+# Usage:
+#   flask rebuild-item-stats
+######################################################################
+@app.cli.command("rebuild-item-stats")
+def rebuild_item_stats():
+    """
+    Recomputes the statistics of every item name from the items, after
+    items were loaded in bulk or while the statistics were disabled.
+    """
+    names = 0
+    for shard in sharding.router.shards():
+        with sharding.on_shard(shard):
+            names += ItemStat.rebuild()
+    click.echo(f"Rebuilt the statistics of {names} item names")
+
+
+######################################################################
+# Command to delete the expired shopcarts
+# Usage:
+#   flask sweep-expired [--ttl 2592000] [--empty-ttl 86400]
+######################################################################
+@app.cli.command("sweep-expired")
+@click.option("--ttl", type=float, default=lambda: app.config["SHOPCART_TTL_SECONDS"],
+              help="Seconds a shopcart lives after its last change")
+@click.option("--empty-ttl", type=float, default=lambda: app.config["SHOPCART_EMPTY_TTL_SECONDS"],
+              help="Seconds an empty shopcart lives after its last change")
+def sweep_expired(ttl, empty_ttl):
+    """
+    Deletes the shopcarts past their time to live, in chunks of
+    SHOPCART_SWEEP_CHUNK shopcarts, until none is left.
+    """
+    if not (ttl or empty_ttl):
+        raise click.UsageError("Set --ttl, --empty-ttl, SHOPCART_TTL_SECONDS or SHOPCART_EMPTY_TTL_SECONDS")
+    sweeper = expiry.ExpirySweeper(app, ttl, empty_ttl, app.config["SHOPCART_SWEEP_CHUNK"])
+    click.echo(f"Deleted {sweeper.sweep()} expired shopcarts")
+
+
+######################################################################
+# Commands to move the stale shopcarts to the archive and back
+# Usage:
+#   flask archive-stale [--age 7776000]
+#   flask restore-shopcart <shopcart_id>
+######################################################################
+@app.cli.command("archive-stale")
+@click.option("--age", type=float, default=lambda: app.config["ARCHIVE_AFTER_SECONDS"],
+              help="Seconds after its last change a shopcart is archived")
+def archive_stale(age):
+    """
+    Moves the shopcarts unchanged for longer than the age to the archive,
+    in batches of ARCHIVE_BATCH_SIZE shopcarts, until none is left.
+    """
+    if not age:
+        raise click.UsageError("Set --age or ARCHIVE_AFTER_SECONDS")
+    archiver = archive.ArchiveSweeper(app, age, app.config["ARCHIVE_BATCH_SIZE"])
+    click.echo(f"Archived {archiver.sweep()} shopcarts")
+
+
+@app.cli.command("restore-shopcart")
+@click.argument("shopcart_id", type=int)
+def restore_shopcart(shopcart_id):
+    """
+    Moves an archived shopcart back to the hot tables.
+    """
+    sharding.route_to(shopcart_id)
+    if Shopcart.get_by_id(shopcart_id):
+        raise click.ClickException(f"A shopcart with id {shopcart_id} already exists")
+    if not ArchivedShopcart.restore(shopcart_id):
+        raise click.ClickException(f"Shopcart {shopcart_id} is not archived")
+    click.echo(f"Restored shopcart {shopcart_id}")
+
+
+######################################################################
+# Command to hash partition the item table of a PostgreSQL database
+# Usage:
+#   flask partition-items [--partitions 16]
+######################################################################
+@app.cli.command("partition-items")
+@click.option("--partitions", type=click.IntRange(min=1), default=lambda: app.config["ITEM_PARTITIONS"] or None,
+              help="Number of hash partitions")
+def partition_items(partitions):
+    """
+    Moves the items of an unpartitioned item table to a table hash
+    partitioned on shopcart_id. The items cannot be written until it is done.
+    """
+    if not partitions:
+        raise click.UsageError("Set --partitions or ITEM_PARTITIONS")
+    engines = sharding.engines(db.engines)
+    if any(engine.dialect.name != "postgresql" for engine in engines):
+        raise click.ClickException("Only PostgreSQL tables can be partitioned")
+    moved = 0
+    for engine in engines:
+        with engine.begin() as connection:
+            try:
+                moved += partitioning.migrate_to_partitioned(connection, Item.__table__, partitions)
+            except ValueError as error:
+                raise click.ClickException(str(error)) from error
+    click.echo(f"Moved {moved} items to {partitions} partitions")
+
+
+######################################################################
+# Command to move the float money columns of an older database to cents
+# Usage:
+#   flask migrate-money
+######################################################################
+@app.cli.command("migrate-money")
+def migrate_money_columns():
+    """
+    Replaces the float price and total columns of every shard with whole
+    cents columns, rounding each amount to the cent, in one transaction per
+    shard. Run it before starting the workers of this version.
+    """
+    moved = []
+    for engine in sharding.engines(db.engines):
+        with engine.begin() as connection:
+            moved += migrate_money(connection)
+    click.echo(f"Moved {len(moved)} money columns to cents" + (f": {', '.join(moved)}" if moved else ""))
+
+
+######################################################################
+# Command to add the columns of this version to an older database
+# Usage:
+#   flask add-columns
+######################################################################
+@app.cli.command("add-columns")
+def add_missing_columns():
+    """
+    Adds the columns of the models missing from the tables of every shard,
+    filling them in for the existing rows, in one transaction per shard.
+    Run it after migrate-money and before starting the workers of this
+    version. Running it again changes nothing.
+    """
+    added = []
+    for engine in sharding.engines(db.engines):
+        with engine.begin() as connection:
+            added += add_columns(connection)
+    click.echo(f"Added {len(added)} columns" + (f": {', '.join(added)}" if added else ""))
+
+
+######################################################################
+# Command to move the shopcarts to their shard after adding shards
+# Usage:
+#   flask rebalance-shards [--batch-size 100]
+######################################################################
+@app.cli.command("rebalance-shards")
+@click.option("--batch-size", type=click.IntRange(min=1), default=100, help="Shopcarts moved per transaction")
+def rebalance_shards(batch_size):
+    """
+    Moves every shopcart, with its items and archived copy, that is not on
+    the shard of its id to that shard. Run it once every worker uses the
+    new DATABASE_SHARD_URIS; it can be interrupted and run again.
+    """
+    moved = 0
+    for shard in sharding.router.shards():
+        while True:
+            count = Shopcart.move_misplaced(shard, batch_size)
+            moved += count
+            if not count:
+                break
+    click.echo(f"Moved {moved} shopcarts across {sharding.router.count} shards")
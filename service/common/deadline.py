@@ -0,0 +1,138 @@
+"""
+Request Deadlines
+
+The gateway stops waiting for a response after a while, and the work done
+after that is wasted. A request carrying X-Request-Deadline (the Unix time in
+seconds after which nobody reads the response) or X-Request-Timeout (the
+seconds it may take) gets 504_GATEWAY_TIMEOUT as soon as that budget is spent:
+on arrival, before each database statement, and while the list endpoints
+serialize their results or a batch runs its operations. PostgreSQL
+transactions also get the remaining budget as their statement_timeout, so
+a query still running at the deadline is cancelled by the database.
+
+REQUEST_TIMEOUT_SECONDS gives the requests without either header a budget.
+The statements run within suspended(), which clean up after a request or
+make its committed work durable, run whatever the deadline.
+"""
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from werkzeug.exceptions import BadRequest, GatewayTimeout
+
+from service.common import metrics
+
+DEADLINE_HEADER = "X-Request-Deadline"
+TIMEOUT_HEADER = "X-Request-Timeout"
+EXEMPT_PATHS = ("/health", "/metrics")
+QUERY_CANCELED = "57014"  # PostgreSQL SQLSTATE of a statement_timeout
+
+
+class DeadlineExceeded(GatewayTimeout):
+    """ The deadline of the request has passed """
+
+    description = "The request deadline has passed."
+
+
+def remaining():
+    """ Seconds left before the deadline of the current request, or None without one """
+    if not has_request_context():
+        return None
+    deadline = g.get("deadline")
+    return None if deadline is None else deadline - time.monotonic()
+
+
+@contextmanager
+def suspended():
+    """ Run the block without deadline checks nor statement_timeout, for work that must not be cut short """
+    if not has_request_context():
+        yield
+        return
+    g.deadline_suspended = g.get("deadline_suspended", 0) + 1
+    try:
+        yield
+    finally:
+        g.deadline_suspended -= 1
+
+
+def _suspended() -> bool:
+    """ True within suspended() """
+    return has_request_context() and g.get("deadline_suspended", 0) > 0
+
+
+def check():
+    """ Abort the current request once its deadline has passed """
+    if _suspended():
+        return
+    left = remaining()
+    if left is not None and left <= 0:
+        g.deadline_exceeded = True
+        raise DeadlineExceeded()
+
+
+def checked(iterable):
+    """ Iterate, aborting the request as soon as its deadline passes """
+    for value in iterable:
+        check()
+        yield value
+
+
+def parse_deadline(headers, default_timeout: float):
+    """ The monotonic deadline of a request from its headers, or None """
+    now = time.monotonic()
+    try:
+        if headers.get(DEADLINE_HEADER):
+            return now + float(headers[DEADLINE_HEADER]) - time.time()
+        if headers.get(TIMEOUT_HEADER):
+            return now + float(headers[TIMEOUT_HEADER])
+    except ValueError as error:
+        raise BadRequest(f"{DEADLINE_HEADER} and {TIMEOUT_HEADER} must be numbers of seconds.") from error
+    return now + default_timeout if default_timeout else None
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _check_before_statement(*_args):
+    check()
+
+
+@event.listens_for(Engine, "handle_error")
+def _statement_timed_out(context):
+    """ Report a statement cancelled by its statement_timeout as the deadline passing """
+    if getattr(context.original_exception, "pgcode", None) == QUERY_CANCELED and remaining() is not None:
+        g.deadline_exceeded = True
+        return DeadlineExceeded()
+    return None
+
+
+@event.listens_for(Session, "after_begin")
+def _limit_statements(_session, _transaction, connection):
+    """ Give a PostgreSQL transaction the remaining budget as its statement_timeout """
+    left = remaining()
+    if left is not None and not _suspended() and connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {max(1, int(left * 1000))}")
+
+
+def init_deadline(app):
+    """ Track the deadline of every request and count the requests cut short """
+
+    @app.before_request
+    def start_deadline():  # pylint: disable=unused-variable
+        """ Compute the deadline of the request and refuse it when already passed """
+        g.deadline = None
+        g.deadline_exceeded = False
+        if request.path in EXEMPT_PATHS:
+            return
+        g.deadline = parse_deadline(request.headers, app.config["REQUEST_TIMEOUT_SECONDS"])
+        if g.deadline is not None and g.deadline <= time.monotonic():
+            metrics.increment("deadline.expired_on_arrival")
+        check()
+
+    @app.after_request
+    def count_deadline(response):  # pylint: disable=unused-variable
+        """ Count the requests answered early because of their deadline """
+        if g.pop("deadline_exceeded", False):
+            metrics.increment("deadline.exceeded")
+        return response
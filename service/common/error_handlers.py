@@ -80,6 +80,18 @@ def mediatype_not_supported(error):
            }, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
 
 
+@app.errorhandler(status.HTTP_429_TOO_MANY_REQUESTS)
+def too_many_requests(error):
+    """Handles rate limited requests with 429_TOO_MANY_REQUESTS"""
+    message = str(error)
+    app.logger.warning(message)
+    return {
+               "status_code": status.HTTP_429_TOO_MANY_REQUESTS,
+               "error": "Too Many Requests",
+               "message": message,
+           }, status.HTTP_429_TOO_MANY_REQUESTS, _retry_after(error)
+
+
 @app.errorhandler(status.HTTP_500_INTERNAL_SERVER_ERROR)
 def internal_server_error(error):
     """Handles unexpected server error with 500_SERVER_ERROR"""
@@ -90,3 +102,33 @@ def internal_server_error(error):
                "error": "Internal Server Error",
                "message": message,
            }, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
+@app.errorhandler(status.HTTP_503_SERVICE_UNAVAILABLE)
+def service_unavailable(error):
+    """Handles shed requests with 503_SERVICE_UNAVAILABLE"""
+    message = str(error)
+    app.logger.warning(message)
+    return {
+               "status_code": status.HTTP_503_SERVICE_UNAVAILABLE,
+               "error": "Service Unavailable",
+               "message": message,
+           }, status.HTTP_503_SERVICE_UNAVAILABLE, _retry_after(error)
+
+
+@app.errorhandler(status.HTTP_504_GATEWAY_TIMEOUT)
+def gateway_timeout(error):
+    """Handles requests past their deadline with 504_GATEWAY_TIMEOUT"""
+    message = str(error)
+    app.logger.warning(message)
+    return {
+               "status_code": status.HTTP_504_GATEWAY_TIMEOUT,
+               "error": "Gateway Timeout",
+               "message": message,
+           }, status.HTTP_504_GATEWAY_TIMEOUT
+
+
+def _retry_after(error):
+    """Carries the Retry-After header of the error over to the response"""
+    retry_after = getattr(error, "retry_after", None)
+    return {"Retry-After": str(retry_after)} if retry_after is not None else {}
@@ -0,0 +1,116 @@
+"""
+Shopcart Expiry
+
+Abandoned shopcarts are deleted once they were left unchanged for longer
+than SHOPCART_TTL_SECONDS, or SHOPCART_EMPTY_TTL_SECONDS for the shopcarts
+without items, so the tables and their full scans stop growing. Each
+deleted shopcart sends an "expired" change event.
+
+The sweeper deletes SHOPCART_SWEEP_CHUNK shopcarts at a time, each chunk in
+a transaction of its own that claims its shopcarts with FOR UPDATE SKIP
+LOCKED, so it never waits on nor blocks the requests for long and several
+sweepers can run at once. It runs in a thread of each worker every
+SHOPCART_SWEEP_SECONDS when set, or in its own process with
+`flask sweep-expired`.
+"""
+import atexit
+import logging
+import threading
+from abc import abstractmethod
+
+from service.common import metrics, sharding
+from service.models import db, Shopcart
+
+logger = logging.getLogger("service")
+
+FAILURE_BACKOFF_SECONDS = 5.0
+
+
+class ChunkedSweeper(threading.Thread):
+    """ Processes stale shopcarts a chunk at a time, each chunk in its own transaction """
+
+    # prefix of the metrics, and the counter of the shopcarts processed
+    metric = "sweeper"
+    counter = "processed"
+
+    def __init__(self, app, chunk_size: int = 100, poll_seconds: float = 60.0):
+        super().__init__(name=f"{self.metric}-sweeper", daemon=True)
+        self.app = app
+        self.chunk_size = chunk_size
+        self.poll_seconds = poll_seconds
+        self._stopped = threading.Event()
+
+    @abstractmethod
+    def process_chunk(self) -> int:
+        """ Process the next chunk in the app context and return the number of shopcarts processed """
+
+    def sweep_chunk(self, shard: int = 0) -> int:
+        """ Process the next chunk of shopcarts of a shard """
+        with self.app.app_context(), sharding.on_shard(shard):
+            try:
+                count = self.process_chunk()
+            finally:
+                db.session.remove()
+        if count:
+            metrics.increment(f"{self.metric}.{self.counter}", count)
+            metrics.increment(f"{self.metric}.chunks")
+        return count
+
+    def sweep(self) -> int:
+        """ Process chunks until no shopcart is left on any shard """
+        total = 0
+        for shard in sharding.router.shards():
+            while not self._stopped.is_set():
+                count = self.sweep_chunk(shard)
+                total += count
+                if count < self.chunk_size:
+                    break
+        return total
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.sweep()
+            except Exception as error:  # pylint: disable=broad-except
+                metrics.increment(f"{self.metric}.failed")
+                logger.warning("Shopcart %s sweep failed: %s", self.metric, error)
+                self._stopped.wait(FAILURE_BACKOFF_SECONDS)
+                continue
+            self._stopped.wait(self.poll_seconds)
+
+    def stop(self):
+        """ Finish the current chunk and stop """
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
+
+
+class ExpirySweeper(ChunkedSweeper):
+    """ Deletes the expired shopcarts in chunks """
+
+    metric = "expiry"
+    counter = "deleted"
+
+    def __init__(self, app, ttl: float, empty_ttl: float = 0, chunk_size: int = 100,  # pylint: disable=too-many-arguments
+                 poll_seconds: float = 60.0):
+        super().__init__(app, chunk_size, poll_seconds)
+        self.ttl = ttl
+        self.empty_ttl = empty_ttl
+
+    def process_chunk(self) -> int:
+        """ Delete the next chunk of expired shopcarts """
+        return Shopcart.sweep_expired(self.ttl, self.empty_ttl, self.chunk_size)
+
+
+def init_expiry(app):
+    """ Start the sweeper thread as configured """
+    poll_seconds = app.config["SHOPCART_SWEEP_SECONDS"]
+    if not (poll_seconds and (app.config["SHOPCART_TTL_SECONDS"] or app.config["SHOPCART_EMPTY_TTL_SECONDS"])):
+        return None
+    sweeper = ExpirySweeper(
+        app, app.config["SHOPCART_TTL_SECONDS"], app.config["SHOPCART_EMPTY_TTL_SECONDS"],
+        app.config["SHOPCART_SWEEP_CHUNK"], poll_seconds
+    )
+    sweeper.start()
+    atexit.register(sweeper.stop)
+    return sweeper
@@ -0,0 +1,191 @@
+"""
+Group Commit
+
+Every write request commits its own transaction, and under peak add to cart
+traffic the workers wait on the WAL flush of each of those commits rather
+than on the CPU. While GROUP_COMMIT_ENABLED is set the transactions commit
+without waiting for their flush, and each request waits instead for a group
+flush shared with the other writes of its worker before its response is
+sent: the first write of a group waits GROUP_COMMIT_DELAY_MS, or until
+GROUP_COMMIT_MAX_BATCH writes joined it, then makes all of them durable at
+once. A request is therefore acknowledged only once its changes are durable,
+and its transaction stays its own: a failing write never aborts another one.
+
+PostgreSQL transactions run with synchronous_commit off and the group flush
+is the commit of a transaction given a transaction id, which flushes the WAL
+up to it and with it every commit before. SQLite databases switch to WAL
+journaling with synchronous NORMAL and the group flush is a fsync of the
+WAL file.
+
+With shards, the group flush flushes every shard.
+
+Commits outside of a request, from the CLI or the outbox publisher, wait for
+their flush as soon as they are committed. The flush runs whatever the
+deadline of the request leading the group, whose writes are committed
+already, and only a failure of the flush itself fails the group.
+"""
+import logging
+import os
+import threading
+import time
+
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import Pool
+
+from service.common import deadline, metrics, sharding
+from service.models import db
+
+logger = logging.getLogger("service")
+
+# the committer of the worker, None while group commit is disabled
+committer = None  # pylint: disable=invalid-name
+
+
+class FlushFailed(Exception):
+    """ The flush that was to make a group of commits durable failed """
+
+
+class _Group:  # pylint: disable=too-few-public-methods
+    """ Commits made durable by the same flush """
+
+    def __init__(self):
+        self.size = 0
+        self.done = False
+        self.error = None
+
+
+class GroupCommitter:  # pylint: disable=too-few-public-methods
+    """ Makes the commits of concurrent writes durable in groups """
+
+    def __init__(self, flush, delay: float, max_batch: int):
+        self.flush = flush
+        self.delay = delay
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._open = _Group()
+
+    def wait_durable(self):
+        """ Return once the commits made before the call are durable """
+        with self._cond:
+            group = self._open
+            group.size += 1
+            if group.size > 1:
+                if group.size >= self.max_batch:
+                    self._cond.notify_all()
+                while not group.done:
+                    self._cond.wait()
+                if group.error is not None:
+                    raise FlushFailed(f"Group commit flush failed: {group.error}") from group.error
+                return
+            # the first write of a group waits for the others and flushes them all
+            flush_at = time.monotonic() + self.delay
+            while group.size < self.max_batch and time.monotonic() < flush_at:
+                self._cond.wait(flush_at - time.monotonic())
+            self._open = _Group()
+        try:
+            with deadline.suspended():
+                self.flush()
+        except Exception as error:  # pylint: disable=broad-except
+            logger.error("Group commit flush failed: %s", error)
+            group.error = error
+        with self._cond:
+            group.done = True
+            self._cond.notify_all()
+        metrics.increment("group_commit.flushes")
+        metrics.increment("group_commit.writes", group.size)
+        if group.error is not None:
+            raise FlushFailed(f"Group commit flush failed: {group.error}") from group.error
+
+
+def postgresql_flush(engine):
+    """ Flush the WAL by committing a transaction that has a transaction id """
+    def flush():
+        with engine.connect() as connection:
+            connection.exec_driver_sql("SELECT txid_current()")
+            connection.commit()
+    return flush
+
+
+def sqlite_flush(path: str):
+    """ Flush the WAL file of a SQLite database """
+    def flush():
+        try:
+            descriptor = os.open(f"{path}-wal", os.O_RDONLY)
+        except FileNotFoundError:
+            return  # the last connection closed, checkpointing and syncing the WAL
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+    return flush
+
+
+@event.listens_for(Session, "after_begin")
+def _commit_without_flush(_session, _transaction, connection):
+    """ Let the PostgreSQL transaction commit without waiting for the WAL flush """
+    if committer is not None and connection.dialect.name == "postgresql":
+        connection.exec_driver_sql("SET LOCAL synchronous_commit = off")
+
+
+@event.listens_for(Pool, "connect")
+def _sqlite_wal(dbapi_connection, _record):
+    """ Keep the commits of a SQLite connection in the WAL until it is flushed """
+    if committer is not None and type(dbapi_connection).__module__.startswith("sqlite3"):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.close()
+
+
+@event.listens_for(Session, "after_commit")
+def _wait_for_flush(_session):
+    """ Have the request wait for its flush before responding, or wait right away outside of one """
+    if committer is None:
+        return
+    if has_request_context():
+        g.commit_pending = True
+    else:
+        committer.wait_durable()
+
+
+def init_group_commit(app):
+    """ Commit the writes of the worker in groups when enabled """
+    global committer  # pylint: disable=global-statement, invalid-name
+
+    @app.after_request
+    def wait_for_flush(response):  # pylint: disable=unused-variable
+        """ Answer a request that committed only once its commits are durable """
+        if g.pop("commit_pending", False) and committer is not None:
+            committer.wait_durable()
+        return response
+
+    committer = None
+    if not app.config["GROUP_COMMIT_ENABLED"]:
+        return None
+    flushes = []
+    with app.app_context():
+        shard_engines = sharding.engines(db.engines)
+    for engine in shard_engines:
+        if engine.dialect.name == "postgresql":
+            flushes.append(postgresql_flush(engine))
+        elif engine.dialect.name == "sqlite" and engine.url.database not in (None, "", ":memory:"):
+            flushes.append(sqlite_flush(engine.url.database))
+        else:
+            app.logger.warning("Group commit is not supported on %s databases", engine.dialect.name)
+            return None
+
+    def flush():
+        for shard_flush in flushes:
+            shard_flush()
+
+    committer = GroupCommitter(
+        flush, app.config["GROUP_COMMIT_DELAY_MS"] / 1000, app.config["GROUP_COMMIT_MAX_BATCH"]
+    )
+    # reopen the connections so they get the settings of the committer
+    with app.app_context():
+        for pooled in db.engines.values():
+            pooled.dispose()
+
+    return committer
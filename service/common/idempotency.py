@@ -0,0 +1,120 @@
+"""
+Idempotency Keys
+
+POST endpoints decorated with @idempotent store the first response sent for
+an Idempotency-Key header and replay it on retries of the same request,
+without deserializing or creating anything again.
+
+Concurrent duplicates wait for the first request to finish and replay its
+response, or get 409_CONFLICT if it takes longer than IDEMPOTENCY_WAIT_SECONDS.
+Reusing a key for a different request gets 422_UNPROCESSABLE_ENTITY.
+
+A request that fails releases its key so that a retry executes it, unless it
+had already committed: its key then stays claimed, since executing the retry
+would repeat the committed writes.
+"""
+import functools
+import hashlib
+import json
+import time
+
+from flask import abort, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from service.common import deadline, metrics, status
+from service.models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+POLL_SECONDS = 0.05
+PURGE_EVERY_SECONDS = 60
+
+_last_purge = [0.0]
+
+
+@event.listens_for(Session, "after_commit")
+def _count_commit(_session):
+    """ Count the commits of the request, to tell whether a failed request had committed """
+    if has_request_context():
+        g.idempotency_commits = g.get("idempotency_commits", 0) + 1
+
+
+def request_fingerprint() -> str:
+    """ Identify the request a key was first used for """
+    digest = hashlib.sha256(request.get_data()).hexdigest()
+    return f"{request.method} {request.path} {digest}"
+
+
+def _purge_expired_keys():
+    """ Delete expired keys at most once a minute per worker """
+    now = time.time()
+    if now - _last_purge[0] > PURGE_EVERY_SECONDS:
+        _last_purge[0] = now
+        IdempotencyKey.purge_expired()
+
+
+def _wait_for(key, give_up_at):
+    """ Wait until the request holding the key has stored its response """
+    record = IdempotencyKey.find(key)
+    while record is not None and record.status_code is None and time.monotonic() < give_up_at:
+        time.sleep(POLL_SECONDS)
+        record = IdempotencyKey.find(key)
+    return record
+
+
+def _replay(record):
+    """ The stored response of a key """
+    metrics.increment("idempotency.replayed")
+    return json.loads(record.body), record.status_code, {REPLAYED_HEADER: "true"}
+
+
+def idempotent(function):
+    """ Store and replay the response of requests sent with an Idempotency-Key """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return function(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            abort(status.HTTP_400_BAD_REQUEST, f"{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters.")
+
+        config = current_app.config
+        fingerprint = request_fingerprint()
+        _purge_expired_keys()
+        record = IdempotencyKey.claim(
+            key, fingerprint, config["IDEMPOTENCY_TTL_SECONDS"], config["IDEMPOTENCY_LOCK_SECONDS"]
+        )
+        if record is not None:
+            if record.fingerprint != fingerprint:
+                abort(status.HTTP_422_UNPROCESSABLE_ENTITY,
+                      f"{IDEMPOTENCY_HEADER} '{key}' was already used for a different request.")
+            if record.status_code is None:
+                record = _wait_for(key, time.monotonic() + config["IDEMPOTENCY_WAIT_SECONDS"])
+            if record is None or record.status_code is None:
+                abort(status.HTTP_409_CONFLICT,
+                      f"A request with {IDEMPOTENCY_HEADER} '{key}' is still in progress.")
+            return _replay(record)
+
+        return _execute(key, function, *args, **kwargs)
+
+    return wrapper
+
+
+def _execute(key, function, *args, **kwargs):
+    """ Execute the request holding the key and store its response """
+    commits = g.get("idempotency_commits", 0)
+    try:
+        body, code = function(*args, **kwargs)[:2]
+    except Exception:
+        if g.get("idempotency_commits", 0) == commits:
+            IdempotencyKey.release(key)
+        else:
+            current_app.logger.warning("Keeping %s '%s' of a request that failed after committing",
+                                       IDEMPOTENCY_HEADER, key)
+        raise
+    with deadline.suspended():
+        IdempotencyKey.complete(key, code, json.dumps(body))
+    return body, code
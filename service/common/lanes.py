@@ -0,0 +1,142 @@
+"""
+Worker Lanes
+
+Interactive requests (cart reads, item adds) and bulk requests (the full
+shopcart listing and batches) share the threads of a worker but not their
+limits: each lane admits its own number of requests at once, and the
+requests past it get 503_SERVICE_UNAVAILABLE with a Retry-After header, so
+a few heavy requests never hold every thread of a worker.
+
+The bulk lane also runs its requests on an engine of its own, pointing at
+the same database with a connection pool sized for that lane, so the
+interactive requests never wait for a connection a bulk request holds. An
+in-memory SQLite database cannot be shared by two engines and keeps one.
+
+Routes are classified by endpoint in ROUTES; the ones missing from it are
+interactive, and the health check, metrics, documentation and change feed
+streams are in no lane.
+"""
+import threading
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy.pool import QueuePool
+from werkzeug.exceptions import ServiceUnavailable
+
+from service.common import metrics
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+ENVIRON_KEY = "service.lane"
+UNLANED_ENDPOINTS = (
+    "health", "get_metrics", "static", "specs", "doc", "root", "restx_doc.static",
+    "shopcart_events_resource", "shopcart_changes_resource",
+)
+
+
+def _listing_lane(args):
+    """ Listing every shopcart is bulk work, a page or a name lookup is not """
+    return BULK if args.get("limit") is None and not args.get("name") else INTERACTIVE
+
+
+# endpoint -> method -> lane, or a function of the query arguments returning it
+ROUTES = {
+    "shopcart_collection": {"GET": _listing_lane},
+    "batch_resource": {"POST": BULK},
+}
+
+
+def classify(endpoint, method, args):
+    """ The lane of a request, or None when it is in no lane """
+    if endpoint is None or endpoint in UNLANED_ENDPOINTS:
+        return None
+    lane = ROUTES.get(endpoint, {}).get(method, INTERACTIVE)
+    return lane(args) if callable(lane) else lane
+
+
+class Lane:
+    """ Requests of one kind a worker serves at once """
+
+    def __init__(self, name, max_in_flight):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def enter(self):
+        """ Take a slot of the lane or abort with 503 when it is full """
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                metrics.increment(f"lanes.{self.name}.rejected")
+                raise ServiceUnavailable(f"Too many {self.name} requests in flight, try again later.",
+                                         retry_after=1)
+            self.in_flight += 1
+
+    def leave(self):
+        """ Release the slot of the lane """
+        with self._lock:
+            self.in_flight -= 1
+
+
+class LaneSession(Session):  # pylint: disable=too-many-ancestors, too-few-public-methods
+    """ Session running the statements of bulk requests on the bulk engine """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context() and g.get("lane") == BULK and BULK in self._db.engines:
+            return self._db.engines[BULK]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class LaneControl:
+    """ Puts every request in its lane """
+
+    def __init__(self, config):
+        bulk = int(config.get("LANE_BULK_MAX_IN_FLIGHT", 2))
+        self.lanes = {INTERACTIVE: Lane(INTERACTIVE, int(config.get("LANE_INTERACTIVE_MAX_IN_FLIGHT", 0)))}
+        if bulk:
+            self.lanes[BULK] = Lane(BULK, bulk)
+
+    def enter(self):
+        """ Admit the current request to its lane """
+        lane = classify(request.endpoint, request.method, request.args)
+        if lane is None:
+            return
+        lane = lane if lane in self.lanes else INTERACTIVE
+        self.lanes[lane].enter()
+        # the operations of a batch run in requests of their own, which must not release the slot
+        request.environ[ENVIRON_KEY] = g.lane = lane
+
+    def leave(self):
+        """ Release the lane slot of an admitted request """
+        lane = request.environ.pop(ENVIRON_KEY, None)
+        if lane is not None:
+            g.pop("lane", None)
+            if lane in self.lanes:
+                self.lanes[lane].leave()
+
+
+def init_lanes(app):
+    """ Put every request in its lane and give the bulk lane its own connection pool """
+    control = LaneControl(app.config)
+    uri = app.config.get("SQLALCHEMY_DATABASE_URI", "")
+    if BULK in control.lanes and ":memory:" not in uri:
+        # the bind does not inherit SQLALCHEMY_ENGINE_OPTIONS; a plain QueuePool keeps
+        # the bulk checkout waits out of the pool wait the admission control sheds on
+        options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}), url=uri, poolclass=QueuePool,
+                       pool_size=app.config.get("LANE_BULK_DB_POOL_SIZE", 2), max_overflow=0)
+        app.config.setdefault("SQLALCHEMY_BINDS", {}).setdefault(BULK, options)
+    app.extensions["lanes"] = control
+    for name in control.lanes:
+        metrics.register_gauge(f"lanes.{name}.in_flight",
+                               lambda name=name: getattr(app.extensions["lanes"].lanes.get(name), "in_flight", 0))
+
+    @app.before_request
+    def enter_lane():  # pylint: disable=unused-variable
+        """ Take a slot of the lane of the request before any work is done """
+        g.lane = None
+        app.extensions["lanes"].enter()
+
+    @app.teardown_request
+    def leave_lane(_error):  # pylint: disable=unused-variable
+        """ Free the lane slot whatever the outcome """
+        app.extensions["lanes"].leave()
@@ -20,17 +20,110 @@ Log Handlers
 This module contains utility functions to set up logging
 consistently
 """
+import atexit
+import json
 import logging
+import queue
+import random
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+
+REQUEST_ID_HEADER = "X-Request-ID"
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] [%(module)s] [%(request_id)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats log records as one JSON object per line"""
+
+    # attributes every LogRecord has, anything else was passed with extra=
+    RESERVED = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, DATE_FORMAT),
+            "level": record.levelname,
+            "module": record.module,
+            "request_id": getattr(record, "request_id", None),
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self.RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Formats log records as a single line of text"""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT, DATE_FORMAT)
+
+    def format(self, record):
+        # records from gunicorn's own loggers never went through the app filter
+        record.__dict__.setdefault("request_id", "-")
+        return super().format(record)
+
+
+class RequestContextFilter(logging.Filter):
+    """Tags records with the request id and drops unsampled info logs"""
+
+    def filter(self, record):
+        if not has_request_context():
+            record.request_id = None
+            return True
+        record.request_id = g.get("request_id")
+        return record.levelno > logging.INFO or g.get("log_sampled", True)
+
+
+class BackgroundListener(QueueListener):
+    """Writes queued records to the real handlers on a background thread"""
+
+    def stop(self):
+        """Flush the queue and stop the thread, safe to call more than once"""
+        if self._thread is not None:
+            super().stop()
 
 
 def init_logging(app, logger_name: str):
     """Set up logging for production"""
     app.logger.propagate = False
     gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
     app.logger.setLevel(gunicorn_logger.level)
     # Make all log formats consistent
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
-    for handler in app.logger.handlers:
+    if app.config.get("LOG_FORMAT", "json") == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = TextFormatter()
+    for handler in gunicorn_logger.handlers:
         handler.setFormatter(formatter)
+
+    # Records are handed to a background thread so a request never waits on log I/O
+    log_queue = queue.SimpleQueue()
+    listener = BackgroundListener(log_queue, *gunicorn_logger.handlers, respect_handler_level=True)
+    app.logger.handlers = [QueueHandler(log_queue)] if gunicorn_logger.handlers else []
+    app.logger.filters = [RequestContextFilter()]
+    listener.start()
+    atexit.register(listener.stop)
+
+    sample_rate = float(app.config.get("LOG_SAMPLE_RATE", 1.0))
+
+    @app.before_request
+    def tag_request():  # pylint: disable=unused-variable
+        """Assign the request id and decide whether its info logs are kept"""
+        g.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+        g.log_sampled = sample_rate >= 1.0 or random.random() < sample_rate
+
+    @app.after_request
+    def echo_request_id(response):  # pylint: disable=unused-variable
+        """Return the request id so clients can correlate their logs"""
+        if g.get("request_id"):
+            response.headers[REQUEST_ID_HEADER] = g.request_id
+        return response
+
     app.logger.info("Logging handler established")
+    return listener
@@ -0,0 +1,51 @@
+"""
+Service Metrics
+
+Process local counters and gauges reported by GET /metrics. Every gunicorn
+worker keeps its own values.
+"""
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+
+
+def increment(name: str, amount=1):
+    """ Add to a counter """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def counter(name: str):
+    """ The current value of a counter """
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def set_gauge(name: str, value):
+    """ Record the current value of a gauge """
+    _gauges[name] = value
+
+
+def register_gauge(name: str, function):
+    """ Register a gauge whose value is computed when the metrics are read """
+    _gauges[name] = function
+
+
+def snapshot() -> dict:
+    """ The current value of every counter and gauge """
+    with _lock:
+        values = dict(_counters)
+    for name, gauge in list(_gauges.items()):
+        values[name] = gauge() if callable(gauge) else gauge
+    return values
+
+
+def reset():
+    """ Clear the counters and the plain gauges """
+    with _lock:
+        _counters.clear()
+        for name, gauge in list(_gauges.items()):
+            if not callable(gauge):
+                del _gauges[name]
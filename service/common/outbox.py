@@ -0,0 +1,167 @@
+"""
+Transactional Outbox
+
+While OUTBOX_ENABLED is set, every cart and item change writes an OutboxEvent
+row in the transaction of the change, so an event exists if and only if the
+change was committed. A publisher drains the outbox in batches to a sink and
+deletes the rows the sink accepted: delivery is at least once, and consumers
+use the outbox_id and the cart version of the events to drop duplicates. With
+shards, every shard has its outbox, and its events carry their shard number.
+
+The publisher runs in a thread of each worker when OUTBOX_SINK is set, or in
+its own process with `flask outbox-publish`. Publishers lock the rows they
+send, so several of them can drain the same outbox.
+
+Sinks are selected by URL:
+    file:///var/log/shopcarts/events.jsonl  appends JSON lines to a file
+    unix:///run/shopcarts/events.sock       writes JSON lines to a local socket
+"""
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+from service.common import metrics, sharding
+from service.models import db, OutboxEvent
+
+logger = logging.getLogger("service")
+
+FAILURE_BACKOFF_SECONDS = 5.0
+
+
+def encode(messages) -> bytes:
+    """ Encode the messages of a batch as JSON lines """
+    return "".join(json.dumps(message) + "\n" for message in messages).encode("utf-8")
+
+
+class FileSink:
+    """ Appends the events to a file """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def send(self, messages):
+        """ Write a batch and make it durable before it is deleted from the outbox """
+        with open(self.path, "ab") as sink:
+            sink.write(encode(messages))
+            sink.flush()
+            os.fsync(sink.fileno())
+
+
+class SocketSink:
+    """ Writes the events to a local stream socket """
+
+    def __init__(self, path: str, timeout: float = 5.0):
+        self.path = path
+        self.timeout = timeout
+        self._socket = None
+
+    def send(self, messages):
+        """ Write a batch, reconnecting after a failure """
+        try:
+            if self._socket is None:
+                self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._socket.settimeout(self.timeout)
+                self._socket.connect(self.path)
+            self._socket.sendall(encode(messages))
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        """ Drop the connection """
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+def make_sink(url: str):
+    """ Build the sink of a file:// or unix:// URL """
+    parsed = urlparse(url)
+    if parsed.scheme == "file":
+        return FileSink(parsed.path)
+    if parsed.scheme == "unix":
+        return SocketSink(parsed.path)
+    raise ValueError(f"Unsupported outbox sink: {url}")
+
+
+class OutboxPublisher(threading.Thread):
+    """ Drains the outbox to a sink in batches """
+
+    def __init__(self, app, sink, batch_size: int = 100, poll_seconds: float = 1.0):
+        super().__init__(name="outbox-publisher", daemon=True)
+        self.app = app
+        self.sink = sink
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self._stopped = threading.Event()
+        self._lags = {}  # shard: seconds its oldest pending event has waited
+
+    def publish_batch(self, shard: int = 0) -> int:
+        """ Send the oldest pending events of a shard and delete them once the sink has them """
+        with self.app.app_context(), sharding.on_shard(shard):
+            try:
+                events = OutboxEvent.next_batch(self.batch_size)
+                now = time.time()
+                self._lags[shard] = round(now - events[0].created_at, 3) if events else 0
+                metrics.set_gauge("outbox.lag_seconds", max(self._lags.values()))  # the shard most behind
+                if events:
+                    messages = [event.message() for event in events]
+                    if sharding.router.sharded:
+                        messages = [dict(message, shard=shard) for message in messages]  # outbox ids are per shard
+                    self.sink.send(messages)
+                    OutboxEvent.remove([event.id for event in events])
+                db.session.commit()
+            finally:
+                db.session.remove()
+        if events:
+            metrics.increment("outbox.published", len(events))
+            metrics.increment("outbox.batches")
+        return len(events)
+
+    def drain(self) -> int:
+        """ Publish until the outbox of every shard is empty """
+        total = 0
+        for shard in sharding.router.shards():
+            while True:
+                count = self.publish_batch(shard)
+                total += count
+                if count < self.batch_size:
+                    break
+        return total
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                count = max(self.publish_batch(shard) for shard in sharding.router.shards())
+            except Exception as error:  # pylint: disable=broad-except
+                metrics.increment("outbox.failed")
+                logger.warning("Outbox publishing failed: %s", error)
+                self._stopped.wait(FAILURE_BACKOFF_SECONDS)
+                continue
+            if count < self.batch_size:
+                self._stopped.wait(self.poll_seconds)
+
+    def stop(self):
+        """ Finish the current batch and stop """
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
+
+
+def init_outbox(app):
+    """ Write the outbox and start the publisher thread as configured """
+    OutboxEvent.enabled = app.config["OUTBOX_ENABLED"]
+    if not (OutboxEvent.enabled and app.config["OUTBOX_SINK"]):
+        return None
+    publisher = OutboxPublisher(
+        app, make_sink(app.config["OUTBOX_SINK"]),
+        app.config["OUTBOX_BATCH_SIZE"], app.config["OUTBOX_POLL_SECONDS"]
+    )
+    publisher.start()
+    atexit.register(publisher.stop)
+    return publisher
@@ -0,0 +1,109 @@
+"""
+Item Table Partitioning
+
+With ITEM_PARTITIONS set on PostgreSQL, the item table is created hash
+partitioned on shopcart_id, so the items of a cart are read from one small
+partition and its indexes, and vacuum and index maintenance work on a
+partition at a time. PostgreSQL requires the partition key in the primary
+key, which becomes (id, shopcart_id): ids stay unique through their
+sequence and the models keep addressing items by id. Other databases keep
+a plain table.
+
+`flask partition-items` moves an unpartitioned item table to the
+partitioned layout in a single transaction, during which the items can be
+read but not written.
+"""
+import logging
+
+from sqlalchemy import MetaData, PrimaryKeyConstraint, text
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+logger = logging.getLogger("service")
+
+PARTITION_KEY = "shopcart_id"
+
+
+def partitioned_table(table, partitions: int, name=None, schema=None):
+    """ A copy of the table hash partitioned on shopcart_id, with the partition key in its primary key """
+    metadata = MetaData()
+    for foreign_key in table.foreign_keys:
+        foreign_key.column.table.to_metadata(metadata, schema=schema)
+    copy = table.to_metadata(metadata, schema=schema, name=name)
+    for index in copy.indexes:
+        # a staged copy lives next to the table, whose index names it cannot share
+        index.name = index.name.replace(table.name, copy.name, 1)
+    copy.c[PARTITION_KEY].primary_key = True
+    copy.append_constraint(PrimaryKeyConstraint(copy.c.id, copy.c[PARTITION_KEY], name=f"{copy.name}_pkey"))
+    copy.c.id.autoincrement = True
+    copy.kwargs["postgresql_partition_by"] = f"HASH ({PARTITION_KEY})"
+    copy.info["partitions"] = partitions
+    return copy
+
+
+def partition_statements(table) -> list:
+    """ The statements creating a partitioned table, its partitions and its indexes """
+    partitions = table.info["partitions"]
+    prefix = f"{table.schema}." if table.schema else ""
+    partition_name = table.info.get("partition_name", table.name)
+    statements = [CreateTable(table)]
+    statements += [
+        text(f"CREATE TABLE {prefix}{partition_name}_p{remainder} PARTITION OF {table.fullname} "
+             f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})")
+        for remainder in range(partitions)
+    ]
+    statements += [CreateIndex(index) for index in sorted(table.indexes, key=lambda index: index.name)]
+    return statements
+
+
+def is_partitioned(connection, table_name: str) -> bool:
+    """ True when the table exists and is partitioned """
+    kind = connection.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"), {"name": table_name}
+    ).scalar()
+    return kind == "p"
+
+
+def create_partitioned(connection, table, partitions: int):
+    """ Create the table hash partitioned, with its partitions """
+    logger.info("Create %s with %s hash partitions", table.name, partitions)
+    for statement in partition_statements(partitioned_table(table, partitions)):
+        connection.execute(statement)
+
+
+def migrate_to_partitioned(connection, table, partitions: int) -> int:
+    """Move the rows of an unpartitioned table to a hash partitioned one replacing it
+
+    The table is locked against writes until the transaction of the connection ends.
+
+    Returns the number of rows moved
+    """
+    name = table.name
+    if is_partitioned(connection, name):
+        raise ValueError(f"The {name} table is already partitioned")
+    connection.execute(text(f"LOCK TABLE {name} IN EXCLUSIVE MODE"))
+    sequence = connection.execute(text("SELECT pg_get_serial_sequence(:name, 'id')"), {"name": name}).scalar()
+
+    staged = partitioned_table(table, partitions, name=f"{name}_partitioned")
+    staged.c.id.autoincrement = False
+    staged.info["partition_name"] = name  # the partitions are named after the table they end up in
+    for statement in partition_statements(staged):
+        connection.execute(statement)
+    if sequence:
+        # the new table takes over the sequence, so the dropped table does not drop it
+        connection.execute(text(f"ALTER TABLE {staged.name} ALTER COLUMN id SET DEFAULT nextval('{sequence}')"))
+        connection.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {staged.name}.id"))
+
+    columns = ", ".join(column.name for column in table.columns)
+    moved = connection.execute(text(f"INSERT INTO {staged.name} ({columns}) SELECT {columns} FROM {name}")).rowcount
+    connection.execute(text(f"DROP TABLE {name}"))
+    connection.execute(text(f"ALTER TABLE {staged.name} RENAME TO {name}"))
+    connection.execute(text(f"ALTER TABLE {name} RENAME CONSTRAINT {staged.name}_pkey TO {name}_pkey"))
+    for foreign_key in staged.foreign_key_constraints:
+        column = foreign_key.columns.keys()[0]
+        connection.execute(
+            text(f"ALTER TABLE {name} RENAME CONSTRAINT {staged.name}_{column}_fkey TO {name}_{column}_fkey")
+        )
+    for index in staged.indexes:
+        connection.execute(text(f"ALTER INDEX {index.name} RENAME TO {index.name.replace(staged.name, name, 1)}"))
+    logger.info("Moved %s rows of %s to %s hash partitions", moved, name, partitions)
+    return moved
@@ -0,0 +1,134 @@
+"""
+Read Replicas
+
+With DATABASE_REPLICA_URIS set, the cart and item reads (GET of a shopcart,
+of the shopcart listing, of the items of a shopcart and of an item) run on
+the replicas in turn, each on an engine of its own, while every write and
+every other request stays on the primary. Statements flushing or writing
+from a replica routed request still go to the primary.
+
+A client that wrote reads from the primary for READ_YOUR_WRITES_SECONDS
+afterwards, so it never reads a replica that has not caught up with its own
+write yet. Its writes are remembered in its Flask session cookie, which
+every worker sees, and against its client token header for the clients
+without cookies, which only the worker that served the write sees. Its
+reads do not share the result of a read that may have started before its
+write either.
+"""
+import itertools
+import threading
+import time
+
+from flask import g, has_request_context, request, session
+
+from service.common import metrics
+from service.common.lanes import LaneSession
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+SESSION_KEY = "wrote_at"
+# the endpoints whose GET may read a replica
+READ_ENDPOINTS = ("shopcart_resource", "shopcart_collection", "item_collection", "item_resource")
+
+
+def bind_key(number: int) -> str:
+    """ The SQLAlchemy bind of a replica """
+    return f"replica_{number}"
+
+
+class RoutingSession(LaneSession):  # pylint: disable=too-many-ancestors, too-few-public-methods
+    """ Session running the reads of replica routed requests on their replica """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = g.get("replica") if has_request_context() else None
+        if bind is None and replica is not None and not self._flushing and not getattr(clause, "is_dml", False):
+            return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaRouter:
+    """ Picks the database of every request """
+
+    MAX_CLIENTS = 10000
+
+    def __init__(self, binds, read_your_writes: float = 5.0, client_header: str = "X-Client-Id"):
+        self.binds = list(binds)
+        self.read_your_writes = read_your_writes
+        self.client_header = client_header
+        self._lock = threading.Lock()
+        self._turns = itertools.cycle(self.binds)
+        self._writes = {}
+
+    def next_replica(self) -> str:
+        """ The replica whose turn it is """
+        with self._lock:
+            return next(self._turns)
+
+    def client_wrote_recently(self) -> bool:
+        """ True when the client of the request wrote within the read your writes window """
+        now = time.time()
+        if session.get(SESSION_KEY, 0) > now - self.read_your_writes:
+            return True
+        client = request.headers.get(self.client_header)
+        return bool(client) and self._writes.get(client, 0) > now - self.read_your_writes
+
+    def route(self):
+        """ Send the reads of the request to a replica when it is safe to """
+        g.replica = None
+        g.read_your_writes = False
+        if not self.binds or request.method != "GET" or request.endpoint not in READ_ENDPOINTS:
+            return
+        if self.client_wrote_recently():
+            g.read_your_writes = True
+            metrics.increment("replicas.primary_reads")
+            return
+        g.replica = self.next_replica()
+        metrics.increment("replicas.reads")
+
+    def record_write(self, response):
+        """ Keep the client of a successful write on the primary for a while """
+        if not self.binds or request.method in SAFE_METHODS or response.status_code >= 400:
+            return
+        now = time.time()
+        session[SESSION_KEY] = now
+        client = request.headers.get(self.client_header)
+        if client:
+            with self._lock:
+                self._writes[client] = now
+                if len(self._writes) > self.MAX_CLIENTS:
+                    self._prune(now)
+
+    def _prune(self, now):
+        """ Forget the clients whose window has passed """
+        for client, wrote_at in list(self._writes.items()):
+            if wrote_at <= now - self.read_your_writes:
+                del self._writes[client]
+
+
+def init_replicas(app):
+    """ Give every replica its bind and route the requests between them and the primary """
+    binds = []
+    for number, uri in enumerate(app.config.get("DATABASE_REPLICA_URIS", [])):
+        # the bind does not inherit SQLALCHEMY_ENGINE_OPTIONS
+        options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}), url=uri)
+        app.config.setdefault("SQLALCHEMY_BINDS", {}).setdefault(bind_key(number), options)
+        binds.append(bind_key(number))
+    app.extensions["replicas"] = ReplicaRouter(
+        binds, app.config.get("READ_YOUR_WRITES_SECONDS", 5.0), app.config.get("CLIENT_ID_HEADER", "X-Client-Id")
+    )
+
+    @app.before_request
+    def route_to_replica():  # pylint: disable=unused-variable
+        """ Pick the database of the request """
+        app.extensions["replicas"].route()
+
+    @app.after_request
+    def remember_write(response):  # pylint: disable=unused-variable
+        """ Keep the writers reading their writes """
+        app.extensions["replicas"].record_write(response)
+        return response
+
+    @app.teardown_request
+    def forget_replica(_error):  # pylint: disable=unused-variable
+        """ Leave the statements run after the request on the primary """
+        g.pop("replica", None)
+        g.pop("read_your_writes", None)
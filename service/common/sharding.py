@@ -0,0 +1,164 @@
+"""
+Shopcart Sharding
+
+With DATABASE_SHARD_URIS set, the shopcarts and everything that belongs to
+them (their items, item statistics, outbox events and archived copies) are
+spread over shard 0, the database of DATABASE_URI, and the shard databases,
+shard 1 and up. A shopcart lives on shard `id % count`, so the requests of
+a shopcart, whose path holds its id, run on its shard alone, and a created
+shopcart moves its request to the shard of its new id. Idempotency keys and
+id blocks stay on shard 0, and read replicas and the bulk lane engine only
+serve shard 0.
+
+Shopcart and item ids are unique across the shards: every worker takes
+blocks of SHARD_ID_BLOCK ids from the id_block table of shard 0, so rows
+keep their ids when they move between shards.
+
+The shopcart listing, the name lookups and the item statistics gather the
+results of every shard. The writes of a request touching several shards,
+such as a batch creating shopcarts on two shards, are committed shard by
+shard, not atomically.
+An item only moves to another shopcart of its shard: an
+item update naming a shopcart of another shard gets 409_CONFLICT.
+
+Adding a shard changes the shard of most shopcarts: once every worker runs
+with the new DATABASE_SHARD_URIS, `flask rebalance-shards` moves the
+shopcarts to their shard, and until then the ones not moved yet are not
+found.
+"""
+import threading
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import inspect
+
+from service.common.replicas import RoutingSession
+
+ENVIRON_KEY = "service.shard"
+# tables every shard request still reads and writes on shard 0
+UNSHARDED_TABLES = ("idempotency_key", "id_block")
+
+
+def shard_key(shard: int):
+    """ The SQLAlchemy bind of a shard, shard 0 being the default one """
+    return f"shard_{shard}" if shard else None
+
+
+class ShardRouter:
+    """ Maps shopcart ids to shards and hands out ids unique across them """
+
+    def __init__(self, count: int = 1, block_size: int = 100):
+        self.count = count
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._blocks = {}
+
+    @property
+    def sharded(self) -> bool:
+        """ True with more than one shard """
+        return self.count > 1
+
+    def shards(self):
+        """ Every shard number """
+        return range(self.count)
+
+    def shard_of(self, shopcart_id) -> int:
+        """ The shard a shopcart lives on """
+        return int(shopcart_id) % self.count
+
+    def next_id(self, name: str, reserve) -> int:
+        """ The next id of a table, reserving a new block with reserve(name, size) when the last one is used up """
+        with self._lock:
+            next_id, end = self._blocks.get(name, (0, 0))
+            if next_id >= end:
+                next_id = reserve(name, self.block_size)
+                end = next_id + self.block_size
+            self._blocks[name] = (next_id + 1, end)
+            return next_id
+
+
+router = ShardRouter()  # pylint: disable=invalid-name
+
+
+def current_shard(mapper=None) -> int:
+    """ The shard the statements of a mapper run on in the current context """
+    table = getattr(inspect(mapper), "local_table", None) if mapper is not None else None
+    if table is not None and table.name in UNSHARDED_TABLES:
+        return 0
+    if not has_app_context():
+        return 0
+    if g.get("shards"):
+        return g.shards[-1]
+    if has_request_context():
+        if ENVIRON_KEY in request.environ:
+            return request.environ[ENVIRON_KEY]
+        shopcart_id = (request.view_args or {}).get("shopcart_id")
+        if str(shopcart_id).isdigit():
+            return router.shard_of(shopcart_id)
+    return g.get("shard", 0)
+
+
+def route_to(shopcart_id):
+    """ Run the rest of the request, or of the app context outside requests, on the shard of a shopcart """
+    if not router.sharded or shopcart_id is None or not has_app_context():
+        return
+    shard = router.shard_of(shopcart_id)
+    if has_request_context():
+        request.environ[ENVIRON_KEY] = shard
+    else:
+        g.shard = shard
+
+
+@contextmanager
+def on_shard(shard: int):
+    """ Run the statements of the block on a shard """
+    g.setdefault("shards", []).append(shard)
+    try:
+        yield
+    finally:
+        g.shards.pop()
+
+
+def gather(function) -> list:
+    """ The results of the function run on every shard in turn
+
+    The rows of different shards can share a primary key, item statistics
+    for instance, so the function must return plain values, and the objects
+    loaded on one shard are expired before the next one is read.
+    """
+    if not router.sharded:
+        return [function()]
+    results = []
+    session = current_app.extensions["sqlalchemy"].session
+    for shard in router.shards():
+        with on_shard(shard):
+            results.append(function())
+        session.expire_all()
+    return results
+
+
+def engines(all_engines) -> list:
+    """ The engine of every shard, from the engines of Flask-SQLAlchemy """
+    return [all_engines[shard_key(shard)] for shard in router.shards()]
+
+
+class ShardedSession(RoutingSession):  # pylint: disable=too-many-ancestors, too-few-public-methods
+    """ Session running the statements of a shopcart on its shard """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and router.sharded:
+            shard = current_shard(mapper)
+            if shard:
+                return self._db.engines[shard_key(shard)]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def init_sharding(app):
+    """ Give every shard its bind """
+    global router  # pylint: disable=global-statement, invalid-name
+    uris = app.config.get("DATABASE_SHARD_URIS", [])
+    for shard, uri in enumerate(uris, start=1):
+        # the bind does not inherit SQLALCHEMY_ENGINE_OPTIONS
+        options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}), url=uri)
+        app.config.setdefault("SQLALCHEMY_BINDS", {}).setdefault(shard_key(shard), options)
+    router = ShardRouter(1 + len(uris), app.config.get("SHARD_ID_BLOCK", 100))
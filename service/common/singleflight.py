@@ -0,0 +1,61 @@
+"""
+Single Flight
+
+Coalesces concurrent identical reads within a worker: while a call for a key
+is running, later callers for the same key wait for it and share its result
+instead of running the query and serialize() again.
+
+Shared results are handed to every waiter, so they must be treated as read
+only.
+"""
+import threading
+
+from service.common import metrics
+
+
+class _Call:
+    """ A call in flight and the outcome its waiters will share """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Group:
+    """ A namespace of keys whose concurrent calls are coalesced """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        """ Run function() for the key or wait for the call already in flight """
+        if not self.enabled:
+            return function()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            metrics.increment(f"singleflight.{self.name}.collapsed")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        metrics.increment(f"singleflight.{self.name}.executed")
+        try:
+            call.result = function()
+            return call.result
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
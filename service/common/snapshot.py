@@ -0,0 +1,204 @@
+"""
+Database Snapshots
+
+`flask db-export` writes the shopcart and item tables to gzip compressed
+CSV files, one per table with a header line, and `flask db-import` loads
+them back, to copy production data to staging or to restore it after an
+incident without replaying the API. PostgreSQL databases stream the rows
+with COPY; other databases, and imports spread over several shards, read
+and write them in chunks of rows. The files of either database load into
+the other.
+
+The export of a shard reads its tables in a single repeatable read
+transaction, and the import of a shard is a single transaction. Imported
+rows do not send change events, and the archived shopcarts are not part
+of a snapshot.
+"""
+import csv
+import gzip
+import io
+import itertools
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import func, insert, select, text
+
+# the tables of a snapshot, parents first, and the column holding their shopcart id
+TABLES = (("shopcart", "id"), ("item", "shopcart_id"))
+COMPRESS_LEVEL = 6  # much faster than the default 9, for slightly larger files
+REPORT_SECONDS = 5.0
+
+
+def snapshot_path(directory: str, table_name: str) -> str:
+    """ The file of a table in a snapshot directory """
+    return os.path.join(directory, f"{table_name}.csv.gz")
+
+
+class Progress:
+    """ Counts the rows copied and reports them, with their throughput, every REPORT_SECONDS """
+
+    def __init__(self, report, action: str):
+        self.report = report
+        self.action = action
+        self.started = time.monotonic()
+        self.rows = {}
+        self._reported = self.started
+
+    def add(self, table_name: str, rows: int):
+        """ Count rows of a table, reporting the progress when it is time to """
+        self.rows[table_name] = self.rows.get(table_name, 0) + rows
+        now = time.monotonic()
+        if now - self._reported >= REPORT_SECONDS:
+            self._reported = now
+            self.report(f"{table_name}: {self.rows[table_name]} rows, {self.rate(now):.0f} rows/s")
+
+    def rate(self, now=None) -> float:
+        """ The rows copied per second so far """
+        elapsed = (now or time.monotonic()) - self.started
+        return sum(self.rows.values()) / elapsed if elapsed > 0 else 0.0
+
+    def summary(self, size: int) -> str:
+        """ The rows and bytes copied, with their throughput """
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        tables = ", ".join(f"{rows} {table_name}" for table_name, rows in self.rows.items())
+        return (f"{self.action} {sum(self.rows.values())} rows ({tables}), {size / 1e6:.1f} MB "
+                f"in {elapsed:.1f}s: {self.rate():.0f} rows/s, {size / 1e6 / elapsed:.1f} MB/s")
+
+
+def _open(path: str, mode: str):
+    """ A compressed snapshot file as a CSV text stream """
+    return io.TextIOWrapper(gzip.open(path, mode + "b", compresslevel=COMPRESS_LEVEL), encoding="utf-8", newline="")
+
+
+def _parser(column):
+    """ The function reading the CSV values of a column """
+    python_type = column.type.python_type
+    if python_type is str:
+        return lambda value: value
+    if python_type is datetime:
+        parse = datetime.fromisoformat
+    else:
+        parse = python_type
+    return lambda value: None if value == "" else parse(value)
+
+
+def export_table(connection, table, stream, progress: Progress, chunk_size: int = 10000) -> int:
+    """ Write the rows of a table to a CSV stream, without header, in id order, and return their number """
+    columns = ", ".join(column.name for column in table.columns)
+    if connection.dialect.name == "postgresql":
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(f"COPY (SELECT {columns} FROM {table.name} ORDER BY id) TO STDOUT WITH (FORMAT csv)", stream)
+        progress.add(table.name, cursor.rowcount)
+        return cursor.rowcount
+    writer = csv.writer(stream)
+    exported, last_id = 0, None
+    while True:
+        query = select(table).order_by(table.c.id).limit(chunk_size)
+        if last_id is not None:
+            query = query.where(table.c.id > last_id)
+        rows = connection.execute(query).all()
+        writer.writerows(rows)
+        exported += len(rows)
+        progress.add(table.name, len(rows))
+        if len(rows) < chunk_size:
+            return exported
+        last_id = rows[-1].id
+
+
+def export_snapshot(engines, metadata, directory: str, report, chunk_size: int = 10000) -> Progress:
+    """ Write the snapshot tables of every shard engine to the files of a directory """
+    os.makedirs(directory, exist_ok=True)
+    tables = [metadata.tables[name] for name, _ in TABLES]
+    progress = Progress(report, "Exported")
+    streams = {table.name: _open(snapshot_path(directory, table.name), "w") for table in tables}
+    try:
+        for table in tables:
+            csv.writer(streams[table.name]).writerow(column.name for column in table.columns)
+        for engine in engines:
+            options = {"isolation_level": "REPEATABLE READ"} if engine.dialect.name == "postgresql" else {}
+            with engine.connect().execution_options(**options) as connection, connection.begin():
+                for table in tables:
+                    export_table(connection, table, streams[table.name], progress, chunk_size)
+    finally:
+        for stream in streams.values():
+            stream.close()
+    return progress
+
+
+def copy_in(connection, table, columns: list, stream, progress: Progress) -> int:
+    """ Load the CSV rows left in the stream into a PostgreSQL table with COPY """
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", stream)
+    progress.add(table.name, cursor.rowcount)
+    # the sequence continues after the ids loaded
+    connection.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {table.name}"
+    ))
+    return cursor.rowcount
+
+
+def insert_chunks(connections, shard_of, table, columns: list, stream,  # pylint: disable=too-many-arguments, too-many-locals
+                  progress: Progress, chunk_size: int = 10000) -> int:
+    """ Insert the CSV rows left in the stream, a chunk at a time, each on the connection of its shard """
+    parsers = [_parser(table.c[name]) for name in columns]
+    shard_column = dict(TABLES)[table.name]
+    reader = csv.reader(stream)
+    imported = 0
+    while True:
+        chunk = list(itertools.islice(reader, chunk_size))
+        by_shard = {}
+        for line in chunk:
+            row = {name: parse(value) for name, parse, value in zip(columns, parsers, line)}
+            by_shard.setdefault(shard_of(row[shard_column]), []).append(row)
+        for shard, rows in by_shard.items():
+            connections[shard].execute(insert(table), rows)
+        imported += len(chunk)
+        progress.add(table.name, len(chunk))
+        if len(chunk) < chunk_size:
+            return imported
+
+
+def import_snapshot(engines, shard_of, metadata, directory: str, report,  # pylint: disable=too-many-arguments, too-many-locals
+                    replace: bool = False, chunk_size: int = 10000) -> Progress:
+    """Load the files of a snapshot directory into the snapshot tables of the shard engines
+
+    The tables must be empty unless replace is set, which deletes their rows first.
+    """
+    tables = [metadata.tables[name] for name, _ in TABLES]
+    for table in tables:
+        if not os.path.exists(snapshot_path(directory, table.name)):
+            raise ValueError(f"No {table.name} table in the snapshot {directory}")
+    progress = Progress(report, "Imported")
+    connections = [engine.connect() for engine in engines]
+    try:
+        transactions = [connection.begin() for connection in connections]
+        for connection in connections:
+            _empty_tables(connection, tables, replace)
+        for table in tables:
+            with _open(snapshot_path(directory, table.name), "r") as stream:
+                columns = next(csv.reader(io.StringIO(stream.readline())))
+                if len(connections) == 1 and connections[0].dialect.name == "postgresql":
+                    copy_in(connections[0], table, columns, stream, progress)
+                else:
+                    insert_chunks(connections, shard_of, table, columns, stream, progress, chunk_size)
+        for transaction in transactions:
+            transaction.commit()
+    finally:
+        for connection in connections:
+            connection.close()
+    return progress
+
+
+def _empty_tables(connection, tables, replace: bool):
+    """ Delete the rows of the tables when replacing them, or check they have none """
+    for table in reversed(tables):
+        if replace:
+            connection.execute(table.delete())
+        elif connection.execute(select(func.count()).select_from(table)).scalar():
+            raise ValueError(f"The {table.name} table is not empty, import with --replace to overwrite it")
+
+
+def snapshot_size(directory: str) -> int:
+    """ The bytes of the compressed files of a snapshot """
+    return sum(os.path.getsize(snapshot_path(directory, name)) for name, _ in TABLES)
@@ -0,0 +1,37 @@
+"""
+Statement Cache Metrics
+
+SQLAlchemy caches the compiled SQL of the statements it executes, keyed by
+their structure rather than their parameters, so the lookups built with
+session.get() and select() are compiled once per worker and only their
+parameters change between requests. Every execution is counted as a hit or a
+miss of that cache, and GET /metrics reports the hit ratio.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.interfaces import CacheStats
+
+from service.common import metrics
+
+OUTCOMES = {CacheStats.CACHE_HIT: "hit", CacheStats.CACHE_MISS: "miss"}
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_cache_use(_conn, _cursor, _statement, _parameters, context, _executemany):
+    outcome = OUTCOMES.get(getattr(context, "cache_hit", None), "uncached")
+    metrics.increment(f"db.statement_cache.{outcome}")
+
+
+def hit_ratio():
+    """ Fraction of the cacheable executions whose compiled statement was cached """
+    hits = metrics.counter("db.statement_cache.hit")
+    misses = metrics.counter("db.statement_cache.miss")
+    return round(hits / (hits + misses), 3) if hits + misses else None
+
+
+def init_statement_cache(app):
+    """ Size the compiled statement cache and report its hit ratio """
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {}).setdefault(
+        "query_cache_size", app.config["STATEMENT_CACHE_SIZE"]
+    )
+    metrics.register_gauge("db.statement_cache.hit_ratio", hit_ratio)
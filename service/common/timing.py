@@ -0,0 +1,132 @@
+"""
+Server Timing
+
+Lightweight per-request instrumentation that attributes the time spent on a
+request to the db, hydrate, serialize, marshal and encode phases and reports
+them in a Server-Timing response header and in the request log.
+
+Spans are exclusive: the time spent in a nested span is only attributed to
+the innermost one, so the reported durations add up to the instrumented time.
+"marshal" is what remains of the Flask-RESTX dispatch once the other phases
+are taken out (mostly marshalling the handler result).
+"""
+import functools
+from contextlib import contextmanager
+from time import perf_counter
+
+from flask import g, has_request_context
+from flask_restx import representations
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SPANS = ("db", "hydrate", "serialize", "marshal", "encode")
+
+
+class RequestTimings:
+    """ Accumulates exclusive span durations for one request """
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.durations = dict.fromkeys(SPANS, 0.0)
+        self._stack = []
+
+    def start(self, name):
+        """ Open a span nested in the current one """
+        self._stack.append([name, perf_counter(), 0.0])
+
+    def stop(self):
+        """ Close the innermost span """
+        if not self._stack:
+            return
+        name, started, nested = self._stack.pop()
+        elapsed = perf_counter() - started
+        self.durations[name] = self.durations.get(name, 0.0) + elapsed - nested
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def milliseconds(self) -> dict:
+        """ The span durations and the request total in milliseconds """
+        timings = {name: round(seconds * 1000, 3) for name, seconds in self.durations.items()}
+        timings["total"] = round((perf_counter() - self.started) * 1000, 3)
+        return timings
+
+    def header(self) -> str:
+        """ Render the durations as a Server-Timing header value """
+        return ", ".join(f"{name};dur={dur}" for name, dur in self.milliseconds().items())
+
+
+def current():
+    """ The timings of the current request or None when timing is off """
+    if not has_request_context():
+        return None
+    return g.get("server_timing")
+
+
+@contextmanager
+def span(name):
+    """ Attribute the time spent in the block to the named span """
+    timings = current()
+    if timings is None:
+        yield
+        return
+    timings.start(name)
+    try:
+        yield
+    finally:
+        timings.stop()
+
+
+def timed(name):
+    """ Decorator form of span() """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_db_span(*_args):
+    timings = current()
+    if timings is not None:
+        timings.start("db")
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _stop_db_span(*_args):
+    timings = current()
+    if timings is not None:
+        timings.stop()
+
+
+@event.listens_for(Engine, "handle_error")
+def _abort_db_span(_context):
+    timings = current()
+    if timings is not None:
+        timings.stop()
+
+
+def init_timing(app, api):
+    """ Collect the spans of every request and report them when enabled """
+
+    @api.representation("application/json")
+    def output_json(data, code, headers=None):  # pylint: disable=unused-variable
+        """ Flask-RESTX JSON representation wrapped in the encode span """
+        with span("encode"):
+            return representations.output_json(data, code, headers)
+
+    @app.before_request
+    def start_timing():  # pylint: disable=unused-variable
+        """ Start collecting spans for this request """
+        g.server_timing = RequestTimings() if app.config.get("SERVER_TIMING_ENABLED") else None
+
+    @app.after_request
+    def report_timing(response):  # pylint: disable=unused-variable
+        """ Report the spans in the Server-Timing header and the request log """
+        timings = current()
+        if timings is not None:
+            response.headers["Server-Timing"] = timings.header()
+            app.logger.info("Request timings", extra={"server_timing": timings.milliseconds()})
+        return response
@@ -16,5 +16,122 @@ DATABASE_URI = os.getenv(
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Read replicas, comma separated, the cart and item reads run on in turn, and
+# how long a client reads from the primary after each of its writes
+DATABASE_REPLICA_URIS = [uri.strip() for uri in os.getenv("DATABASE_REPLICA_URIS", "").split(",") if uri.strip()]
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
+# Shard databases, comma separated, after shard 0 of DATABASE_URI: a shopcart
+# lives on shard id % count, with ids reserved in blocks of SHARD_ID_BLOCK
+DATABASE_SHARD_URIS = [uri.strip() for uri in os.getenv("DATABASE_SHARD_URIS", "").split(",") if uri.strip()]
+SHARD_ID_BLOCK = int(os.getenv("SHARD_ID_BLOCK", "100"))
+
+# Connections of the pool of each worker process; gunicorn.conf.py gives a
+# gthread worker one thread per connection
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+
+# Group commit: write requests commit without waiting for the WAL flush and
+# are answered once a flush shared with the other writes of the worker made
+# them durable, flushing after a delay or once enough writes are waiting
+GROUP_COMMIT_ENABLED = os.getenv("GROUP_COMMIT_ENABLED", "false").lower() == "true"
+GROUP_COMMIT_DELAY_MS = float(os.getenv("GROUP_COMMIT_DELAY_MS", "2"))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", "32"))
+
+# Hash partitions of the item table on PostgreSQL, created with the table or
+# by `flask partition-items` (0 keeps a plain table)
+ITEM_PARTITIONS = int(os.getenv("ITEM_PARTITIONS", "0"))
+
+# Compiled statements SQLAlchemy keeps per worker, reported as db.statement_cache.*
+STATEMENT_CACHE_SIZE = int(os.getenv("STATEMENT_CACHE_SIZE", "500"))
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
+
+# Logging: "json" or "text" output, and the fraction of requests whose
+# info-level logs are kept (warnings and errors are always logged)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
+# Report db/hydrate/serialize/marshal/encode spans in a Server-Timing header
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() == "true"
+
+# Admission control: per client token buckets (0 disables rate limiting) kept
+# in memory, or in a SQLite file shared by the workers of a node, and load
+# shedding thresholds (0 disables each of them)
+CLIENT_ID_HEADER = os.getenv("CLIENT_ID_HEADER", "X-Client-Id")
+# the clients are rate limited by address, as forwarded by the trusted
+# proxies in front of the service, or by the client id header when a
+# trusted gateway sets it
+TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", "0"))
+TRUST_CLIENT_ID_HEADER = os.getenv("TRUST_CLIENT_ID_HEADER", "false").lower() == "true"
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "0"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "20"))
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "")
+SHED_MAX_IN_FLIGHT = int(os.getenv("SHED_MAX_IN_FLIGHT", "0"))
+SHED_MAX_POOL_WAIT_MS = float(os.getenv("SHED_MAX_POOL_WAIT_MS", "0"))
+
+# Worker lanes: the interactive and bulk requests a worker serves at once
+# (0 leaves the interactive lane unbounded and puts bulk requests in it), and
+# the connections of the pool of the bulk lane
+LANE_INTERACTIVE_MAX_IN_FLIGHT = int(os.getenv("LANE_INTERACTIVE_MAX_IN_FLIGHT", "0"))
+LANE_BULK_MAX_IN_FLIGHT = int(os.getenv("LANE_BULK_MAX_IN_FLIGHT", "2"))
+LANE_BULK_DB_POOL_SIZE = int(os.getenv("LANE_BULK_DB_POOL_SIZE", "2"))
+
+# Budget in seconds of the requests without an X-Request-Deadline or
+# X-Request-Timeout header (0 leaves them without a deadline)
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "0"))
+
+# Coalesce concurrent identical cart reads of a worker into one execution
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+
+# Idempotency-Key support for POST: how long responses are replayed, how long
+# a duplicate waits for the first request and when a claim counts as abandoned
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "5"))
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "30"))
+
+# Largest number of operations accepted by POST /api/batch
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "100"))
+
+# Server-Sent Events change feed: keep-alive interval, how long a stream stays
+# open before the client reconnects with Last-Event-ID, the events kept for
+# those reconnections and the events queued for a slow client before it is reset
+CHANGE_FEED_HEARTBEAT_SECONDS = float(os.getenv("CHANGE_FEED_HEARTBEAT_SECONDS", "15"))
+CHANGE_FEED_MAX_SECONDS = float(os.getenv("CHANGE_FEED_MAX_SECONDS", "300"))
+CHANGE_FEED_HISTORY = int(os.getenv("CHANGE_FEED_HISTORY", "1000"))
+CHANGE_FEED_QUEUE_SIZE = int(os.getenv("CHANGE_FEED_QUEUE_SIZE", "1000"))
+# streams a worker serves at once, each holding a gthread worker thread; 0 for no limit on gevent workers
+CHANGE_FEED_MAX_STREAMS = int(os.getenv("CHANGE_FEED_MAX_STREAMS", "4"))
+
+# Transactional outbox: write an event row with every change, and the sink
+# (file:// or unix:// URL) a publisher thread of each worker drains it to in
+# batches; leave the sink empty when `flask outbox-publish` runs separately
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "false").lower() == "true"
+OUTBOX_SINK = os.getenv("OUTBOX_SINK", "")
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "1"))
+
+# Shopcart expiry: seconds a shopcart, or an empty one, lives after its last
+# change (0 for ever), the shopcarts deleted per transaction and how often a
+# thread of each worker sweeps them (0 leaves it to `flask sweep-expired`)
+SHOPCART_TTL_SECONDS = float(os.getenv("SHOPCART_TTL_SECONDS", "0"))
+SHOPCART_EMPTY_TTL_SECONDS = float(os.getenv("SHOPCART_EMPTY_TTL_SECONDS", "0"))
+SHOPCART_SWEEP_CHUNK = int(os.getenv("SHOPCART_SWEEP_CHUNK", "100"))
+SHOPCART_SWEEP_SECONDS = float(os.getenv("SHOPCART_SWEEP_SECONDS", "0"))
+
+# Shopcart archive: seconds after its last change a shopcart moves to the
+# archive tables (0 never), the shopcarts moved per transaction and how often
+# a thread of each worker moves them (0 leaves it to `flask archive-stale`)
+ARCHIVE_AFTER_SECONDS = float(os.getenv("ARCHIVE_AFTER_SECONDS", "0"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "100"))
+ARCHIVE_SWEEP_SECONDS = float(os.getenv("ARCHIVE_SWEEP_SECONDS", "0"))
+
+# Largest page of shopcarts returned by GET /api/shopcarts?limit=
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "250"))
+
+# Per item name statistics kept up to date by the item writes; run
+# `flask rebuild-item-stats` after turning them back on
+ITEM_STATS_ENABLED = os.getenv("ITEM_STATS_ENABLED", "true").lower() == "true"
+TOP_ITEMS_MAX = int(os.getenv("TOP_ITEMS_MAX", "100"))
@@ -6,25 +6,65 @@ GET  /shopcarts
 POST /shopcarts
 GET  /shopcarts/{shopcart_id}
 PUT  /shopcarts/{shopcart_id}
+PATCH /shopcarts/{shopcart_id}
 DELETE /shopcarts/{shopcart_id}
+PUT  /shopcarts/{shopcart_id}/clear
+PUT  /shopcarts/{shopcart_id}/restore
 
 GET  /shopcarts/{shopcart_id}/items
 POST /shopcarts{shopcart_id}/items
 GET  /shopcarts/{shopcart_id}/items/{item_id}
 PUT  /shopcarts/{shopcart_id}/items/{item_id}
+PATCH /shopcarts/{shopcart_id}/items/{item_id}
 DELETE /shopcarts/{shopcart_id}/items/{item_id}
+
+Every write records a change event, published to the change feed once its
+transaction commits and written to the outbox in the same transaction, and
+bumps the version and the item totals of the shopcart it touches. Item
+writes also maintain the per item name statistics of ItemStat, and the
+shopcarts untouched for longer than their time to live are swept away by
+Shopcart.sweep_expired. Shopcart.archive_stale moves the shopcarts untouched
+for long to the compressed rows of ArchivedShopcart, out of the hot tables,
+until ArchivedShopcart.restore brings them back.
+
+With ITEM_PARTITIONS on PostgreSQL, create_tables creates the item table
+hash partitioned on shopcart_id (see service.common.partitioning). With
+DATABASE_SHARD_URIS, every shopcart and its rows live on the shard of its
+id, which sharding.ShardedSession routes the statements to.
+
+Money is stored as whole cents in integer columns, so the totals and the
+sums the database computes are exact; the price, total_price and
+total_value attributes, and the API, keep amounts in currency units.
+`flask migrate-money` moves the float columns of older databases to cents,
+and `flask add-columns` adds the columns they miss.
 """
+# pylint: disable=too-many-lines
 
+import json
 import logging
 import math
+import time
+import zlib
 from abc import abstractmethod
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from decimal import ROUND_HALF_UP, Decimal
 
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, delete, event, func, inspect, insert, or_, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import Session, joinedload, selectinload
 
-logger = logging.getLogger("flask.app")
+from service.common import change_feed, deadline, partitioning, sharding
+from service.common.sharding import ShardedSession
+from service.common.timing import timed
+
+logger = logging.getLogger("service")  # app.logger, named after the service package
 
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": ShardedSession})
 
 
 # Function to initialize the tables in DB
@@ -32,6 +72,178 @@ def init_db(app):
     """ Initialize the Shopcart and the Item tables through SQLAlchemy """
     Shopcart.init_db(app)
     Item.init_db(app)
+    ItemStat.enabled = app.config["ITEM_STATS_ENABLED"]
+
+
+def create_tables(partitions: int = 0):
+    """ Create the missing tables of every shard, with the item table hash partitioned on PostgreSQL when asked """
+    for engine in sharding.engines(db.engines):
+        if not partitions or engine.dialect.name != "postgresql":
+            db.metadata.create_all(engine)
+            continue
+        item = Item.__table__
+        db.metadata.create_all(engine, tables=[table for table in db.metadata.sorted_tables if table is not item])
+        with engine.begin() as connection:
+            if not inspect(connection).has_table(item.name):
+                partitioning.create_partitioned(connection, item, partitions)
+
+
+def drop_tables():
+    """ Drop the tables of every shard """
+    for engine in sharding.engines(db.engines):
+        db.metadata.drop_all(engine)
+
+
+NO_TIME = "1970-01-01 00:00:00"  # the constant default of the time columns SQLite adds
+
+# the columns added to the tables of older databases, with the statements filling them in
+ADDED_COLUMNS = (
+    ("shopcart", "version", "INTEGER NOT NULL DEFAULT 1", ()),
+    ("shopcart", "item_count", "INTEGER NOT NULL DEFAULT 0", ()),
+    ("shopcart", "total_quantity", "INTEGER NOT NULL DEFAULT 0", ()),
+    ("shopcart", "total_price_cents", "BIGINT NOT NULL DEFAULT 0", (
+        "UPDATE shopcart SET "
+        "item_count = (SELECT COUNT(*) FROM item WHERE item.shopcart_id = shopcart.id), "
+        "total_quantity = (SELECT COALESCE(SUM(quantity), 0) FROM item WHERE item.shopcart_id = shopcart.id), "
+        "total_price_cents = (SELECT COALESCE(SUM(quantity * price_cents), 0) FROM item "
+        "WHERE item.shopcart_id = shopcart.id)",
+    )),
+    # the existing shopcarts count as created and changed when they are migrated
+    ("shopcart", "created_at", "TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP", (
+        f"UPDATE shopcart SET created_at = CURRENT_TIMESTAMP WHERE created_at = '{NO_TIME}'",
+    )),
+    ("shopcart", "updated_at", "TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP", (
+        f"UPDATE shopcart SET updated_at = CURRENT_TIMESTAMP WHERE updated_at = '{NO_TIME}'",
+        "CREATE INDEX IF NOT EXISTS ix_shopcart_updated_at ON shopcart (updated_at)",
+    )),
+)
+
+
+def add_columns(connection) -> list:
+    """Add the columns missing from the tables of an older database, in the transaction of the connection
+
+    Returns the "table.column" names of the columns added, none once up to date
+    """
+    added = []
+    for table, column, definition, statements in ADDED_COLUMNS:
+        if column in {existing["name"] for existing in inspect(connection).get_columns(table)}:
+            continue
+        logger.info("Add %s.%s", table, column)
+        if connection.dialect.name == "sqlite":
+            # SQLite only adds columns with a constant default
+            definition = definition.replace("DEFAULT CURRENT_TIMESTAMP", f"DEFAULT '{NO_TIME}'")
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+        for statement in statements:
+            connection.execute(text(statement))
+        added.append(f"{table}.{column}")
+    return added
+
+
+# the float money columns of older databases and the cents columns replacing them
+MONEY_COLUMNS = (
+    ("shopcart", "total_price", "total_price_cents"),
+    ("item", "price", "price_cents"),
+    ("archived_shopcart", "total_price", "total_price_cents"),
+    ("item_stat", "total_value", "total_value_cents"),
+)
+
+
+def migrate_money(connection) -> list:
+    """Move the float money columns of a database to whole cents, in the transaction of the connection
+
+    Returns the "table.column" names of the columns moved, none once migrated
+    """
+    moved = []
+    for table, old, new in MONEY_COLUMNS:
+        columns = {column["name"] for column in inspect(connection).get_columns(table)}
+        if old not in columns or new in columns:
+            continue
+        logger.info("Move %s.%s to %s", table, old, new)
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {new} BIGINT NOT NULL DEFAULT 0"))
+        # rounded as numeric on PostgreSQL, half away from zero like to_cents()
+        amount = f"CAST({old} AS NUMERIC)" if connection.dialect.name == "postgresql" else old
+        connection.execute(text(f"UPDATE {table} SET {new} = ROUND({amount} * 100)"))
+        connection.execute(text(f"ALTER TABLE {table} DROP COLUMN {old}"))
+        moved.append(f"{table}.{old}")
+    if "item.price" in moved and connection.dialect.name == "postgresql":
+        # the shopcart_id index covers the prices now
+        connection.execute(text("DROP INDEX IF EXISTS ix_item_shopcart_id"))
+        connection.execute(text("CREATE INDEX ix_item_shopcart_id ON item (shopcart_id) INCLUDE (quantity, price_cents)"))
+    return moved
+
+
+def to_cents(amount) -> int:
+    """ An amount of money in whole cents, rounded half up """
+    amount = Decimal(str(amount))
+    if not amount.is_finite():
+        raise ValueError("amounts of money must be finite")
+    return int((amount * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    """ An amount of whole cents in currency units, as the API has it """
+    return None if cents is None else cents / 100
+
+
+@contextmanager
+def atomic():
+    """ Run the model writes of the block in a single transaction """
+    nested = in_atomic()
+    db.session.info["atomic"] = True
+    try:
+        yield
+        if not nested:
+            db.session.commit()
+    except Exception:
+        if not nested:
+            db.session.rollback()
+        raise
+    finally:
+        if not nested:
+            db.session.info.pop("atomic", None)
+
+
+def in_atomic() -> bool:
+    """ True while the writes are deferred to the end of an atomic() block """
+    return db.session.info.get("atomic", False)
+
+
+def _next_id(model):
+    """ A new id unique across the shards, or None for the database to choose it when there is a single one """
+    if not sharding.router.sharded:
+        return None
+    return sharding.router.next_id(model.__tablename__, IdBlock.reserve)
+
+
+def utcnow() -> datetime:
+    """ The current UTC time, as stored in the timestamp columns """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _queue_change(change: dict):
+    """ Queue a change event for the change feed and the outbox of the transaction """
+    db.session.info.setdefault("changes", []).append(change)
+    if OutboxEvent.enabled:
+        OutboxEvent.record(change)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_changes(session):
+    """ Publish the changes of a transaction once it is committed """
+    changes = session.info.pop("changes", None)
+    if changes:
+        change_feed.broker.publish(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session):
+    """ Forget the changes of a transaction that was rolled back """
+    session.info.pop("changes", None)
+
+
+def _isoformat(value):
+    """ A timestamp as ISO 8601 UTC, None before the row is written """
+    return value.isoformat() + "Z" if value is not None else None
 
 
 class DataValidationError(Exception):
@@ -59,61 +271,160 @@ class ModelBase:
     def init_db(cls, app):
         """ Initialize DB Table """
         logger.info("Start initializing the %s Table", cls.__name__)
-        cls.app = app
-        db.init_app(app)  # init the Flask app for SQLAlchemy
-        app.app_context().push()
-        db.create_all()  # create SQLAlchemy table
+        if "sqlalchemy" not in app.extensions:
+            db.init_app(app)  # init the Flask app for SQLAlchemy
+        # every request pushes its own app context, and with it gets its own session
+        with app.app_context():
+            create_tables(app.config.get("ITEM_PARTITIONS", 0))  # create SQLAlchemy table
         logger.info("Done initializing the %s Table", cls.__name__)
 
     @classmethod
+    @timed("hydrate")
     def get_all(cls):
         """ Get all objects in DB table """
         logger.info("Get all %s", cls.__name__)
-        return cls.query.all()
+        return db.session.scalars(select(cls)).all()
 
     def create(self):
         """ Create an object in DB table """
-        logger.info("Create %s", self.__repr__)
-        self.id = None  # pylint: disable=invalid-name
+        logger.info("Create %s", self)
+        self.id = _next_id(type(self))  # pylint: disable=invalid-name
+        sharding.route_to(self.id if isinstance(self, Shopcart) else self.shopcart_id)
         db.session.add(self)
-        db.session.commit()
+        db.session.flush()
+        self._record_change("created")
+        self._commit()
 
     def update(self):
         """ Update an object in DB table """
-        logger.info("Update %s", self.__repr__)
-        db.session.commit()
+        logger.info("Update %s", self)
+        previous = self._state_before_write()
+        db.session.flush()
+        self._record_change("updated", previous)
+        self._commit()
 
     def delete(self):
         """ Delete an object in DB table """
-        logger.info("Delete %s", self.__repr__)
+        logger.info("Delete %s", self)
+        previous = self._state_before_write()
         db.session.delete(self)
-        db.session.commit()
+        db.session.flush()
+        self._record_change("deleted", previous)
+        self._commit()
 
     @classmethod
+    def patch(cls, pk_id, changes: dict, **criteria):
+        """
+        Update only the given columns of a row with an UPDATE statement, without loading it first
+
+        Args:
+            pk_id: the primary key of the row
+            changes (dict): the new value of each column to update
+            criteria: extra column values the row must match
+
+        Returns the updated object, or None when no row matched
+        """
+        logger.info("Patch %s id=%s with %s", cls.__name__, pk_id, changes)
+        filters = [cls.id == pk_id] + [getattr(cls, column) == value for column, value in criteria.items()]
+        if not changes:
+            return db.session.query(cls).filter(*filters).one_or_none()
+        previous = cls._locked_state(filters, changes)
+        statement = update(cls).where(*filters).values(**changes).returning(cls)
+        patched = db.session.execute(statement).scalar_one_or_none()
+        if patched is not None:
+            patched._record_change("updated", previous)  # pylint: disable=protected-access
+        cls._commit()
+        return patched
+
+    @abstractmethod
+    def _state_before_write(self):
+        """ The stored values the shopcart totals must forget when the object is written """
+
+    @classmethod
+    @abstractmethod
+    def _locked_state(cls, filters, changes: dict):
+        """ The stored values a patch overwrites, locked until the transaction ends """
+
+    @abstractmethod
+    def _next_version(self, action: str, previous) -> int:
+        """ Apply the change to the shopcart version and totals and return the new version """
+
+    def _record_change(self, action: str, previous=None):
+        """ Queue a change event, published by the change feed once the transaction commits """
+        version = self._next_version(action, previous)
+        change = {
+            "type": type(self).__name__.lower(),
+            "action": action,
+            "shopcart_id": self.id if isinstance(self, Shopcart) else self.shopcart_id,
+            "id": self.id,
+            "version": version,
+            "data": None if action == "deleted" else self.change_data(action),
+        }
+        _queue_change(change)
+
+    def change_data(self, action: str) -> dict:  # pylint: disable=unused-argument
+        """ The state sent with a change event of the object """
+        return self.serialize()
+
+    @staticmethod
+    def _commit():
+        """ Commit, or only flush while inside an atomic() block """
+        if in_atomic():
+            db.session.flush()
+        else:
+            db.session.commit()
+
+    @classmethod
+    @timed("hydrate")
     def get_by_id(cls, pk_id):
         """ Get shopcart by primary key: id """
         logger.info("Get %s by id=%s", cls.__name__, pk_id)
-        return cls.query.get(pk_id)
+        return db.session.get(cls, pk_id)
 
 
 class Shopcart(db.Model, ModelBase):
     """ The Shopcart Table """
 
-    app = None
-
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)  # correspond to customer_id
     name = db.Column(db.String(63), nullable=False)  # correspond to customer_name
+    # bumped by every change to the shopcart or its items
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    # totals of the items, kept up to date by every item write
+    item_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    total_quantity = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    total_price_cents = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
+    # UTC times of the creation and of the last change, which the expiry counts from
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow, server_default=func.current_timestamp())
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, server_default=func.current_timestamp())
     items = db.relationship("Item", backref="shopcart", passive_deletes=True)
 
+    __table_args__ = (db.Index("ix_shopcart_updated_at", "updated_at"),)
+
     def __repr__(self):
         return f"{type(self).__name__}({self.id}, {self.name})"
 
+    @hybrid_property
+    def total_price(self):
+        """ The total price of the items in currency units """
+        return from_cents(self.total_price_cents)
+
+    @total_price.setter
+    def total_price(self, amount):
+        self.total_price_cents = None if amount is None else to_cents(amount)
+
+    @timed("serialize")
     def serialize(self) -> dict:
         """ Transform the self object into a shopcart dictionary """
         shopcart = {
             "id": self.id,
             "name": self.name,
+            "version": self.version,
+            "item_count": self.item_count,
+            "total_quantity": self.total_quantity,
+            "total_price": self.total_price,
+            "created_at": _isoformat(self.created_at),
+            "updated_at": _isoformat(self.updated_at),
             "items": []
         }
         for item in self.items:
@@ -153,6 +464,341 @@ class Shopcart(db.Model, ModelBase):
                 f"Invalid {type(self).__name__}: failed to deserialize name: '{self.name}'"
             ) from error
 
+    @classmethod
+    def deserialize_patch(cls, data) -> dict:
+        """
+        Transform a JSON Merge Patch document into the shopcart columns to update
+
+        Args:
+            data (dict): the members of the shopcart to change
+        """
+        if not isinstance(data, dict):
+            raise DataValidationError(f"Invalid {cls.__name__}: patch must be a JSON object")
+        unknown = set(data) - {"name"}
+        if unknown:
+            raise DataValidationError(f"Invalid {cls.__name__}: cannot patch {', '.join(sorted(unknown))}")
+        changes = {}
+        if "name" in data:
+            changes["name"] = _patched_name(cls, data["name"])
+        return changes
+
+    def create(self):
+        """ Create a shopcart, with the totals of the items it is created with """
+        self.item_count = len(self.items)
+        self.total_quantity = sum(item.quantity for item in self.items)
+        self.total_price_cents = sum(item.quantity * item.price_cents for item in self.items)
+        self.created_at = self.updated_at = utcnow()
+        for item in self.items:
+            item.id = _next_id(Item)
+        super().create()
+
+    def update(self):
+        """ Update a shopcart, giving the items it gained ids unique across the shards """
+        for item in self._state_before_write():
+            item.id = _next_id(Item)
+        super().update()
+
+    def delete(self):
+        """ Delete a shopcart, whose items are deleted by the database """
+        if ItemStat.enabled:
+            self._lock(self.id)
+            ItemStat.remove_shopcart(self.id)
+        super().delete()
+
+    def clear(self):
+        """ Delete every item of the shopcart with a single statement """
+        logger.info("Clear %s", self)
+        if ItemStat.enabled:
+            self._lock(self.id)
+            ItemStat.remove_shopcart(self.id)
+        db.session.query(Item).filter(Item.shopcart_id == self.id).delete()
+        db.session.expire(self, ["items"])
+        self._record_change("cleared")
+        self._commit()
+
+    def change_data(self, action: str) -> dict:
+        """ The shopcart with its items when created, later item changes have their own events """
+        data = self.serialize_summary()
+        if action in ("created", "restored"):
+            data["items"] = [item.serialize() for item in self.items]
+        return data
+
+    def serialize_summary(self) -> dict:
+        """ The shopcart and its totals, without loading its items """
+        return {
+            "id": self.id,
+            "name": self.name,
+            "version": self.version,
+            "item_count": self.item_count,
+            "total_quantity": self.total_quantity,
+            "total_price": self.total_price,
+        }
+
+    def _state_before_write(self):
+        """ The items a PUT adds to the shopcart """
+        return [item for item in db.session.new if isinstance(item, Item) and item.shopcart is self]
+
+    @classmethod
+    def _locked_state(cls, filters, changes: dict):  # pylint: disable=unused-argument
+        """ Nothing, a patch of the shopcart columns leaves its totals alone """
+        return None
+
+    def _record_change(self, action: str, previous=None):
+        super()._record_change(action, previous)  # the version bump locks the shopcart for the statistics
+        if ItemStat.enabled and action in ("created", "restored", "updated"):
+            ItemStat.add_items(self.id, (previous or []) if action == "updated" else self.items)
+
+    def _next_version(self, action: str, previous) -> int:
+        if action in ("created", "restored"):
+            return self.version
+        if action == "deleted":
+            return self.version + 1
+        if action == "cleared":
+            return Shopcart.bump_version(self.id, item_count=0, total_quantity=0, total_price_cents=0)
+        return Shopcart.bump_version(self.id, *Item.totals_delta(added=[
+            (item.quantity, item.price_cents) for item in previous or []
+        ]))
+
+    @classmethod
+    def _lock(cls, shopcart_id):
+        """ Lock the row of a shopcart until the transaction ends, as its version bump does """
+        db.session.execute(select(cls.id).where(cls.id == shopcart_id).with_for_update())
+
+    @classmethod
+    def bump_version(cls, shopcart_id, count=0, quantity=0, cents=0, **values):
+        """ Increment the version of a shopcart, add to its totals and return the new version """
+        if count or quantity or cents:
+            values.update(
+                item_count=cls.item_count + count,
+                total_quantity=cls.total_quantity + quantity,
+                total_price_cents=cls.total_price_cents + cents,
+            )
+        statement = update(cls).where(cls.id == shopcart_id).values(version=cls.version + 1, updated_at=utcnow(), **values)
+        return db.session.execute(statement.returning(cls.version)).scalar_one_or_none()
+
+    @classmethod
+    def expired(cls, ttl: float, empty_ttl: float = 0, now=None):
+        """The condition of the shopcarts past their time to live
+
+        Args:
+            ttl (float): seconds a shopcart lives after its last change, 0 for ever
+            empty_ttl (float): seconds an empty shopcart lives after its last change, 0 for as long as the others
+        """
+        now = now or utcnow()
+        conditions = []
+        if ttl:
+            conditions.append(cls.updated_at < now - timedelta(seconds=ttl))
+        if empty_ttl:
+            conditions.append(and_(cls.item_count == 0, cls.updated_at < now - timedelta(seconds=empty_ttl)))
+        return or_(*conditions) if conditions else None
+
+    @classmethod
+    def claim_batch(cls, condition, limit: int):
+        """Lock the least recently changed shopcarts matching the condition, skipping those another transaction holds
+
+        Returns the id and the version of each claimed shopcart
+        """
+        expired = select(cls.id).where(condition).order_by(cls.updated_at).limit(limit)
+        if db.session.get_bind().dialect.name == "sqlite":
+            # SQLite has no row locks: a no-op update takes the write lock of the database
+            # instead, so no claimed shopcart changes before the end of the transaction
+            statement = update(cls).where(cls.id.in_(expired.scalar_subquery())).values(version=cls.version)
+            return db.session.execute(statement.returning(cls.id, cls.version)).all()
+        statement = expired.add_columns(cls.version).with_for_update(skip_locked=True)
+        return db.session.execute(statement).all()
+
+    @classmethod
+    def sweep_expired(cls, ttl: float, empty_ttl: float = 0, chunk_size: int = 100) -> int:
+        """Delete a chunk of expired shopcarts and their items in a short transaction
+
+        Args:
+            ttl (float): seconds a shopcart lives after its last change, 0 for ever
+            empty_ttl (float): seconds an empty shopcart lives after its last change
+            chunk_size (int): the largest number of shopcarts deleted
+
+        Returns the number of shopcarts deleted
+        """
+        condition = cls.expired(ttl, empty_ttl)
+        if condition is None:
+            return 0
+        try:
+            claimed = cls.claim_batch(condition, chunk_size)
+            ids = [shopcart_id for shopcart_id, _ in claimed]
+            if ids:
+                logger.info("Expire %s %s", cls.__name__, ids)
+                if ItemStat.enabled:
+                    ItemStat.remove_shopcarts(ids)
+                db.session.execute(delete(Item).where(Item.shopcart_id.in_(ids)))
+                db.session.execute(delete(cls).where(cls.id.in_(ids)))
+                for shopcart_id, version in claimed:
+                    _queue_change({"type": "shopcart", "action": "expired", "shopcart_id": shopcart_id,
+                                   "id": shopcart_id, "version": version + 1, "data": None})
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return len(ids)
+
+    @classmethod
+    def archive_stale(cls, age: float, batch_size: int = 100) -> int:
+        """Move a batch of the shopcarts unchanged for long to the archive in a short transaction
+
+        Args:
+            age (float): seconds since their last change after which shopcarts are archived
+            batch_size (int): the largest number of shopcarts archived
+
+        Returns the number of shopcarts archived
+        """
+        try:
+            claimed = dict(cls.claim_batch(cls.updated_at < utcnow() - timedelta(seconds=age), batch_size))
+            if claimed:
+                logger.info("Archive %s %s", cls.__name__, list(claimed))
+                shopcarts = db.session.scalars(
+                    select(cls).where(cls.id.in_(claimed)).options(selectinload(cls.items))
+                ).all()
+                if ItemStat.enabled:
+                    ItemStat.remove_shopcarts(list(claimed))
+                archived_at = utcnow()
+                for shopcart in shopcarts:
+                    db.session.add(ArchivedShopcart.from_shopcart(shopcart, claimed[shopcart.id] + 1, archived_at))
+                    _queue_change({"type": "shopcart", "action": "archived", "shopcart_id": shopcart.id,
+                                   "id": shopcart.id, "version": claimed[shopcart.id] + 1, "data": None})
+                db.session.execute(delete(Item).where(Item.shopcart_id.in_(claimed)))
+                db.session.execute(delete(cls).where(cls.id.in_(claimed)))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return len(claimed)
+
+    @classmethod
+    def move_misplaced(cls, source: int, batch_size: int = 100) -> int:
+        """Move a batch of the shopcarts of a shard that belong to another one since shards were added
+
+        Each shopcart is copied with its items, or its archived copy, to its shard, then deleted from
+        the source shard. A shopcart its shard already holds, copied before an interrupted run and
+        maybe changed since, is only deleted.
+
+        Returns the number of shopcarts moved off the source shard
+        """
+        ids, rows = cls._misplaced_rows(source, batch_size)
+        if not ids:
+            return 0
+        logger.info("Move %s %s off shard %s", cls.__name__, ids, source)
+        for target in {sharding.router.shard_of(shopcart_id) for shopcart_id in ids}:
+            cls._copy_to_shard(target, ids, rows)
+        with sharding.on_shard(source):
+            if ItemStat.enabled:
+                ItemStat.remove_shopcarts(ids)
+            for table, column in reversed(cls._moved_tables().items()):
+                db.session.execute(delete(table).where(column.in_(ids)))
+            db.session.commit()
+        return len(ids)
+
+    @classmethod
+    def _moved_tables(cls) -> dict:
+        """ The tables moving with a shopcart, parents first, and their shopcart id column """
+        return {cls.__table__: cls.id, Item.__table__: Item.shopcart_id, ArchivedShopcart.__table__: ArchivedShopcart.id}
+
+    @classmethod
+    def _misplaced_rows(cls, source: int, batch_size: int):
+        """ The ids of a batch of the shopcarts of a shard that belong to another one, and their rows by table """
+        count = sharding.router.count
+        with sharding.on_shard(source):
+            ids = db.session.scalars(
+                select(cls.id).where(cls.id % count != source).order_by(cls.id).limit(batch_size)
+            ).all() + db.session.scalars(
+                select(ArchivedShopcart.id).where(ArchivedShopcart.id % count != source)
+                .order_by(ArchivedShopcart.id).limit(batch_size)
+            ).all()
+            rows = {table: db.session.execute(select(table).where(column.in_(ids))).all()
+                    for table, column in cls._moved_tables().items()}
+            db.session.commit()
+        return ids, rows
+
+    @classmethod
+    def _copy_to_shard(cls, target: int, ids, rows):
+        """ Copy the rows of the shopcarts that belong to a shard and it does not hold yet to it """
+        with sharding.on_shard(target):
+            held = set(db.session.scalars(select(cls.id).where(cls.id.in_(ids))).all())
+            held.update(db.session.scalars(select(ArchivedShopcart.id).where(ArchivedShopcart.id.in_(ids))).all())
+            moving = {shopcart_id for shopcart_id in ids
+                      if sharding.router.shard_of(shopcart_id) == target and shopcart_id not in held}
+            items = {}
+            for table, column in cls._moved_tables().items():
+                moved = [row for row in rows[table] if getattr(row, column.key) in moving]
+                if moved:
+                    db.session.execute(insert(table), [row._asdict() for row in moved])  # pylint: disable=protected-access
+                if table is Item.__table__:
+                    for item in moved:
+                        items.setdefault(item.shopcart_id, []).append(item)
+            if ItemStat.enabled:
+                for shopcart_id, shopcart_items in items.items():
+                    ItemStat.add_items(shopcart_id, shopcart_items)
+            db.session.commit()
+
+    @classmethod
+    def recompute_totals(cls, fix=False):
+        """Compare the totals of every shopcart with its items
+
+        Args:
+            fix (bool): overwrite the totals that differ
+
+        Returns the ids of the shopcarts whose totals differed
+        """
+        logger.info("Recompute %s totals", cls.__name__)
+        items = db.session.query(
+            Item.shopcart_id,
+            func.count(Item.id).label("item_count"),
+            func.sum(Item.quantity).label("total_quantity"),
+            func.sum(Item.quantity * Item.price_cents).label("total_price_cents"),
+        ).group_by(Item.shopcart_id).subquery()
+        rows = db.session.query(
+            cls.id, cls.item_count, cls.total_quantity, cls.total_price_cents,
+            items.c.item_count, items.c.total_quantity, items.c.total_price_cents,
+        ).outerjoin(items, items.c.shopcart_id == cls.id)
+
+        fixes = []
+        for shopcart_id, count, quantity, cents, real_count, real_quantity, real_cents in rows:
+            real = (real_count or 0, real_quantity or 0, real_cents or 0)
+            if (count, quantity, cents) != real:
+                logger.warning("%s %s totals %s should be %s", cls.__name__, shopcart_id, (count, quantity, cents), real)
+                fixes.append({
+                    "id": shopcart_id, "item_count": real[0], "total_quantity": real[1], "total_price_cents": real[2]
+                })
+        if fix and fixes:
+            db.session.execute(update(cls), fixes)
+            db.session.commit()
+        return [row["id"] for row in fixes]
+
+    @classmethod
+    @timed("hydrate")
+    def get_page(cls, limit: int, after=None, name=None):
+        """Get a page of shopcarts ordered by id, with their items loaded in one more query
+
+        Args:
+            limit (int): the largest number of shopcarts to return
+            after (int): only return the shopcarts whose id is greater
+            name (string): only return the shopcarts with this name
+
+        Returns the shopcarts and whether more follow
+        """
+        logger.info("Get %s page of %s after id=%s", cls.__name__, limit, after)
+        statement = select(cls).options(selectinload(cls.items)).order_by(cls.id)
+        if after is not None:
+            statement = statement.where(cls.id > after)
+        if name:
+            statement = statement.where(cls.name == name)
+        shopcarts = db.session.scalars(statement.limit(limit + 1)).all()
+        return shopcarts[:limit], len(shopcarts) > limit
+
+    @classmethod
+    @timed("hydrate")
+    def get_with_items(cls, pk_id):
+        """ Get a shopcart by id together with its items in a single query """
+        logger.info("Get %s with items by id=%s", cls.__name__, pk_id)
+        return db.session.get(cls, pk_id, options=[joinedload(cls.items)])
+
     @classmethod
     def find_by_name(cls, name):
         """Find shopcart(s) by name
@@ -161,25 +807,43 @@ class Shopcart(db.Model, ModelBase):
             name (string): the name of the Shopcarts you want to match
         """
         logger.info("Get %s by name=%s", cls.__name__, name)
-        return cls.query.filter(cls.name == name)
+        return db.session.scalars(select(cls).where(cls.name == name)).all()
 
 
 class Item(db.Model, ModelBase):
     """ The Item Table """
 
-    app = None
-
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
     # shopcart_id = db.Column(db.Integer, db.ForeignKey('shopcart.id', ondelete="CASCADE"), primary_key=True)
     shopcart_id = db.Column(db.Integer, db.ForeignKey('shopcart.id', ondelete="CASCADE"), nullable=False)
     name = db.Column(db.String(128), nullable=False)
     quantity = db.Column(db.Integer, nullable=False, default=0)
-    price = db.Column(db.Float, nullable=False, default=0.0)
+    price_cents = db.Column(db.BigInteger, nullable=False, default=0)
+
+    # covers the per shopcart sums, read from the index alone on PostgreSQL
+    __table_args__ = (
+        db.Index("ix_item_shopcart_id", "shopcart_id", postgresql_include=["quantity", "price_cents"]),
+    )
 
     def __repr__(self):
         return f"{type(self).__name__}({self.shopcart_id}, {self.id}, {self.name}, {self.quantity}, {self.price})"
 
+    @hybrid_property
+    def price(self):
+        """ The unit price in currency units """
+        return from_cents(self.price_cents)
+
+    @price.setter
+    def price(self, amount):
+        self.price_cents = None if amount is None else to_cents(amount)
+
+    @price.update_expression
+    def price(cls, amount):  # pylint: disable=no-self-argument
+        """ Lets update() and patch() set the price in currency units """
+        return [(cls.price_cents, to_cents(amount))]
+
+    @timed("serialize")
     def serialize(self) -> dict:
         """ Transform the self object into an item dictionary """
         return {
@@ -229,3 +893,458 @@ class Item(db.Model, ModelBase):
             raise DataValidationError(
                 f"Invalid {type(self).__name__}: {error}"
             ) from error
+
+    def create(self):
+        """ Create an item, in the shopcart it was appended to rather than the one of the request body """
+        if self.shopcart is not None:
+            self.shopcart_id = self.shopcart.id
+        super().create()
+
+    @staticmethod
+    def totals_delta(added=(), removed=()):
+        """ The change to the item count, quantity and price in cents of a shopcart, from (quantity, cents) pairs """
+        count = len(added) - len(removed)
+        quantity = sum(q for q, _ in added) - sum(q for q, _ in removed)
+        cents = sum(q * c for q, c in added) - sum(q * c for q, c in removed)
+        return count, quantity, cents
+
+    def _state_before_write(self):
+        """ The shopcart_id, name, quantity and price in cents stored before the write """
+        state = inspect(self)
+        if not state.persistent:
+            return None
+        names = ("shopcart_id", "name", "quantity", "price_cents")
+        histories = [state.attrs[name].history for name in names]
+        if any(history.added and not history.deleted for history in histories):
+            # assigned while expired: the stored value was never loaded
+            with db.session.no_autoflush:
+                query = db.session.query(Item.shopcart_id, Item.name, Item.quantity, Item.price_cents)
+                return tuple(query.filter(Item.id == self.id).one())
+        return tuple(
+            history.deleted[0] if history.deleted else getattr(self, name)
+            for name, history in zip(names, histories)
+        )
+
+    @classmethod
+    def _locked_state(cls, filters, changes: dict):
+        query = db.session.query(cls.shopcart_id, cls.name, cls.quantity, cls.price_cents).filter(*filters)
+        row = query.with_for_update().one_or_none()
+        return tuple(row) if row else None
+
+    def _record_change(self, action: str, previous=None):
+        super()._record_change(action, previous)  # the version bump locks the shopcarts for the statistics
+        if not ItemStat.enabled:
+            return
+        current = None if action == "deleted" else (self.shopcart_id, self.name, self.quantity, self.price_cents)
+        if previous and current and previous[:2] == current[:2]:
+            _, name, quantity, cents = current
+            ItemStat.add(name, 0, quantity - previous[2], quantity * cents - previous[2] * previous[3])
+            return
+        if previous:
+            ItemStat.remove_line(previous, self.id)
+        if current:
+            ItemStat.add_line(current, self.id)
+
+    def _next_version(self, action: str, previous) -> int:
+        current = (self.quantity, self.price_cents)
+        if action == "created":
+            return Shopcart.bump_version(self.shopcart_id, *self.totals_delta(added=[current]))
+        if previous is None:
+            return Shopcart.bump_version(self.shopcart_id)
+        previous_shopcart_id, _, *stored = previous
+        if action == "deleted":
+            return Shopcart.bump_version(previous_shopcart_id, *self.totals_delta(removed=[stored]))
+        if previous_shopcart_id != self.shopcart_id:  # moved to another shopcart
+            Shopcart.bump_version(previous_shopcart_id, *self.totals_delta(removed=[stored]))
+            return Shopcart.bump_version(self.shopcart_id, *self.totals_delta(added=[current]))
+        return Shopcart.bump_version(self.shopcart_id, *self.totals_delta(added=[current], removed=[stored]))
+
+    @classmethod
+    def deserialize_patch(cls, data) -> dict:
+        """
+        Transform a JSON Merge Patch document into the item columns to update
+
+        Args:
+            data (dict): the members of the item to change
+        """
+        if not isinstance(data, dict):
+            raise DataValidationError(f"Invalid {cls.__name__}: patch must be a JSON object")
+        unknown = set(data) - {"name", "quantity", "price"}
+        if unknown:
+            raise DataValidationError(f"Invalid {cls.__name__}: cannot patch {', '.join(sorted(unknown))}")
+        changes = {}
+        if "name" in data:
+            changes["name"] = _patched_name(cls, data["name"])
+        try:
+            if "quantity" in data:
+                if isinstance(data["quantity"], bool) or not math.isclose(int(data["quantity"]), data["quantity"]):
+                    raise ValueError("quantity must be an integer")
+                changes["quantity"] = int(data["quantity"])
+            if "price" in data:
+                if isinstance(data["price"], bool):
+                    raise ValueError("price must be a number")
+                changes["price_cents"] = to_cents(float(data["price"]))
+        except (TypeError, ValueError) as error:
+            raise DataValidationError(f"Invalid {cls.__name__}: {error}") from error
+        return changes
+
+
+def _patched_name(cls, name) -> str:
+    """ Validate a name member of a merge patch """
+    if not isinstance(name, str) or not name.strip():
+        raise DataValidationError(
+            f"Invalid {cls.__name__}: name should contain at least one non-whitespace char"
+        )
+    return name.strip()
+
+
+class IdempotencyKey(db.Model):
+    """ The stored responses of requests sent with an Idempotency-Key header """
+
+    # Table Schema
+    key = db.Column(db.String(255), primary_key=True)
+    fingerprint = db.Column(db.String(320), nullable=False)  # method, path and body hash
+    status_code = db.Column(db.Integer, nullable=True)  # NULL while the first request is in flight
+    body = db.Column(db.Text, nullable=True)
+    locked_at = db.Column(db.Float, nullable=False)
+    expires_at = db.Column(db.Float, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.key}, {self.status_code})"
+
+    @classmethod
+    def claim(cls, key, fingerprint, ttl, lock_timeout):
+        """
+        Claim a key for the current request
+
+        Returns None when the caller owns the key and must execute the request,
+        or the IdempotencyKey of the request that claimed it first.
+        """
+        now = time.time()
+        record = cls(key=key, fingerprint=fingerprint, locked_at=now, expires_at=now + ttl)
+        db.session.add(record)
+        try:
+            db.session.commit()
+            return None
+        except IntegrityError:
+            db.session.rollback()
+
+        existing = db.session.get(cls, key, populate_existing=True)
+        if existing is None:  # released in the meantime
+            return cls.claim(key, fingerprint, ttl, lock_timeout)
+        abandoned = existing.status_code is None and existing.locked_at < now - lock_timeout
+        if existing.expires_at < now or abandoned:
+            logger.info("Taking over expired %s", existing)
+            existing.fingerprint = fingerprint
+            existing.status_code = existing.body = None
+            existing.locked_at = now
+            existing.expires_at = now + ttl
+            db.session.commit()
+            return None
+        return existing
+
+    @classmethod
+    def find(cls, key):
+        """ Reload a key as committed by other requests """
+        db.session.rollback()  # start a new transaction to see their commits
+        return db.session.get(cls, key, populate_existing=True)
+
+    @classmethod
+    def complete(cls, key, status_code, body):
+        """ Store the response of the request that claimed the key """
+        record = db.session.get(cls, key)
+        record.status_code = status_code
+        record.body = body
+        db.session.commit()
+
+    @classmethod
+    def release(cls, key):
+        """ Give up a claimed key so that a retry executes the request, even past the deadline of the request """
+        db.session.rollback()
+        with deadline.suspended():
+            db.session.query(cls).filter(cls.key == key, cls.status_code.is_(None)).delete()
+            db.session.commit()
+
+    @classmethod
+    def purge_expired(cls):
+        """ Delete the keys whose TTL has elapsed """
+        count = db.session.query(cls).filter(cls.expires_at < time.time()).delete()
+        db.session.commit()
+        return count
+
+
+class IdBlock(db.Model):
+    """ The next shopcart and item ids, which the workers reserve in blocks on shard 0 while sharded """
+
+    # Table Schema
+    name = db.Column(db.String(63), primary_key=True)  # the table of the ids
+    next_id = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name}, {self.next_id})"
+
+    @classmethod
+    def reserve(cls, name: str, size: int) -> int:
+        """ Reserve the next ids of a table, in a transaction of its own, and return the first one """
+        table = cls.__table__
+        statement = update(table).where(table.c.name == name).values(next_id=table.c.next_id + size)
+        with db.engines[None].connect() as connection:
+            while True:
+                end = connection.execute(statement.returning(table.c.next_id)).scalar()
+                if end is not None:
+                    connection.commit()
+                    return end - size
+                first = cls._first_free(name)
+                try:
+                    connection.execute(insert(table).values(name=name, next_id=first + size))
+                    connection.commit()
+                    return first
+                except IntegrityError:
+                    connection.rollback()  # another worker started the table first
+
+    @staticmethod
+    def _first_free(name: str) -> int:
+        """ The id after the largest one of the table on any shard, archived shopcarts included """
+        models = {"shopcart": (Shopcart, ArchivedShopcart), "item": (Item,)}[name]
+        largest = 0
+        for engine in sharding.engines(db.engines):
+            with engine.connect() as connection:
+                for model in models:
+                    largest = max(largest, connection.execute(select(func.max(model.id))).scalar() or 0)
+        return largest + 1
+
+
+class OutboxEvent(db.Model):
+    """ The change events waiting to be published to downstream services """
+
+    # written with every change while enabled, see service.common.outbox
+    enabled = False
+
+    # Table Schema
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.Float, nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # the change event as JSON
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.id}, {self.created_at})"
+
+    @classmethod
+    def record(cls, change: dict):
+        """ Add a change to the outbox, in the transaction of the change """
+        db.session.add(cls(created_at=time.time(), payload=json.dumps(change)))
+
+    def message(self) -> dict:
+        """ The event sent to the downstream services """
+        return {"outbox_id": self.id, "created_at": self.created_at, **json.loads(self.payload)}
+
+    @classmethod
+    def next_batch(cls, size: int):
+        """ Lock the oldest pending events, skipping those another publisher holds """
+        query = db.session.query(cls).order_by(cls.id).limit(size)
+        return query.with_for_update(skip_locked=True).all()
+
+    @classmethod
+    def remove(cls, ids):
+        """ Delete published events """
+        db.session.query(cls).filter(cls.id.in_(ids)).delete(synchronize_session=False)
+
+
+class ArchivedShopcart(db.Model):
+    """ A shopcart moved out of the hot tables, with its items, as compressed JSON """
+
+    # Table Schema
+    id = db.Column(db.Integer, primary_key=True)  # the id of the shopcart
+    name = db.Column(db.String(63), nullable=False, index=True)
+    version = db.Column(db.Integer, nullable=False)
+    item_count = db.Column(db.Integer, nullable=False)
+    total_price_cents = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, index=True)
+    payload = db.Column(db.LargeBinary, nullable=False)  # the serialized shopcart, zlib compressed
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.id}, {self.name}, {self.archived_at})"
+
+    @classmethod
+    def from_shopcart(cls, shopcart, version: int, archived_at):
+        """ The archive row of a shopcart """
+        data = dict(shopcart.serialize(), version=version)
+        return cls(
+            id=shopcart.id, name=shopcart.name, version=version, item_count=shopcart.item_count,
+            total_price_cents=shopcart.total_price_cents, created_at=shopcart.created_at, updated_at=shopcart.updated_at,
+            archived_at=archived_at, payload=zlib.compress(json.dumps(data).encode("utf-8")),
+        )
+
+    def serialize(self) -> dict:
+        """ The shopcart as it was archived """
+        data = json.loads(zlib.decompress(self.payload))
+        data["archived_at"] = _isoformat(self.archived_at)
+        return data
+
+    @classmethod
+    @timed("hydrate")
+    def lookup(cls, shopcart_id):
+        """ The archived shopcart with its items, or None when it is not archived """
+        logger.info("Look up %s id=%s", cls.__name__, shopcart_id)
+        archived = db.session.get(cls, shopcart_id)
+        return archived.serialize() if archived else None
+
+    @classmethod
+    def restore(cls, shopcart_id):
+        """ Move an archived shopcart back to the hot tables, or return None when it is not archived """
+        logger.info("Restore %s id=%s", cls.__name__, shopcart_id)
+        archived = db.session.get(cls, shopcart_id, with_for_update=True)
+        if archived is None:
+            return None
+        data = archived.serialize()
+        shopcart = Shopcart(
+            id=archived.id, name=archived.name, version=archived.version + 1,
+            item_count=data["item_count"], total_quantity=data["total_quantity"], total_price=data["total_price"],
+            created_at=archived.created_at, updated_at=utcnow(),
+            items=[Item(id=item["id"], name=item["name"], quantity=item["quantity"], price=item["price"])
+                   for item in data["items"]],
+        )
+        db.session.delete(archived)
+        db.session.add(shopcart)
+        db.session.flush()
+        shopcart._record_change("restored")  # pylint: disable=protected-access
+        shopcart._commit()  # pylint: disable=protected-access
+        return shopcart
+
+
+class ItemStat(db.Model):
+    """
+    How many shopcarts hold each item name, and in what quantity, maintained by the item writes
+
+    The writes lock the shopcart row before looking at its other items, so that
+    concurrent writes to a shopcart count its items one after the other.
+    """
+
+    # maintained while enabled, rebuild() once re-enabled
+    enabled = True
+
+    # Table Schema
+    name = db.Column(db.String(128), primary_key=True)
+    cart_count = db.Column(db.Integer, nullable=False, default=0)  # shopcarts with an item of this name
+    total_quantity = db.Column(db.Integer, nullable=False, default=0)
+    total_value_cents = db.Column(db.BigInteger, nullable=False, default=0)  # sum of quantity times price in cents
+
+    __table_args__ = (db.Index("ix_item_stat_rank", "cart_count", "total_quantity"),)
+
+    @hybrid_property
+    def total_value(self):
+        """ The sum of quantity times price in currency units """
+        return from_cents(self.total_value_cents)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name}, {self.cart_count}, {self.total_quantity}, {self.total_value})"
+
+    def serialize(self) -> dict:
+        """ Transform the self object into a dictionary """
+        return {
+            "name": self.name,
+            "cart_count": self.cart_count,
+            "total_quantity": self.total_quantity,
+            "total_value": self.total_value,
+        }
+
+    @classmethod
+    def add(cls, name, carts, quantity, cents):
+        """ Add to the statistics of an item name with a single upsert """
+        if not (carts or quantity or cents):
+            return
+        dialects = {"postgresql": postgresql, "sqlite": sqlite}
+        dialect = dialects.get(db.session.get_bind().dialect.name)
+        if dialect is None:
+            cls._add_portably(name, carts, quantity, cents)
+            return
+        statement = dialect.insert(cls).values(
+            name=name, cart_count=carts, total_quantity=quantity, total_value_cents=cents
+        )
+        db.session.execute(statement.on_conflict_do_update(index_elements=[cls.name], set_={
+            "cart_count": cls.cart_count + statement.excluded.cart_count,
+            "total_quantity": cls.total_quantity + statement.excluded.total_quantity,
+            "total_value_cents": cls.total_value_cents + statement.excluded.total_value_cents,
+        }))
+
+    @classmethod
+    def _add_portably(cls, name, carts, quantity, cents):
+        """ Update, or insert the name when it has no statistics yet """
+        updated = db.session.execute(update(cls).where(cls.name == name).values(
+            cart_count=cls.cart_count + carts,
+            total_quantity=cls.total_quantity + quantity,
+            total_value_cents=cls.total_value_cents + cents,
+        ).execution_options(synchronize_session=False)).rowcount
+        if not updated:
+            db.session.add(cls(name=name, cart_count=carts, total_quantity=quantity, total_value_cents=cents))
+            db.session.flush()
+
+    @staticmethod
+    def _shopcart_has(shopcart_id, name, except_ids) -> bool:
+        """ True if other items of the shopcart have the name """
+        query = db.session.query(Item.id).filter(
+            Item.shopcart_id == shopcart_id, Item.name == name, Item.id.notin_(except_ids)
+        )
+        return db.session.query(query.exists()).scalar()
+
+    @classmethod
+    def add_line(cls, line: tuple, item_id):
+        """ Count an item written to a shopcart, from its shopcart_id, name, quantity and price in cents """
+        shopcart_id, name, quantity, cents = line
+        carts = 0 if cls._shopcart_has(shopcart_id, name, [item_id]) else 1
+        cls.add(name, carts, quantity, quantity * cents)
+
+    @classmethod
+    def remove_line(cls, line: tuple, item_id):
+        """ Forget an item removed from a shopcart, or whose name or shopcart changed, from its stored line """
+        shopcart_id, name, quantity, cents = line
+        carts = 0 if cls._shopcart_has(shopcart_id, name, [item_id]) else -1
+        cls.add(name, carts, -quantity, -quantity * cents)
+
+    @classmethod
+    def add_items(cls, shopcart_id, items):
+        """ Count the items added to a shopcart along with it """
+        by_name = {}
+        for item in items:
+            by_name.setdefault(item.name, []).append(item)
+        for name, named in by_name.items():
+            carts = 0 if cls._shopcart_has(shopcart_id, name, [item.id for item in named]) else 1
+            cls.add(name, carts, sum(item.quantity for item in named),
+                    sum(item.quantity * item.price_cents for item in named))
+
+    @classmethod
+    def remove_shopcart(cls, shopcart_id):
+        """ Forget every item of a shopcart about to be emptied """
+        cls.remove_shopcarts([shopcart_id])
+
+    @classmethod
+    def remove_shopcarts(cls, shopcart_ids):
+        """ Forget every item of the shopcarts about to be emptied """
+        lines = db.session.query(
+            Item.name, func.count(Item.shopcart_id.distinct()), func.sum(Item.quantity),
+            func.sum(Item.quantity * Item.price_cents)
+        ).filter(Item.shopcart_id.in_(shopcart_ids)).group_by(Item.name)
+        for name, carts, quantity, cents in lines.all():
+            cls.add(name, -carts, -quantity, -cents)
+
+    @classmethod
+    def top(cls, limit: int):
+        """ The item names held by the most shopcarts, then in the largest quantity """
+        query = db.session.query(cls).filter(cls.cart_count > 0)
+        return query.order_by(cls.cart_count.desc(), cls.total_quantity.desc()).limit(limit).all()
+
+    @classmethod
+    def rebuild(cls):
+        """ Recompute the statistics of every item name from the items """
+        logger.info("Rebuild %s", cls.__name__)
+        db.session.query(cls).delete()
+        lines = select(
+            Item.name,
+            func.count(Item.shopcart_id.distinct()),
+            func.sum(Item.quantity),
+            func.sum(Item.quantity * Item.price_cents),
+        ).group_by(Item.name)
+        db.session.execute(insert(cls).from_select(["name", "cart_count", "total_quantity", "total_value_cents"], lines))
+        db.session.commit()
+        return db.session.query(cls).count()
@@ -5,27 +5,49 @@ GET  /
 
 GET  /health
 
+GET  /metrics
+
 GET  /shopcarts
 POST /shopcarts
 GET  /shopcarts/{shopcart_id}
 PUT  /shopcarts/{shopcart_id}
+PATCH /shopcarts/{shopcart_id}
 DELETE /shopcarts/{shopcart_id}
+PUT  /shopcarts/{shopcart_id}/restore
+
+GET  /shopcarts/events
+GET  /shopcarts/{shopcart_id}/events
+
+POST /batch
+
+GET  /analytics/top-items
 
 GET  /shopcarts/{shopcart_id}/items
 POST /shopcarts{shopcart_id}/items
 GET  /shopcarts/{shopcart_id}/items/{item_id}
 PUT  /shopcarts/{shopcart_id}/items/{item_id}
+PATCH /shopcarts/{shopcart_id}/items/{item_id}
 DELETE /shopcarts/{shopcart_id}/items/{item_id}
 """
+# pylint: disable=too-many-lines
 
-from flask import request, abort
+import io
+import json
+
+from flask import Response, g, request, abort
 from flask_restx import Resource, fields, reqparse
+from werkzeug.exceptions import HTTPException
 
-from service.common import status  # HTTP Status Codes
-from service.models import Shopcart, Item, DataValidationError
+from service.common import change_feed, deadline, metrics, sharding, singleflight, status  # HTTP Status Codes
+from service.common.idempotency import idempotent
+from service.common.timing import span
+from service.models import (
+    ArchivedShopcart, Shopcart, Item, ItemStat, DataValidationError, atomic, from_cents, in_atomic, to_cents
+)
 from . import app, api
 
 DEFAULT_CONTENT_TYPE = "application/json"
+MERGE_PATCH_CONTENT_TYPE = "application/merge-patch+json"
 
 item_base_model = api.model(
     "ItemBaseModel",
@@ -77,14 +99,99 @@ shopcart_model = api.inherit(
         "id": fields.Integer(
             readOnly=True, description="The unique id assigned internally by service"
         ),
+        "version": fields.Integer(
+            readOnly=True, description="Incremented by every change to the shopcart or its items"
+        ),
+        "item_count": fields.Integer(readOnly=True, description="Number of items in the shopcart"),
+        "total_quantity": fields.Integer(readOnly=True, description="Sum of the item quantities"),
+        "total_price": fields.Float(readOnly=True, description="Sum of the item quantities times their price"),
+        "created_at": fields.String(readOnly=True, description="UTC time the shopcart was created (ISO 8601)"),
+        "updated_at": fields.String(readOnly=True, description="UTC time of the last change to the shopcart (ISO 8601)"),
+        "archived_at": fields.String(
+            readOnly=True, description="UTC time the shopcart was archived (ISO 8601), null while it is not"
+        ),
         "items": fields.List(fields.Nested(item_model))
     },
 )
 
+CHANGE_FEED_PARAMS = {
+    "Last-Event-ID": {
+        "in": "header",
+        "description": "Resume the stream after this event",
+    }
+}
+
+IDEMPOTENCY_PARAMS = {
+    "Idempotency-Key": {
+        "in": "header",
+        "description": "Replays the stored response when the request is retried with the same key",
+    }
+}
+
+# Concurrent identical reads of a worker share one query and serialize()
+shopcart_reads = singleflight.Group("shopcart_reads")
+shopcart_reads.enabled = app.config["SINGLE_FLIGHT_ENABLED"]
+
+batch_operation_model = api.model(
+    "BatchOperationModel",
+    {
+        "method": fields.String(
+            required=True,
+            enum=["GET", "POST", "PUT", "PATCH", "DELETE"],
+            description="HTTP method of the operation"
+        ),
+        "path": fields.String(
+            required=True,
+            description="Resource path relative to the API prefix, e.g. /shopcarts/1/items"
+        ),
+        "body": fields.Raw(
+            required=False,
+            description="JSON body of the operation"
+        )
+    },
+)
+
+batch_model = api.model(
+    "BatchModel",
+    {
+        "operations": fields.List(
+            fields.Nested(batch_operation_model),
+            required=True,
+            description="Operations executed in order in a single transaction"
+        )
+    },
+)
+
 shopcart_args = reqparse.RequestParser()
 shopcart_args.add_argument(
     "name", type=str, location="args", required=False, help="List Shopcarts by name"
 )
+shopcart_args.add_argument(
+    "limit", type=int, location="args", required=False,
+    help="Return a page of at most this many Shopcarts, ordered by id"
+)
+shopcart_args.add_argument(
+    "after", type=int, location="args", required=False,
+    help="Return the page after this Shopcart id, as given by the X-Next-Cursor header"
+)
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+item_stat_model = api.model(
+    "ItemStatModel",
+    {
+        "name": fields.String(description="The name of the Items"),
+        "cart_count": fields.Integer(description="The number of Shopcarts holding an Item of this name"),
+        "total_quantity": fields.Integer(description="The quantity of the Items across the Shopcarts"),
+        "total_value": fields.Float(description="The sum of the quantity times the price of the Items"),
+    },
+)
+
+top_items_args = reqparse.RequestParser()
+top_items_args.add_argument(
+    "limit", type=int, location="args", required=False, default=10,
+    help="Return at most this many item names"
+)
 
 
 ############################################################
@@ -97,6 +204,16 @@ def health():
     return {"status": 'OK'}, status.HTTP_200_OK
 
 
+############################################################
+# Metrics Endpoint
+############################################################
+
+@app.route("/metrics")
+def get_metrics():
+    """Counters and gauges of this worker"""
+    return metrics.snapshot(), status.HTTP_200_OK
+
+
 ######################################################################
 # GET INDEX
 ######################################################################
@@ -123,21 +240,21 @@ def itemsapi():
 #  U T I L I T Y  F U N C T I O N S
 ######################################################################
 
-def check_content_type(expected_content_type):
+def check_content_type(*expected_content_types):
     """ Verify and abort if not expected content type """
     content_type = request.headers.get("Content-Type")
     if not content_type:
         app.logger.error("No Content-Type specified.")
         abort(
             status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-            f"Content-Type must be {expected_content_type}"
+            f"Content-Type must be {' or '.join(expected_content_types)}"
         )
 
-    if content_type != expected_content_type:
+    if content_type not in expected_content_types:
         app.logger.error("Invalid Content-Type: %s", content_type)
         abort(
             status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
-            f"Content-Type must be {expected_content_type}"
+            f"Content-Type must be {' or '.join(expected_content_types)}"
         )
 
 
@@ -161,6 +278,56 @@ def check_item_id(item_id):
         )
 
 
+def coalesced(key, function):
+    """ Share concurrent identical reads of the same database, except for uncommitted batch state """
+    if in_atomic() or g.get("read_your_writes"):
+        return function()  # a read in flight may have started before the write of the client
+    try:
+        return shopcart_reads.do(("replica" if g.get("replica") else "primary",) + key, function)
+    except deadline.DeadlineExceeded:
+        deadline.check()
+        return function()  # only the deadline of the request that ran the read has passed
+
+
+def load_archived(shopcart_id):
+    """ Serialized archived Shopcart, or None when it is not archived either """
+    archived = ArchivedShopcart.lookup(shopcart_id)
+    if archived:
+        metrics.increment("archive.hits")
+    return archived
+
+
+def load_shopcart(shopcart_id):
+    """ Serialized Shopcart, from the archive when it is not in the hot tables, or None when it does not exist """
+    shopcart = Shopcart.get_with_items(shopcart_id)
+    return shopcart.serialize() if shopcart else load_archived(shopcart_id)
+
+
+def load_items(shopcart_id):
+    """ Serialized Items of a Shopcart, from the archive when it is not in the hot tables, or None """
+    shopcart = Shopcart.get_with_items(shopcart_id)
+    if shopcart is None:
+        archived = load_archived(shopcart_id)
+        return archived["items"] if archived else None
+    return [item.serialize() for item in deadline.checked(shopcart.items)]
+
+
+def load_shopcarts_by_name(name):
+    """ Serialized Shopcarts matching the name, on every shard """
+    def load():
+        with span("hydrate"):
+            shopcarts = list(Shopcart.find_by_name(name))
+        return [shopcart.serialize() for shopcart in deadline.checked(shopcarts)]
+    return merged_shopcarts(sharding.gather(load))
+
+
+def merged_shopcarts(parts):
+    """ The serialized Shopcarts gathered from every shard, by id """
+    if len(parts) == 1:
+        return parts[0]
+    return sorted((shopcart for part in parts for shopcart in part), key=lambda shopcart: shopcart["id"])
+
+
 ######################################################################
 # S H O P C A R T   A P I S
 ######################################################################
@@ -174,6 +341,7 @@ class ShopcartResource(Resource):
     Allows the manipulation of a single Shopcart:
     GET /shopcarts/<int:shopcart_id> - Get a Shopcart according to shopcart_id
     PUT /shopcarts/<int:shopcart_id> - Update a Shopcart according to shopcart_id
+    PATCH /shopcarts/<int:shopcart_id> - Partially update a Shopcart according to shopcart_id
     DELETE /shopcarts/<int:shopcart_id> - Delete a Shopcart according to shopcart_id
     """
 
@@ -189,14 +357,14 @@ class ShopcartResource(Resource):
         check_shopcart_id(shopcart_id)
 
         app.logger.info("Request for Shopcart with id: %s", shopcart_id)
-        shopcart = Shopcart.get_by_id(shopcart_id)
-        if not shopcart:
+        shopcart_js = coalesced(("shopcart", int(shopcart_id)), lambda: load_shopcart(shopcart_id))
+        if not shopcart_js:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Shopcart with id '{shopcart_id}' could not be found."
             )
-        app.logger.info("Returning shopcart: %s", shopcart.id)
-        return shopcart.serialize(), status.HTTP_200_OK
+        app.logger.info("Returning shopcart: %s", shopcart_js["id"])
+        return shopcart_js, status.HTTP_200_OK
 
     @api.doc("update_shopcarts")
     @api.response(404, "Shopcart not found")
@@ -226,10 +394,40 @@ class ShopcartResource(Resource):
             shopcart.deserialize(data)
         except DataValidationError as error:
             abort(status.HTTP_400_BAD_REQUEST, error.message)
-        shopcart.id = shopcart_id
+        shopcart.id = int(shopcart_id)
         shopcart.update()
         return shopcart.serialize(), status.HTTP_200_OK
 
+    @api.doc("patch_shopcarts")
+    @api.response(404, "Shopcart not found")
+    @api.response(400, "The patch document was not valid")
+    @api.response(415, "Invalid header content-type")
+    @api.expect(shopcart_base_model)
+    @api.marshal_with(shopcart_model)
+    def patch(self, shopcart_id):
+        """
+        Partially update a Shopcart
+
+        This endpoint will apply the JSON Merge Patch in the body to the Shopcart according to the shopcart_id
+        specified in the path, updating only the members it contains.
+        """
+        check_shopcart_id(shopcart_id)
+        check_content_type(MERGE_PATCH_CONTENT_TYPE, DEFAULT_CONTENT_TYPE)
+
+        app.logger.info("Request to patch shopcart with id: %s", shopcart_id)
+        try:
+            changes = Shopcart.deserialize_patch(api.payload)
+        except DataValidationError as error:
+            abort(status.HTTP_400_BAD_REQUEST, error.message)
+
+        shopcart = Shopcart.patch(int(shopcart_id), changes)
+        if not shopcart:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Shopcart with id '{shopcart_id}' was not found."
+            )
+        return shopcart.serialize(), status.HTTP_200_OK
+
     @api.doc("delete_shopcarts")
     @api.response(204, "Shopcart deleted")
     def delete(self, shopcart_id):
@@ -247,6 +445,42 @@ class ShopcartResource(Resource):
         return "", status.HTTP_204_NO_CONTENT
 
 
+@api.route("/shopcarts/<shopcart_id>/restore")
+@api.param("shopcart_id", "The Shopcart identifier")
+class RestoreShopcartResource(Resource):
+    """
+    RestoreShopcartResource Class
+
+    Allows the manipulation of an archived Shopcart:
+    PUT /shopcarts/<int:shopcart_id>/restore - Move an archived Shopcart back to the hot tables
+    """
+
+    @api.doc("restore_shopcarts")
+    @api.response(404, "Archived shopcart not found")
+    @api.response(409, "Another shopcart holds the id")
+    @api.marshal_with(shopcart_model)
+    def put(self, shopcart_id):
+        """
+        Restore a Shopcart
+
+        This endpoint will move the archived Shopcart with the shopcart_id specified in the path back to the hot
+        tables, so it can be changed again.
+        """
+        check_shopcart_id(shopcart_id)
+
+        app.logger.info("Request to restore shopcart with id: %s", shopcart_id)
+        if Shopcart.get_by_id(shopcart_id):
+            abort(status.HTTP_409_CONFLICT, f"A shopcart with id '{shopcart_id}' already exists.")
+        shopcart = ArchivedShopcart.restore(shopcart_id)
+        if not shopcart:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Archived shopcart with id '{shopcart_id}' could not be found.",
+            )
+        metrics.increment("archive.restored")
+        return shopcart.serialize(), status.HTTP_200_OK
+
+
 @api.route("/shopcarts/<shopcart_id>/clear")
 @api.param("shopcart_id”, “The Shopcart identifier")
 class ClearShopcartResource(Resource):
@@ -275,16 +509,79 @@ class ClearShopcartResource(Resource):
                 status.HTTP_404_NOT_FOUND,
                 f"Shopcart with id '{shopcart_id}' could not be found.",
             )
-        app.logger.info("Returning shopcart: %s", shopcart_id)
         app.logger.info("Request to clear shopcart with id: %s", shopcart_id)
-        shopcart = Shopcart.get_by_id(shopcart_id)
-        for item in shopcart.items:
-            item.delete()
-            app.logger.info("Deleted item '%s' in shopcart with id='%s'.", item, shopcart_id)
-        shopcart.update()
+        shopcart.clear()
         return shopcart.serialize(), status.HTTP_200_OK
 
 
+######################################################################
+# C H A N G E   F E E D
+######################################################################
+
+def stream_changes(shopcart_id=None):
+    """ Stream the committed changes as Server-Sent Events """
+    subscription = change_feed.broker.subscribe(shopcart_id, request.headers.get("Last-Event-ID"))
+    events = change_feed.broker.stream(
+        subscription, app.config["CHANGE_FEED_HEARTBEAT_SECONDS"], app.config["CHANGE_FEED_MAX_SECONDS"]
+    )
+    response = Response(events, mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.call_on_close(lambda: change_feed.broker.unsubscribe(subscription))
+    return response
+
+
+@api.route("/shopcarts/events")
+class ShopcartEventsResource(Resource):
+    """
+    ShopcartEventsResource Class
+
+    GET /shopcarts/events - Stream the changes of every Shopcart
+    """
+
+    @api.doc("stream_shopcart_events", params=CHANGE_FEED_PARAMS)
+    @api.produces(["text/event-stream"])
+    def get(self):
+        """
+        Stream the changes of every Shopcart
+
+        This endpoint streams a Server-Sent Event for every shopcart and item created, updated,
+        cleared or deleted, with the new version of the shopcart.
+        """
+        app.logger.info("Request to stream the changes of all shopcarts")
+        return stream_changes()
+
+
+@api.route("/shopcarts/<shopcart_id>/events")
+@api.param("shopcart_id", "The Shopcart identifier")
+class ShopcartChangesResource(Resource):
+    """
+    ShopcartChangesResource Class
+
+    GET /shopcarts/{shopcart_id}/events - Stream the changes of a Shopcart
+    """
+
+    @api.doc("stream_shopcart_changes", params=CHANGE_FEED_PARAMS)
+    @api.response(404, "Shopcart not found")
+    @api.produces(["text/event-stream"])
+    def get(self, shopcart_id):
+        """
+        Stream the changes of a Shopcart
+
+        This endpoint streams a Server-Sent Event for every change to the Shopcart specified in the path
+        and to its items, with the new version of the shopcart.
+        """
+        check_shopcart_id(shopcart_id)
+
+        app.logger.info("Request to stream the changes of shopcart with id: %s", shopcart_id)
+        if not Shopcart.get_by_id(int(shopcart_id)):
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Shopcart with id '{shopcart_id}' could not be found.",
+            )
+        return stream_changes(int(shopcart_id))
+
+
 @api.route("/shopcarts", strict_slashes=False)
 class ShopcartCollection(Resource):
     """
@@ -295,11 +592,14 @@ class ShopcartCollection(Resource):
     GET /shopcarts - List all Shopcarts
     """
 
-    @api.doc("create_shopcarts")
+    @api.doc("create_shopcarts", params=IDEMPOTENCY_PARAMS)
     @api.response(400, "Invalid shopcart request body")
+    @api.response(409, "A request with the same Idempotency-Key is in progress")
+    @api.response(422, "The Idempotency-Key was used for a different request")
     @api.response(415, "Invalid header content-type")
     @api.expect(shopcart_base_model)
     @api.marshal_with(shopcart_model, code=201)
+    @idempotent
     def post(self):
         """
         Create a Shopcart
@@ -317,8 +617,9 @@ class ShopcartCollection(Resource):
         app.logger.info("Request body deserialized to shopcart")
 
         shopcart.create()  # store in table
-        app.logger.info("New shopcart created with id=%s", shopcart.id)
-        shopcart_js = shopcart.serialize()
+        with deadline.suspended():  # committed: a retry would only replay the response
+            app.logger.info("New shopcart created with id=%s", shopcart.id)
+            shopcart_js = shopcart.serialize()
         return shopcart_js, status.HTTP_201_CREATED
 
     @api.doc("list_shopcarts")
@@ -328,23 +629,47 @@ class ShopcartCollection(Resource):
         """
         List all Shopcarts
 
-        This endpoint will list all Shopcarts in the system.
+        This endpoint will list all Shopcarts in the system, or a page of them when a limit is given.
+        The X-Next-Cursor header of a page holds the "after" value of the next page, if any.
         """
         app.logger.info("Request to list all Shopcarts")
-        shopcarts = []
         args = shopcart_args.parse_args()
+        if args["limit"] is not None:
+            return list_shopcarts_page(args)
         if args["name"]:
             app.logger.info("Filtering by name: %s", args["name"])
-            shopcarts = list(Shopcart.find_by_name(args["name"]))
+            name = args["name"]
+            results = coalesced(("name", name), lambda: load_shopcarts_by_name(name))
         else:
             app.logger.info("Returning unfiltered list")
-            shopcarts = Shopcart.get_all()
+            results = merged_shopcarts(sharding.gather(
+                lambda: [shopcart.serialize() for shopcart in deadline.checked(Shopcart.get_all())]
+            ))
 
-        app.logger.info("[%s] Shopcarts returned", len(shopcarts))
-        results = [shopcart.serialize() for shopcart in shopcarts]
+        app.logger.info("[%s] Shopcarts returned", len(results))
         return results, status.HTTP_200_OK
 
 
+def list_shopcarts_page(args):
+    """ A page of Shopcarts and the cursor of the next one """
+    limit = args["limit"]
+    if limit <= 0:
+        abort(status.HTTP_400_BAD_REQUEST, "limit must be positive.")
+    limit = min(limit, app.config["PAGE_SIZE_MAX"])
+
+    def load_page():
+        shopcarts, has_more = Shopcart.get_page(limit, after=args["after"], name=args["name"])
+        return [shopcart.serialize() for shopcart in deadline.checked(shopcarts)], has_more
+
+    pages = sharding.gather(load_page)
+    results = merged_shopcarts([page for page, _ in pages])
+    has_more = len(results) > limit or any(more for _, more in pages)
+    results = results[:limit]
+    headers = {NEXT_CURSOR_HEADER: str(results[-1]["id"])} if has_more else {}
+    app.logger.info("[%s] Shopcarts returned", len(results))
+    return results, status.HTTP_200_OK, headers
+
+
 ######################################################################
 # I T E M   A P I S
 ######################################################################
@@ -360,12 +685,15 @@ class ItemCollection(Resource):
     GET /shopcarts/<int:shopcart_id>/items - List all items in the Shopcart according to shopcart_id
     """
 
-    @api.doc("create_items")
+    @api.doc("create_items", params=IDEMPOTENCY_PARAMS)
     @api.response(400, "Invalid item request body")
+    @api.response(409, "A request with the same Idempotency-Key is in progress")
+    @api.response(422, "The Idempotency-Key was used for a different request")
     @api.response(404, "Shopcart not found")
     @api.response(415, "Invalid header content-type")
     @api.expect(item_base_model)
     @api.marshal_with(item_model, code=201)
+    @idempotent
     def post(self, shopcart_id):
         """
         Create an Item
@@ -407,10 +735,10 @@ class ItemCollection(Resource):
             )
 
         shopcart.items.append(item)
-        shopcart.update()
-        app.logger.info("New item with id=%s added to shopcart with id=%s.", item.id, shopcart.id)
-
-        item_js = item.serialize()
+        item.create()
+        with deadline.suspended():  # committed: a retry would only replay the response
+            app.logger.info("New item with id=%s added to shopcart with id=%s.", item.id, shopcart.id)
+            item_js = item.serialize()
         return item_js, status.HTTP_201_CREATED
 
     @api.doc("list_items")
@@ -425,15 +753,14 @@ class ItemCollection(Resource):
         check_shopcart_id(shopcart_id)
 
         app.logger.info("Get items in the shopcart with id=%s", shopcart_id)
-        shopcart = Shopcart.get_by_id(shopcart_id)
-        if not shopcart:
+        items = coalesced(("items", shopcart_id), lambda: load_items(shopcart_id))
+        if items is None:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Shopcart with id='{shopcart_id}' was not found."
             )
-        app.logger.info("Found shopcart with id=%s", shopcart.id)
+        app.logger.info("Found shopcart with id=%s", shopcart_id)
 
-        items = [item.serialize() for item in shopcart.items]
         return items, status.HTTP_200_OK
 
 
@@ -447,6 +774,7 @@ class ItemResource(Resource):
     Allows the manipulation of a single Item:
     GET /shopcarts/{shopcart_id}/items/{item_id} - Get an Item according to shopcart_id and item_id
     PUT /shopcarts/{shopcart_id}/items/{item_id} - Update an Item according to shopcart_id and item_id
+    PATCH /shopcarts/{shopcart_id}/items/{item_id} - Partially update an Item according to shopcart_id and item_id
     DELETE /shopcarts/{shopcart_id}/items/{item_id} - Delete an Item according to shopcart_id and item_id
     """
 
@@ -485,6 +813,7 @@ class ItemResource(Resource):
     @api.doc("update_items")
     @api.response(404, "Shopcart or Item not found")
     @api.response(400, "The posted Item data was not valid")
+    @api.response(409, "The Item cannot move to a Shopcart on another shard")
     @api.response(415, "Invalid header content-type")
     @api.expect(item_base_model)
     @api.marshal_with(item_model)
@@ -519,6 +848,13 @@ class ItemResource(Resource):
         except DataValidationError as error:
             abort(status.HTTP_400_BAD_REQUEST, error.message)
 
+        if sharding.router.sharded and sharding.router.shard_of(item.shopcart_id) != sharding.router.shard_of(shopcart_id):
+            app.logger.error("Item %s cannot move to shopcart %s on another shard.", item_id, item.shopcart_id)
+            abort(
+                status.HTTP_409_CONFLICT,
+                f"Item with id '{item_id}' cannot move to Shopcart with id '{item.shopcart_id}' on another shard."
+            )
+
         if item.quantity <= 0:
             app.logger.error("Invalid item quantity assignment to %s.", item.quantity)
             abort(
@@ -537,6 +873,51 @@ class ItemResource(Resource):
         app.logger.info("Item with shopcart_id: %s and item_id: %s is updated successfully", shopcart_id, item_id)
         return item.serialize(), status.HTTP_200_OK
 
+    @api.doc("patch_items")
+    @api.response(404, "Shopcart or Item not found")
+    @api.response(400, "The patch document was not valid")
+    @api.response(415, "Invalid header content-type")
+    @api.expect(item_base_model)
+    @api.marshal_with(item_model)
+    def patch(self, shopcart_id, item_id):
+        """
+        Partially update an Item
+
+        This endpoint will apply the JSON Merge Patch in the body to the Item according to the shopcart_id and item_id
+        specified in the path, updating only the members it contains with a single UPDATE statement.
+        """
+        check_shopcart_id(shopcart_id)
+        check_item_id(item_id)
+        check_content_type(MERGE_PATCH_CONTENT_TYPE, DEFAULT_CONTENT_TYPE)
+
+        app.logger.info("Request to patch item with shopcart_id: %s and item_id: %s", shopcart_id, item_id)
+        try:
+            changes = Item.deserialize_patch(api.payload)
+        except DataValidationError as error:
+            abort(status.HTTP_400_BAD_REQUEST, error.message)
+
+        if changes.get("quantity", 1) <= 0:
+            app.logger.error("Invalid item quantity assignment to %s.", changes["quantity"])
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                "Quantity of the item must be positive."
+            )
+
+        if changes.get("price_cents", 0) < 0:
+            app.logger.error("Invalid item price assignment to %s.", from_cents(changes["price_cents"]))
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                "Price of the item must be positive."
+            )
+
+        item = Item.patch(int(item_id), changes, shopcart_id=int(shopcart_id))
+        if not item:
+            abort(
+                status.HTTP_404_NOT_FOUND,
+                f"Item with id '{item_id}' could not be found in Shopcart with id '{shopcart_id}'."
+            )
+        return item.serialize(), status.HTTP_200_OK
+
     @api.doc("delete_items")
     @api.response(204, 'Item deleted')
     def delete(self, shopcart_id, item_id):
@@ -553,3 +934,166 @@ class ItemResource(Resource):
             item.delete()
 
         return "", status.HTTP_204_NO_CONTENT
+
+
+######################################################################
+# A N A L Y T I C S   A P I S
+######################################################################
+
+@api.route("/analytics/top-items")
+class TopItemsResource(Resource):
+    """
+    TopItemsResource Class
+
+    GET /analytics/top-items - Returns the item names held by the most Shopcarts
+    """
+
+    @api.doc("top_items")
+    @api.expect(top_items_args, validate=True)
+    @api.response(400, "Invalid limit")
+    @api.marshal_list_with(item_stat_model)
+    def get(self):
+        """
+        Returns the item names held by the most Shopcarts
+
+        This endpoint reads the statistics the item writes keep up to date, ranked by the number
+        of Shopcarts holding each name and then by total quantity.
+        """
+        limit = top_items_args.parse_args()["limit"]
+        app.logger.info("Request for the top %s items", limit)
+        if limit <= 0:
+            abort(status.HTTP_400_BAD_REQUEST, "limit must be positive.")
+        if not ItemStat.enabled:
+            abort(status.HTTP_503_SERVICE_UNAVAILABLE, "Item statistics are disabled.")
+        limit = min(limit, app.config["TOP_ITEMS_MAX"])
+        parts = sharding.gather(lambda: [stat.serialize() for stat in ItemStat.top(limit)])
+        return merged_item_stats(parts, limit), status.HTTP_200_OK
+
+
+def merged_item_stats(parts, limit):
+    """ The top item statistics of every shard added up by name, from the top ones of each shard """
+    if len(parts) == 1:
+        return parts[0]
+    totals = {}
+    for stat in (stat for part in parts for stat in part):
+        total = totals.setdefault(stat["name"], dict(stat, cart_count=0, total_quantity=0, total_value=0.0))
+        for key in ("cart_count", "total_quantity"):
+            total[key] += stat[key]
+        total["total_value"] = from_cents(to_cents(total["total_value"]) + to_cents(stat["total_value"]))
+    ranked = sorted(totals.values(), key=lambda stat: (stat["cart_count"], stat["total_quantity"]), reverse=True)
+    return ranked[:limit]
+
+
+######################################################################
+# B A T C H   A P I
+######################################################################
+
+BATCH_METHODS = ("GET", "POST", "PUT", "PATCH", "DELETE")
+
+
+def check_batch_operations(data):
+    """ Validate the batch request body and return its operations """
+    operations = data.get("operations") if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        abort(status.HTTP_400_BAD_REQUEST, "operations must be a non-empty list.")
+    if len(operations) > app.config["BATCH_MAX_OPERATIONS"]:
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            f"A batch is limited to {app.config['BATCH_MAX_OPERATIONS']} operations."
+        )
+    for position, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get("method") not in BATCH_METHODS \
+                or not str(operation.get("path", "")).startswith("/shopcarts"):
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                f"Operation {position} must have a method in {BATCH_METHODS} and a /shopcarts path."
+            )
+    return operations
+
+
+# the parts of the batch request environ its operations share; headers such as Idempotency-Key stay behind
+BATCH_ENVIRON_KEYS = ("SERVER_NAME", "SERVER_PORT", "SERVER_PROTOCOL", "SCRIPT_NAME", "REMOTE_ADDR")
+
+
+def operation_environ(operation):
+    """ The WSGI environ of one operation of the current batch request """
+    path, _, query = operation["path"].partition("?")
+    environ = {key: value for key, value in request.environ.items()
+               if key in BATCH_ENVIRON_KEYS or (key.startswith("wsgi.") and key != "wsgi.input")}
+    environ.update({
+        "REQUEST_METHOD": operation["method"],
+        "PATH_INFO": app.config["PREFIX_API"] + path,
+        "QUERY_STRING": query,
+        "wsgi.input": io.BytesIO(),
+    })
+    if operation.get("body") is not None:
+        body = json.dumps(operation["body"]).encode("utf-8")
+        environ.update({
+            "CONTENT_TYPE": DEFAULT_CONTENT_TYPE,
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.input": io.BytesIO(body),
+        })
+    return environ
+
+
+def dispatch_operation(operation):
+    """ Run one operation through the regular resources and return its response """
+    with app.request_context(operation_environ(operation)):
+        try:
+            return app.make_response(app.dispatch_request())
+        except HTTPException as error:
+            return api.handle_error(error)
+
+
+@api.route("/batch", strict_slashes=False)
+class BatchResource(Resource):
+    """
+    BatchResource Class
+
+    Allows several Shopcart and Item operations in one request:
+    POST /batch - Execute the operations in order in a single transaction
+    """
+
+    @api.doc("batch_operations")
+    @api.response(400, "Invalid batch request body")
+    @api.response(415, "Invalid header content-type")
+    @api.expect(batch_model)
+    def post(self):
+        """
+        Execute a Batch of operations
+
+        This endpoint will execute the operations in order in a single transaction and return all of their
+        responses. When an operation fails, every operation of the batch is rolled back and the failing status is
+        returned.
+        """
+        check_content_type(DEFAULT_CONTENT_TYPE)
+        operations = check_batch_operations(api.payload)
+        app.logger.info("Request to execute a batch of %s operations", len(operations))
+
+        results = []
+        try:
+            with atomic():
+                for position, operation in enumerate(deadline.checked(operations)):
+                    response = dispatch_operation(operation)
+                    results.append({"status": response.status_code, "body": response.get_json(silent=True)})
+                    if response.status_code >= 400:
+                        raise BatchOperationFailed(position, response.status_code)
+        except BatchOperationFailed as failure:
+            app.logger.warning("Batch rolled back, operation %s failed", failure.position)
+            return {
+                "message": f"Operation {failure.position} failed, the batch was rolled back.",
+                "failed_operation": failure.position,
+                "results": results,
+            }, failure.status_code
+
+        app.logger.info("Batch of %s operations committed", len(operations))
+        return {"results": results}, status.HTTP_200_OK
+
+
+class BatchOperationFailed(Exception):
+    """ Raised to roll back a batch when one of its operations fails """
+
+    def __init__(self, position, status_code):
+        self.position = position
+        self.status_code = status_code
+        super().__init__(f"Operation {position} failed with {status_code}")
@@ -191,65 +191,123 @@ $(function () {
     // List Shopcarts
     // ****************************************
 
-    $("#search-shopcart-btn").click(function () {
+    // Shopcarts are fetched a page at a time as the results are scrolled,
+    // and only the rows in view (plus a margin) are in the DOM.
+    const PAGE_SIZE = 50;
+    const ROW_HEIGHT = 37;
+    const VIEWPORT_ROWS = 15;
+    const OVERSCAN_ROWS = 10;
+    const SEARCH_DEBOUNCE_MS = 300;
+
+    let search = null;
+    let searchTimer = null;
+
+    function shopcart_rows(shopcart) {
+        if (shopcart.items.length == 0) {
+            return [`<td>${shopcart.id}</td><td>${shopcart.name}</td><td></td><td></td><td></td><td></td>`];
+        }
+        return shopcart.items.map(item =>
+            `<td>${shopcart.id}</td><td>${shopcart.name}</td><td>${item.id}</td><td>${item.name}</td><td>${item.quantity}</td><td>${item.price}</td>`
+        );
+    }
 
-        let name = $("#shopcart_name").val();
+    function render_shopcart_rows() {
+        let viewport = $("#search_shopcarts_viewport");
+        if (!search || viewport.length == 0) {
+            return;
+        }
+        let rows = search.rows;
+        let first = Math.max(0, Math.floor(viewport.scrollTop() / ROW_HEIGHT) - OVERSCAN_ROWS);
+        let last = Math.min(rows.length, first + VIEWPORT_ROWS + 2 * OVERSCAN_ROWS);
+        let body = `<tr style="height: ${first * ROW_HEIGHT}px"></tr>`;
+        for (let i = first; i < last; i++) {
+            body += `<tr id="row_${i}" style="height: ${ROW_HEIGHT}px">${rows[i]}</tr>`;
+        }
+        body += `<tr style="height: ${(rows.length - last) * ROW_HEIGHT}px"></tr>`;
+        $("#search_shopcarts_rows").html(body);
 
-        let queryString = ""
-        if (name) {
-            queryString += 'name=' + name
+        if (search.cursor && last + OVERSCAN_ROWS >= rows.length) {
+            fetch_shopcarts_page(search);
         }
+    }
 
-        $("#flash_message").empty();
+    function fetch_shopcarts_page(current) {
+        if (current.request) {
+            return;
+        }
+        let params = {limit: PAGE_SIZE};
+        if (current.name) {
+            params.name = current.name;
+        }
+        if (current.cursor) {
+            params.after = current.cursor;
+        }
 
-        let ajax = $.ajax({
+        current.request = $.ajax({
             type: "GET",
-            url: `api/shopcarts?${queryString}`,
+            url: `api/shopcarts?${$.param(params)}`,
             contentType: "application/json",
             data: ''
-        })
+        });
 
-        ajax.done(function(res){
-            $("#search_shopcarts_results").empty();
-            let table = '<table class="table table-striped" cellpadding="10">'
-            table += '<thead><tr>'
-            table += '<th class="col-md-1">ID</th>'
-            table += '<th class="col-md-3">Name</th>'
-            table += '<th class="col-md-1">Item_ID</th>'
-            table += '<th class="col-md-3">Item_Name</th>'
-            table += '<th class="col-md-2">Quantity</th>'
-            table += '<th class="col-md-2">Price</th>'
-            table += '</tr></thead><tbody>'
-            let firstShopcart = "";
-            for (let i = 0; i < res.length; i++) {
-                let shopcart = res[i];
-                items = shopcart['items'];
-                if (items.length != 0) {
-                    for (let j = 0; j < items.length; j++) {
-                        table += `<tr id="row_${i}"><td>${shopcart.id}</td><td>${shopcart.name}</td><td>${shopcart.items[j]['id']}</td><td>${shopcart.items[j]['name']}</td><td>${shopcart.items[j]['quantity']}</td><td>${shopcart.items[j]['price']}</td></tr>`
-                    }
-                } else {
-                    table += `<tr id="row_${i}"><td>${shopcart.id}</td><td>${shopcart.name}</td><td></td><td></td><td></td><td></td></tr>`
-                }
-                
-                if (i == 0) {
-                    firstShopcart = shopcart;
-                }
+        current.request.done(function(res, textStatus, xhr){
+            current.request = null;
+            if (current !== search) {
+                return;
             }
-            table += '</tbody></table>';
-            $("#search_shopcarts_results").append(table);
-
-            if (firstShopcart != "") {
-                update_form_shopcart(firstShopcart)
+            if (current.rows.length == 0 && res.length != 0 && current.fill_form) {
+                update_form_shopcart(res[0])
             }
-
+            res.forEach(shopcart => current.rows.push(...shopcart_rows(shopcart)));
+            current.cursor = xhr.getResponseHeader("X-Next-Cursor");
+            render_shopcart_rows();
             flash_message("Success")
         });
 
-        ajax.fail(function(res){
-            flash_message(res.responseJSON.message)
+        current.request.fail(function(res, textStatus){
+            current.request = null;
+            if (textStatus != "abort" && current === search) {
+                flash_message(res.responseJSON.message)
+            }
         });
+    }
+
+    function search_shopcarts(fill_form) {
+        clearTimeout(searchTimer);
+        if (search && search.request) {
+            search.request.abort();
+        }
+        search = {name: $("#shopcart_name").val(), cursor: null, rows: [], request: null, fill_form: fill_form};
+
+        $("#flash_message").empty();
+        $("#search_shopcarts_results").empty();
+        let table = `<div id="search_shopcarts_viewport" style="max-height: ${VIEWPORT_ROWS * ROW_HEIGHT}px; overflow-y: auto">`
+        table += '<table class="table table-striped" cellpadding="10">'
+        table += '<thead><tr>'
+        table += '<th class="col-md-1">ID</th>'
+        table += '<th class="col-md-3">Name</th>'
+        table += '<th class="col-md-1">Item_ID</th>'
+        table += '<th class="col-md-3">Item_Name</th>'
+        table += '<th class="col-md-2">Quantity</th>'
+        table += '<th class="col-md-2">Price</th>'
+        table += '</tr></thead><tbody id="search_shopcarts_rows"></tbody></table></div>'
+        $("#search_shopcarts_results").append(table);
+        $("#search_shopcarts_viewport").on("scroll", render_shopcart_rows);
+
+        fetch_shopcarts_page(search);
+    }
 
+    $("#search-shopcart-btn").click(function () {
+        search_shopcarts(true);
+    });
+
+    // refresh the results as a name is typed, once typing pauses
+    $("#shopcart_name").on("input", function () {
+        if (!search) {
+            return;
+        }
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(function () { search_shopcarts(false); }, SEARCH_DEBOUNCE_MS);
     });
 
     $("#reset-item-form-btn").click(function () {
@@ -11,3 +11,5 @@ DATABASE_URI = os.getenv(
 BASE_URL_RESTX = "/api/shopcarts"
 
 DEFAULT_CONTENT_TYPE = "application/json"
+
+MERGE_PATCH_CONTENT_TYPE = "application/merge-patch+json"
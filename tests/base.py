@@ -0,0 +1,37 @@
+"""
+Base class of the tests running against the service app
+
+It lives outside the package __init__, which the memory harness imports, so that
+unittest does not count against the memory budget.
+"""
+import logging
+from unittest import TestCase
+
+from service import app
+from service.common import metrics
+from service.models import db, ArchivedShopcart, IdempotencyKey, Item, ItemStat, OutboxEvent, Shopcart
+
+
+class ServiceTestCase(TestCase):
+    """ Runs each test in an app context with a test client, on empty shopcart tables """
+
+    @classmethod
+    def setUpClass(cls):
+        """ Run once before the entire test suite """
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+        with app.app_context():
+            db.create_all()  # the model tests drop every table
+
+    def setUp(self):
+        self.app_context = app.app_context()
+        self.app_context.push()
+        self.client = app.test_client()
+        for model in (IdempotencyKey, OutboxEvent, ArchivedShopcart, Item, Shopcart, ItemStat):
+            db.session.query(model).delete()
+        db.session.commit()
+        metrics.reset()
+
+    def tearDown(self):
+        db.session.remove()
+        self.app_context.pop()
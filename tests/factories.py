@@ -56,4 +56,4 @@ class ItemFactory(factory.Factory):
     shopcart_id = None
     name = FuzzyChoice(choices=["Air Pods", "iPhone SE", "Macbook Air"])
     quantity = 1
-    price = factory.Faker("pyfloat", positive=True)
+    price = factory.Faker("pyfloat", right_digits=2, positive=True)
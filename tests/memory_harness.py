@@ -0,0 +1,193 @@
+"""
+Memory Budget Harness
+
+Boots the service in the current interpreter, drives representative traffic
+through the Flask test client (including a large shopcart) and records the
+peak RSS of the process together with the peak traced memory and the top
+tracemalloc allocators of every endpoint.
+
+The deployment limits each container to 64Mi (see deploy/deployment.yaml),
+so the harness exits with a non zero status when a budget is exceeded.
+
+Usage:
+  python -m tests.memory_harness
+  python -m tests.memory_harness --budget-mb 64 --large-cart-items 1000 --json
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tracemalloc
+
+DEFAULT_BUDGET_MB = float(os.getenv("MEMORY_BUDGET_MB", "64"))
+DEFAULT_ENDPOINT_BUDGET_KB = float(os.getenv("MEMORY_ENDPOINT_BUDGET_KB", "16384"))
+DEFAULT_LARGE_CART_ITEMS = int(os.getenv("MEMORY_LARGE_CART_ITEMS", "500"))
+DEFAULT_CART_COUNT = int(os.getenv("MEMORY_CART_COUNT", "50"))
+TOP_ALLOCATORS = 5
+
+BASE_URL = "/api/shopcarts"
+
+
+def peak_rss_mb() -> float:
+    """ Peak resident set size of this process in MiB """
+    # ru_maxrss survives execve() on Linux, so a harness spawned by the test
+    # runner would report the runner's peak; VmHWM is reset with the new image
+    try:
+        with open("/proc/self/status", encoding="ascii") as status_file:
+            for line in status_file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:  # pragma: no cover
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":  # pragma: no cover
+        return peak / (1024 * 1024)  # bytes on macOS
+    return peak / 1024  # kilobytes on Linux
+
+
+def _top_allocators(snapshot, limit=TOP_ALLOCATORS):
+    """ Summarize the biggest allocation sites of a snapshot """
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+    allocators = []
+    for stat in snapshot.statistics("lineno")[:limit]:
+        frame = stat.traceback[0]
+        allocators.append({
+            "location": f"{frame.filename}:{frame.lineno}",
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count,
+        })
+    return allocators
+
+
+class MemoryHarness:
+    """ Drives traffic through the service and records memory per endpoint """
+
+    def __init__(self, client, budget_mb, endpoint_budget_kb):
+        self.client = client
+        self.budget_mb = budget_mb
+        self.endpoint_budget_kb = endpoint_budget_kb
+        self.endpoints = []
+
+    def measure(self, label, method, url, **kwargs):
+        """ Issue one request while tracing its allocations """
+        tracemalloc.start()
+        try:
+            resp = self.client.open(url, method=method, **kwargs)
+            body = resp.get_data()  # keep the payload alive for the snapshot
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        self.endpoints.append({
+            "endpoint": label,
+            "status_code": resp.status_code,
+            "response_kb": round(len(body) / 1024, 1),
+            "peak_kb": round(peak / 1024, 1),
+            "rss_mb": round(peak_rss_mb(), 1),
+            "top_allocators": _top_allocators(snapshot),
+        })
+        return resp
+
+    def run(self, cart_count, large_cart_items):
+        """ Replay a representative mix of cart and item traffic """
+        item = {"name": "Air Pods", "quantity": 1, "price": 129.99}
+        shopcart_ids = []
+        for i in range(cart_count):
+            resp = self.client.post(BASE_URL, json={"name": f"Customer {i}"})
+            shopcart_ids.append(resp.get_json()["id"])
+
+        large_id = shopcart_ids[0]
+        for _ in range(large_cart_items):
+            resp = self.client.post(f"{BASE_URL}/{large_id}/items", json=dict(item, shopcart_id=large_id))
+        item_id = resp.get_json()["id"]
+
+        self.measure("POST /shopcarts", "POST", BASE_URL, json={"name": "Measured"})
+        self.measure("POST /shopcarts/{id}/items", "POST", f"{BASE_URL}/{large_id}/items",
+                     json=dict(item, shopcart_id=large_id))
+        self.measure("GET /shopcarts", "GET", BASE_URL)
+        self.measure("GET /shopcarts?name=", "GET", f"{BASE_URL}?name=Customer%201")
+        self.measure("GET /shopcarts/{id}", "GET", f"{BASE_URL}/{large_id}")
+        self.measure("GET /shopcarts/{id}/items", "GET", f"{BASE_URL}/{large_id}/items")
+        self.measure("GET /shopcarts/{id}/items/{id}", "GET", f"{BASE_URL}/{large_id}/items/{item_id}")
+        self.measure("PUT /shopcarts/{id}/items/{id}", "PUT", f"{BASE_URL}/{large_id}/items/{item_id}",
+                     json=dict(item, shopcart_id=large_id, quantity=2))
+        self.measure("PUT /shopcarts/{id}", "PUT", f"{BASE_URL}/{large_id}", json={"name": "Renamed"})
+        self.measure("PUT /shopcarts/{id}/clear", "PUT", f"{BASE_URL}/{large_id}/clear")
+        self.measure("DELETE /shopcarts/{id}", "DELETE", f"{BASE_URL}/{large_id}")
+
+    def report(self) -> dict:
+        """ Summarize the run and list every exceeded budget """
+        violations = []
+        rss_mb = peak_rss_mb()
+        if rss_mb > self.budget_mb:
+            violations.append(f"peak RSS {rss_mb:.1f}MiB exceeds budget of {self.budget_mb}MiB")
+        for endpoint in self.endpoints:
+            if endpoint["peak_kb"] > self.endpoint_budget_kb:
+                violations.append(
+                    f"{endpoint['endpoint']} traced peak {endpoint['peak_kb']}KiB "
+                    f"exceeds budget of {self.endpoint_budget_kb}KiB"
+                )
+        return {
+            "budget_mb": self.budget_mb,
+            "endpoint_budget_kb": self.endpoint_budget_kb,
+            "peak_rss_mb": round(rss_mb, 1),
+            "endpoints": self.endpoints,
+            "violations": violations,
+        }
+
+
+def main(argv=None) -> int:
+    """ Boot the service, run the traffic mix and check the budgets """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-mb", type=float, default=DEFAULT_BUDGET_MB)
+    parser.add_argument("--endpoint-budget-kb", type=float, default=DEFAULT_ENDPOINT_BUDGET_KB)
+    parser.add_argument("--large-cart-items", type=int, default=DEFAULT_LARGE_CART_ITEMS)
+    parser.add_argument("--carts", type=int, default=DEFAULT_CART_COUNT)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    # pylint: disable=import-outside-toplevel
+    from service import app
+    from service.models import db, Shopcart
+
+    app.config["TESTING"] = True
+    app.logger.setLevel(logging.CRITICAL)
+    boot_rss_mb = peak_rss_mb()
+
+    # every request of the harness gets its own app context, as under gunicorn
+    with app.app_context():
+        db.session.query(Shopcart).delete()
+        db.session.commit()
+    harness = MemoryHarness(app.test_client(), args.budget_mb, args.endpoint_budget_kb)
+    try:
+        harness.run(args.carts, args.large_cart_items)
+    finally:
+        with app.app_context():
+            db.session.query(Shopcart).delete()
+            db.session.commit()
+
+    report = harness.report()
+    report["boot_rss_mb"] = round(boot_rss_mb, 1)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"boot RSS: {report['boot_rss_mb']}MiB, peak RSS: {report['peak_rss_mb']}MiB "
+              f"(budget {report['budget_mb']}MiB)")
+        for endpoint in report["endpoints"]:
+            print(f"{endpoint['endpoint']:<36} {endpoint['status_code']}  "
+                  f"peak {endpoint['peak_kb']:>9}KiB  response {endpoint['response_kb']:>8}KiB")
+            for allocator in endpoint["top_allocators"]:
+                print(f"    {allocator['size_kb']:>9}KiB  {allocator['location']}")
+        for violation in report["violations"]:
+            print(f"BUDGET EXCEEDED: {violation}")
+    return 1 if report["violations"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Read Path CPU Benchmark
+
+Boots the service in the current interpreter and measures the CPU time spent
+per request on the cart and item read paths, through the Flask test client
+and through the model lookups alone, each in a fresh app context like a
+request.
+
+Usage:
+  python -m tests.read_benchmark
+  python -m tests.read_benchmark --iterations 2000 --items 20 --json
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+DEFAULT_ITERATIONS = int(os.getenv("BENCHMARK_ITERATIONS", "500"))
+DEFAULT_ITEMS = int(os.getenv("BENCHMARK_ITEMS", "10"))
+
+BASE_URL = "/api/shopcarts"
+
+
+def cpu_microseconds(function, iterations) -> float:
+    """ Average CPU time of a call in microseconds, after a warm up call """
+    function()
+    started = time.process_time()
+    for _ in range(iterations):
+        function()
+    return round((time.process_time() - started) / iterations * 1e6, 1)
+
+
+def main(argv=None) -> int:  # pylint: disable=too-many-locals
+    """ Boot the service, fill a cart and time its reads """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--items", type=int, default=DEFAULT_ITEMS)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    # pylint: disable=import-outside-toplevel
+    from service import app
+    from service.common import metrics
+    from service.models import db, Item, Shopcart
+
+    app.config["TESTING"] = True
+    app.logger.setLevel(logging.CRITICAL)
+    client = app.test_client()
+
+    shopcart_id = client.post(BASE_URL, json={"name": "Benchmarked"}).get_json()["id"]
+    for _ in range(args.items):
+        resp = client.post(f"{BASE_URL}/{shopcart_id}/items", json={
+            "shopcart_id": shopcart_id, "name": "Air Pods", "quantity": 1, "price": 129.99
+        })
+    item_id = resp.get_json()["id"]
+
+    def in_app_context(function):
+        def run():
+            with app.app_context():
+                return function()
+        return run
+
+    requests = {
+        "GET /shopcarts/{id}": f"{BASE_URL}/{shopcart_id}",
+        "GET /shopcarts/{id}/items": f"{BASE_URL}/{shopcart_id}/items",
+        "GET /shopcarts/{id}/items/{id}": f"{BASE_URL}/{shopcart_id}/items/{item_id}",
+        "GET /shopcarts?name=": f"{BASE_URL}?name=Benchmarked",
+    }
+    lookups = {
+        "Shopcart.get_by_id": lambda: Shopcart.get_by_id(shopcart_id),
+        "Shopcart.get_by_id + items": lambda: Shopcart.get_by_id(shopcart_id).items,
+        "Shopcart.get_with_items": lambda: Shopcart.get_with_items(shopcart_id).items,
+        "Item.get_by_id": lambda: Item.get_by_id(item_id),
+        "Shopcart.find_by_name": lambda: list(Shopcart.find_by_name("Benchmarked")),
+    }
+    metrics.reset()
+    try:
+        report = {
+            "iterations": args.iterations,
+            "items": args.items,
+            "requests_us": {
+                label: cpu_microseconds(lambda url=url: client.get(url).get_data(), args.iterations)
+                for label, url in requests.items()
+            },
+            "lookups_us": {
+                label: cpu_microseconds(in_app_context(lookup), args.iterations)
+                for label, lookup in lookups.items()
+            },
+            "statement_cache_hit_ratio": metrics.snapshot().get("db.statement_cache.hit_ratio"),
+        }
+    finally:
+        with app.app_context():
+            db.session.query(Shopcart).filter(Shopcart.id == shopcart_id).delete()
+            db.session.commit()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for section in ("requests_us", "lookups_us"):
+            for label, microseconds in report[section].items():
+                print(f"{label:<36} {microseconds:>9}us CPU")
+        print(f"statement cache hit ratio: {report['statement_cache_hit_ratio']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Test cases for Admission Control
+"""
+import logging
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import Flask
+
+from service import app
+from service.common import metrics, status
+from service.common.admission import (
+    AdmissionControl, MemoryBucketStore, MeteredQueuePool, SqliteBucketStore, init_admission
+)
+from . import BASE_URL_RESTX
+
+
+class TestBucketStores(TestCase):
+    """ Token bucket store Tests """
+
+    def _exhaust(self, store):
+        self.assertEqual(store.take("client", 1, 2, 100.0), 0)
+        self.assertEqual(store.take("client", 1, 2, 100.0), 0)
+        self.assertAlmostEqual(store.take("client", 1, 2, 100.0), 1.0)
+        self.assertEqual(store.take("other", 1, 2, 100.0), 0)
+        # a second later one token has been refilled
+        self.assertEqual(store.take("client", 1, 2, 101.0), 0)
+
+    def test_memory_store(self):
+        """ It should rate limit each client key in memory """
+        store = MemoryBucketStore()
+        self._exhaust(store)
+        store.MAX_KEYS = 0
+        store.take("late", 1, 2, 1000.0)
+        self.assertEqual(list(store._buckets), ["late"])  # pylint: disable=protected-access
+
+    def test_sqlite_store_is_shared(self):
+        """ It should share the buckets through the SQLite file """
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "buckets.db")
+            self._exhaust(SqliteBucketStore(path))
+            # another worker opening the same file sees the empty bucket
+            self.assertGreater(SqliteBucketStore(path).take("client", 1, 2, 101.0), 0)
+
+
+class TestAdmissionControl(TestCase):
+    """ Rate limiting and load shedding Tests """
+
+    @classmethod
+    def setUpClass(cls):
+        """ Run once before the entire test suite """
+        app.config["TESTING"] = True
+        app.logger.setLevel(logging.CRITICAL)
+
+    def setUp(self):
+        self.client = app.test_client()
+        self.default_control = app.extensions["admission"]
+        metrics.reset()
+
+    def tearDown(self):
+        app.extensions["admission"] = self.default_control
+
+    def test_rate_limit(self):
+        """ It should return 429 with Retry-After once a client runs out of tokens """
+        app.extensions["admission"] = AdmissionControl({"RATE_LIMIT_PER_SECOND": 0.5, "RATE_LIMIT_BURST": 2})
+        greedy = {"REMOTE_ADDR": "10.0.0.1"}
+        for number in range(2):
+            resp = self.client.get(f"{BASE_URL_RESTX}/0", environ_base=greedy, headers={"X-Client-Id": str(number)})
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        # a client id the client makes up does not give it a new bucket
+        resp = self.client.get(f"{BASE_URL_RESTX}/0", environ_base=greedy, headers={"X-Client-Id": "2"})
+        self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(resp.headers["Retry-After"], "2")
+        self.assertEqual(resp.get_json()["message"], "Rate limit exceeded, slow down.")
+        self.assertEqual(self.client.get("/", environ_base=greedy).get_json()["error"], "Too Many Requests")
+
+        # other clients and the health check are not affected
+        resp = self.client.get(f"{BASE_URL_RESTX}/0", environ_base={"REMOTE_ADDR": "10.0.0.2"})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get("/health", environ_base=greedy).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get("/metrics").get_json()["admission.rate_limited"], 2)
+
+    def test_rate_limit_trusted_client_id(self):
+        """ It should rate limit by the client id header a trusted gateway sets """
+        app.extensions["admission"] = AdmissionControl({
+            "RATE_LIMIT_PER_SECOND": 0.5, "RATE_LIMIT_BURST": 1, "TRUST_CLIENT_ID_HEADER": True
+        })
+        resp = self.client.get(f"{BASE_URL_RESTX}/0", headers={"X-Client-Id": "greedy"})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.get(f"{BASE_URL_RESTX}/0", headers={"X-Client-Id": "greedy"})
+        self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        resp = self.client.get(f"{BASE_URL_RESTX}/0", headers={"X-Client-Id": "polite"})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_trusted_proxies(self):
+        """ It should take the client address from X-Forwarded-For behind trusted proxies """
+        proxied = Flask(__name__)
+        proxied.config.update(SQLALCHEMY_DATABASE_URI="sqlite://", TRUSTED_PROXIES=1, RATE_LIMIT_PER_SECOND=0.5)
+
+        @proxied.route("/address")
+        def address():
+            return proxied.extensions["admission"].client_key()
+
+        with patch.object(metrics, "register_gauge"):  # keep the gauges of the service app
+            init_admission(proxied)
+        resp = proxied.test_client().get("/address", headers={"X-Forwarded-For": "203.0.113.7"})
+        self.assertEqual(resp.get_data(as_text=True), "203.0.113.7")
+
+    def test_shed_in_flight(self):
+        """ It should return 503 when too many requests are in flight """
+        control = AdmissionControl({"SHED_MAX_IN_FLIGHT": 1})
+        app.extensions["admission"] = control
+        resp = self.client.get(f"{BASE_URL_RESTX}/0")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(control.in_flight, 0)
+
+        control.in_flight = 1  # another request is being served
+        resp = self.client.get(f"{BASE_URL_RESTX}/0")
+        self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(resp.headers["Retry-After"], "1")
+        self.assertEqual(control.in_flight, 1)
+        self.assertEqual(metrics.snapshot()["admission.shed_in_flight"], 1)
+
+    def test_shed_pool_wait(self):
+        """ It should return 503 while connection pool waits are over the threshold """
+        app.extensions["admission"] = AdmissionControl({"SHED_MAX_POOL_WAIT_MS": 50})
+        with patch.object(MeteredQueuePool, "current_wait", return_value=0.2):
+            resp = self.client.get(f"{BASE_URL_RESTX}/0")
+        self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(metrics.snapshot()["admission.shed_pool_wait"], 1)
+
+    def test_pool_wait_average_decays(self):
+        """ It should average the checkout waits and decay them over time """
+        MeteredQueuePool.record_wait(1.0)
+        self.assertGreater(MeteredQueuePool.current_wait(), 0.1)
+        with patch("service.common.admission.time.monotonic", return_value=MeteredQueuePool.wait_updated + 10):
+            self.assertLess(MeteredQueuePool.current_wait(), 0.001)
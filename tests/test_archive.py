@@ -0,0 +1,104 @@
+"""
+Test cases for the shopcart archive
+"""
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+from sqlalchemy import update
+
+from service import app
+from service.common import metrics, status
+from service.common.archive import ArchiveSweeper, init_archive
+from service.common.cli_commands import archive_stale, restore_shopcart
+from service.models import db, ArchivedShopcart, Item, ItemStat, Shopcart, utcnow
+from . import BASE_URL_RESTX
+from .base import ServiceTestCase
+
+DAY = 86400
+
+
+class TestArchive(ServiceTestCase):
+    """ Shopcart archive Tests """
+
+    def _cart(self, name, days_ago, items=0):
+        """ A shopcart with items, last changed some days ago """
+        shopcart_id = self.client.post(BASE_URL_RESTX, json={"name": name}).get_json()["id"]
+        for number in range(items):
+            self.client.post(f"{BASE_URL_RESTX}/{shopcart_id}/items", json={
+                "shopcart_id": shopcart_id, "name": f"Item {number}", "quantity": 1, "price": 10.0
+            })
+        db.session.execute(update(Shopcart).where(Shopcart.id == shopcart_id).values(
+            updated_at=utcnow() - timedelta(days=days_ago)
+        ))
+        db.session.commit()
+        return shopcart_id
+
+    def test_archive_and_restore(self):
+        """ It should move stale shopcarts to the archive, serve them from there and restore them """
+        stale = self._cart("Stale", days_ago=100, items=2)
+        other = self._cart("Other stale", days_ago=95)
+        fresh = self._cart("Fresh", days_ago=1, items=1)
+        before = self.client.get(f"{BASE_URL_RESTX}/{stale}").get_json()
+
+        self.assertEqual(ArchiveSweeper(app, age=90 * DAY, batch_size=1).sweep(), 2)
+        self.assertEqual(sorted(shopcart.id for shopcart in Shopcart.get_all()), [fresh])
+        self.assertEqual({item.shopcart_id for item in Item.get_all()}, {fresh})
+        self.assertEqual([stat.name for stat in ItemStat.top(10)], ["Item 0"])
+        self.assertEqual(db.session.get(ArchivedShopcart, other).name, "Other stale")
+
+        # reads fall back to the archive
+        resp = self.client.get(f"{BASE_URL_RESTX}/{stale}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        archived = resp.get_json()
+        self.assertIsNotNone(archived["archived_at"])
+        self.assertEqual(archived["version"], before["version"] + 1)
+        self.assertEqual(archived["items"], before["items"])
+        self.assertEqual(len(self.client.get(f"{BASE_URL_RESTX}/{stale}/items").get_json()), 2)
+        self.assertIsNone(self.client.get(f"{BASE_URL_RESTX}/{fresh}").get_json()["archived_at"])
+        self.assertEqual(metrics.snapshot()["archive.hits"], 2)
+
+        # writes need the shopcart restored first
+        item_url = f"{BASE_URL_RESTX}/{stale}/items"
+        item = {"shopcart_id": stale, "name": "Late", "quantity": 1, "price": 1.0}
+        self.assertEqual(self.client.post(item_url, json=item).status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.client.put(f"{BASE_URL_RESTX}/{stale}/restore")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        restored = resp.get_json()
+        self.assertIsNone(restored["archived_at"])
+        self.assertEqual((restored["version"], restored["items"]), (before["version"] + 2, before["items"]))
+        self.assertEqual(self.client.post(item_url, json=item).status_code, status.HTTP_201_CREATED)
+        self.assertIsNone(db.session.get(ArchivedShopcart, stale))
+        self.assertEqual(sorted(stat.name for stat in ItemStat.top(10)), ["Item 0", "Item 1", "Late"])
+
+        self.assertEqual(self.client.put(f"{BASE_URL_RESTX}/{stale}/restore").status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.client.put(f"{BASE_URL_RESTX}/0/restore").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_archiver_thread(self):
+        """ It should archive from a background thread once configured, until stopped """
+        self.assertIsNone(init_archive(app))
+        stale = self._cart("Stale", days_ago=100)
+        with patch.dict(app.config, {"ARCHIVE_SWEEP_SECONDS": 0.01, "ARCHIVE_AFTER_SECONDS": 90 * DAY}):
+            archiver = init_archive(app)
+            for _ in range(500):
+                if metrics.snapshot().get("archive.archived"):
+                    break
+                time.sleep(0.01)
+            archiver.stop()
+        self.assertFalse(archiver.is_alive())
+        self.assertEqual(db.session.get(ArchivedShopcart, stale).name, "Stale")
+
+    def test_archive_commands(self):
+        """ It should archive and restore shopcarts from the CLI """
+        stale = self._cart("Stale", days_ago=100)
+        runner = app.test_cli_runner()
+        self.assertNotEqual(runner.invoke(archive_stale, ["--age", "0"]).exit_code, 0)
+        result = runner.invoke(archive_stale, ["--age", str(90 * DAY)])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Archived 1 shopcarts", result.output)
+
+        result = runner.invoke(restore_shopcart, [str(stale)])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(Shopcart.get_by_id(stale).name, "Stale")
+        self.assertNotEqual(runner.invoke(restore_shopcart, [str(stale)]).exit_code, 0)
+        self.assertNotEqual(runner.invoke(restore_shopcart, ["0"]).exit_code, 0)
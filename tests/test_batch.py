@@ -0,0 +1,108 @@
+"""
+Test cases for the Batch API
+"""
+from unittest.mock import patch
+
+from service import app, routes
+from service.common import status
+from . import BASE_URL_RESTX
+from .base import ServiceTestCase
+
+BATCH_URL = "/api/batch"
+
+
+class TestBatch(ServiceTestCase):
+    """ POST /batch Tests """
+
+    def setUp(self):
+        super().setUp()
+        resp = self.client.post(BASE_URL_RESTX, json={"name": "Edit Session"})
+        self.shopcart_id = resp.get_json()["id"]
+
+    def _item(self, name, quantity=1):
+        return {"shopcart_id": self.shopcart_id, "name": name, "quantity": quantity, "price": 9.99}
+
+    def test_batch(self):
+        """ It should execute every operation in order and commit once """
+        cart = f"/shopcarts/{self.shopcart_id}"
+        resp = self.client.post(BATCH_URL, json={"operations": [
+            {"method": "PUT", "path": cart, "body": {"name": "Renamed"}},
+            {"method": "POST", "path": f"{cart}/items", "body": self._item("Air Pods")},
+            {"method": "POST", "path": f"{cart}/items", "body": self._item("iPhone SE")},
+            {"method": "GET", "path": f"{cart}/items"},
+        ]})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        results = resp.get_json()["results"]
+        self.assertEqual([r["status"] for r in results], [200, 201, 201, 200])
+        self.assertEqual(len(results[3]["body"]), 2)
+
+        item_id = results[1]["body"]["id"]
+        resp = self.client.post(BATCH_URL, json={"operations": [
+            {"method": "PUT", "path": f"{cart}/items/{item_id}", "body": self._item("Air Pods", 3)},
+            {"method": "DELETE", "path": f"{cart}/items/{results[2]['body']['id']}"},
+        ]})
+        self.assertEqual([r["status"] for r in resp.get_json()["results"]], [200, 204])
+
+        shopcart = self.client.get(f"{BASE_URL_RESTX}/{self.shopcart_id}").get_json()
+        self.assertEqual(shopcart["name"], "Renamed")
+        self.assertEqual([(i["name"], i["quantity"]) for i in shopcart["items"]], [("Air Pods", 3)])
+
+    def test_failed_operation_rolls_back(self):
+        """ It should roll back the whole batch when an operation fails """
+        cart = f"/shopcarts/{self.shopcart_id}"
+        resp = self.client.post(BATCH_URL, json={"operations": [
+            {"method": "PUT", "path": cart, "body": {"name": "Renamed"}},
+            {"method": "POST", "path": f"{cart}/items", "body": self._item("Air Pods")},
+            {"method": "POST", "path": f"{cart}/items", "body": self._item("Broken", quantity=5)},
+        ]})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        data = resp.get_json()
+        self.assertEqual(data["failed_operation"], 2)
+        self.assertEqual([r["status"] for r in data["results"]], [200, 201, 400])
+
+        shopcart = self.client.get(f"{BASE_URL_RESTX}/{self.shopcart_id}").get_json()
+        self.assertEqual(shopcart["name"], "Edit Session")
+        self.assertEqual(shopcart["items"], [])
+
+        resp = self.client.post(BATCH_URL, json={"operations": [{"method": "GET", "path": "/shopcarts/0"}]})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_batch_holds_one_slot(self):
+        """ It should keep the batch request in flight until its last operation has run """
+        control = app.extensions["admission"]
+        in_flight = []
+        dispatch_operation = routes.dispatch_operation
+
+        def dispatch(operation):
+            response = dispatch_operation(operation)
+            in_flight.append(control.in_flight)
+            return response
+
+        cart = f"/shopcarts/{self.shopcart_id}"
+        with patch.object(routes, "dispatch_operation", dispatch):
+            resp = self.client.post(BATCH_URL, json={"operations": [
+                {"method": "POST", "path": f"{cart}/items", "body": self._item("Air Pods")},
+                {"method": "GET", "path": "/shopcarts?name=Edit%20Session"},
+                {"method": "GET", "path": f"{cart}/items"},
+            ]}, headers={"Idempotency-Key": "batch-1"})
+        self.assertEqual([r["status"] for r in resp.get_json()["results"]], [201, 200, 200])
+        self.assertEqual(len(resp.get_json()["results"][1]["body"]), 1)
+        self.assertEqual(in_flight, [1, 1, 1])
+        self.assertEqual(control.in_flight, 0)
+
+    def test_invalid_batch(self):
+        """ It should reject malformed batches """
+        for body in ({}, {"operations": []}, {"operations": [{"method": "HEAD", "path": "/shopcarts"}]},
+                     {"operations": [{"method": "POST", "path": "/batch"}]}, []):
+            resp = self.client.post(BATCH_URL, json=body)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, body)
+
+        app.config["BATCH_MAX_OPERATIONS"] = 1
+        try:
+            resp = self.client.post(BATCH_URL, json={"operations": [{"method": "GET", "path": "/shopcarts"}] * 2})
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        finally:
+            app.config["BATCH_MAX_OPERATIONS"] = 100
+
+        resp = self.client.post(BATCH_URL, data="{}", content_type="text/plain")
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
@@ -0,0 +1,163 @@
+"""
+Test cases for the Server-Sent Events change feed
+"""
+import json
+from unittest import TestCase
+from unittest.mock import patch
+
+from service import app
+from service.common import change_feed, metrics, status
+from service.common.change_feed import ChangeBroker
+from . import BASE_URL_RESTX
+from .base import ServiceTestCase
+
+
+def parse_events(text):
+    """ The (id, event, data) of every event of a stream """
+    events = []
+    for block in text.split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if "event" in fields:
+            events.append((fields.get("id"), fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def change(shopcart_id, action="updated"):
+    """ A change of a shopcart as recorded by the models """
+    return {"type": "shopcart", "action": action, "shopcart_id": shopcart_id, "id": shopcart_id,
+            "version": 2, "data": None}
+
+
+class TestChangeBroker(TestCase):
+    """ ChangeBroker Tests """
+
+    def _read(self, broker, subscription):
+        return parse_events("".join(broker.stream(subscription, 0.01, 0.05)))
+
+    def test_publish_to_subscribers(self):
+        """ It should send every subscription the changes it follows """
+        broker = ChangeBroker()
+        every_cart = broker.subscribe()
+        one_cart = broker.subscribe(2)
+        self.assertEqual(broker.subscriber_count, 2)
+        broker.publish([change(1), change(2, "cleared")])
+
+        events = self._read(broker, every_cart)
+        self.assertEqual([event for _, event, _ in events], ["shopcart.updated", "shopcart.cleared"])
+        self.assertEqual(events[1][2]["shopcart_id"], 2)
+        self.assertEqual([event for _, event, _ in self._read(broker, one_cart)], ["shopcart.cleared"])
+        self.assertEqual(broker.subscriber_count, 0)
+
+    def test_resume_after_last_event_id(self):
+        """ It should replay the events after Last-Event-ID and reset unknown ones """
+        broker = ChangeBroker(history=3)
+        broker.publish([change(1), change(2), change(3)])
+        first = self._read(broker, broker.subscribe())
+        self.assertEqual(first, [])
+
+        subscription = broker.subscribe()
+        broker.publish([change(4)])
+        last_id = self._read(broker, subscription)[0][0]
+        broker.publish([change(5), change(6)])
+        resumed = self._read(broker, broker.subscribe(last_event_id=last_id))
+        self.assertEqual([data["shopcart_id"] for _, _, data in resumed], [5, 6])
+
+        # the event has left the history, or was sent by another worker
+        broker.publish([change(7)])
+        for last_event_id in (last_id, "elsewhere-1"):
+            events = self._read(broker, broker.subscribe(last_event_id=last_event_id))
+            self.assertEqual([event for _, event, _ in events], ["reset"])
+
+    def test_slow_subscriber_is_reset(self):
+        """ It should reset a subscription whose queue overflowed """
+        broker = ChangeBroker(queue_size=1)
+        subscription = broker.subscribe()
+        broker.publish([change(1), change(2)])
+        self.assertEqual([event for _, event, _ in self._read(broker, subscription)], ["reset"])
+
+
+class TestChangeFeedRoutes(ServiceTestCase):
+    """ GET /shopcarts/events Tests """
+
+    @classmethod
+    def setUpClass(cls):
+        """ Run once before the entire test suite """
+        super().setUpClass()
+        app.config["CHANGE_FEED_HEARTBEAT_SECONDS"] = 0.05
+        app.config["CHANGE_FEED_MAX_SECONDS"] = 0.2
+
+    @classmethod
+    def tearDownClass(cls):
+        app.config["CHANGE_FEED_HEARTBEAT_SECONDS"] = 15
+        app.config["CHANGE_FEED_MAX_SECONDS"] = 300
+
+    def setUp(self):
+        super().setUp()
+        resp = self.client.post(BASE_URL_RESTX, json={"name": "Watched"})
+        self.shopcart_id = resp.get_json()["id"]
+
+    def test_stream_changes(self):
+        """ It should stream the changes of a cart with its new version """
+        cart_url = f"{BASE_URL_RESTX}/{self.shopcart_id}"
+        all_carts = self.client.get(f"{BASE_URL_RESTX}/events", buffered=False)
+        one_cart = self.client.get(f"{cart_url}/events", buffered=False)
+        self.assertEqual(one_cart.status_code, status.HTTP_200_OK)
+        self.assertEqual(one_cart.mimetype, "text/event-stream")
+
+        item = self.client.post(f"{cart_url}/items", json={
+            "shopcart_id": self.shopcart_id, "name": "Air Pods", "quantity": 1, "price": 129.0
+        }).get_json()
+        self.client.patch(f"{cart_url}/items/{item['id']}", json={"quantity": 2})
+        self.client.put(cart_url, json={"name": "Renamed"})
+        self.client.put(f"{cart_url}/clear")
+        other = self.client.post(BASE_URL_RESTX, json={"name": "Other"}).get_json()
+        self.client.delete(cart_url)
+
+        events = parse_events(one_cart.get_data(as_text=True))
+        self.assertEqual([(event, data["version"]) for _, event, data in events], [
+            ("item.created", 2), ("item.updated", 3), ("shopcart.updated", 4),
+            ("shopcart.cleared", 5), ("shopcart.deleted", 6)
+        ])
+        self.assertEqual(events[1][2]["data"]["quantity"], 2)
+        self.assertEqual(events[2][2]["data"], {
+            "id": self.shopcart_id, "name": "Renamed", "version": 4,
+            "item_count": 1, "total_quantity": 2, "total_price": 258.0
+        })
+        self.assertIsNone(events[4][2]["data"])
+
+        events = parse_events(all_carts.get_data(as_text=True))
+        self.assertEqual(len(events), 6)
+        self.assertEqual(events[4][1:], ("shopcart.created", {
+            "type": "shopcart", "action": "created", "shopcart_id": other["id"], "id": other["id"],
+            "version": 1, "data": {"id": other["id"], "name": "Other", "version": 1, "item_count": 0,
+                                   "total_quantity": 0, "total_price": 0, "items": []}
+        }))
+
+    def test_streams_per_worker(self):
+        """ It should turn streams away beyond the limit of the worker until one closes """
+        with patch.object(change_feed.broker, "max_subscriptions", 1):
+            first = self.client.get(f"{BASE_URL_RESTX}/events", buffered=False)
+            resp = self.client.get(f"{BASE_URL_RESTX}/{self.shopcart_id}/events")
+            self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(resp.headers["Retry-After"], "3")
+            self.assertEqual(metrics.snapshot()["change_feed.rejected"], 1)
+            first.get_data()
+            resp = self.client.get(f"{BASE_URL_RESTX}/{self.shopcart_id}/events")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_rolled_back_changes_are_not_sent(self):
+        """ It should not stream the changes of a failed batch """
+        stream = self.client.get(f"{BASE_URL_RESTX}/events", buffered=False)
+        cart = f"/shopcarts/{self.shopcart_id}"
+        resp = self.client.post("/api/batch", json={"operations": [
+            {"method": "PUT", "path": cart, "body": {"name": "Renamed"}},
+            {"method": "GET", "path": "/shopcarts/0"},
+        ]})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(parse_events(stream.get_data(as_text=True)), [])
+        self.assertEqual(change_feed.broker.subscriber_count, 0)
+
+    def test_stream_missing_shopcart(self):
+        """ It should not stream the changes of a shopcart that does not exist """
+        resp = self.client.get(f"{BASE_URL_RESTX}/{self.shopcart_id + 10000}/events")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
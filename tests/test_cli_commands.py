@@ -5,16 +5,15 @@ import os
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 
-from click.testing import CliRunner
-
-from service.common.cli_commands import db_create
+from service import app
+from service.common.cli_commands import db_create, rebuild_item_stats, recompute_totals
 
 
 class TestFlaskCLI(TestCase):
     """Test Flask CLI Commands"""
 
     def setUp(self):
-        self.runner = CliRunner()
+        self.runner = app.test_cli_runner()
 
     @patch('service.common.cli_commands.db')
     def test_db_create(self, db_mock):
@@ -23,3 +22,24 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch('service.common.cli_commands.Shopcart.recompute_totals')
+    def test_recompute_totals(self, recompute_mock):
+        """It should call the recompute-totals command"""
+        recompute_mock.return_value = [3]
+        result = self.runner.invoke(recompute_totals)
+        self.assertEqual(result.exit_code, 1)
+        recompute_mock.assert_called_with(fix=False)
+        result = self.runner.invoke(recompute_totals, ["--fix"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("1 shopcarts with wrong totals fixed: [3]", result.output)
+        recompute_mock.return_value = []
+        self.assertEqual(self.runner.invoke(recompute_totals).exit_code, 0)
+
+    @patch('service.common.cli_commands.ItemStat.rebuild')
+    def test_rebuild_item_stats(self, rebuild_mock):
+        """It should call the rebuild-item-stats command"""
+        rebuild_mock.return_value = 4
+        result = self.runner.invoke(rebuild_item_stats)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Rebuilt the statistics of 4 item names", result.output)
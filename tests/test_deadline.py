@@ -0,0 +1,128 @@
+"""
+Test cases for request deadlines
+"""
+import time
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import patch
+
+from flask import g
+from sqlalchemy import select
+from werkzeug.exceptions import BadRequest
+
+from service import app
+from service.common import deadline, metrics, status
+from service.common.deadline import DeadlineExceeded, parse_deadline
+from service.models import db, Shopcart
+from . import BASE_URL_RESTX
+from .base import ServiceTestCase
+
+
+class TestParseDeadline(TestCase):
+    """ parse_deadline Tests """
+
+    def test_parse_deadline(self):
+        """ It should turn the deadline headers into a monotonic deadline """
+        now = time.monotonic()
+        self.assertAlmostEqual(parse_deadline({"X-Request-Timeout": "2"}, 0) - now, 2, delta=0.1)
+        self.assertAlmostEqual(parse_deadline({"X-Request-Deadline": str(time.time() + 3)}, 0) - now, 3, delta=0.1)
+        self.assertAlmostEqual(parse_deadline({}, 5) - now, 5, delta=0.1)
+        self.assertIsNone(parse_deadline({}, 0))
+        self.assertRaises(BadRequest, parse_deadline, {"X-Request-Timeout": "soon"}, 0)
+
+
+class TestDeadline(ServiceTestCase):
+    """ Request deadline Tests """
+
+    def test_expired_on_arrival(self):
+        """ It should refuse a request whose deadline has already passed """
+        resp = self.client.get(BASE_URL_RESTX, headers={"X-Request-Deadline": str(time.time() - 1)})
+        self.assertEqual(resp.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+        self.assertEqual(self.client.get("/health", headers={"X-Request-Timeout": "0"}).status_code,
+                         status.HTTP_200_OK)
+        self.assertEqual(self.client.get(BASE_URL_RESTX, headers={"X-Request-Timeout": "5"}).status_code,
+                         status.HTTP_200_OK)
+        self.assertEqual(self.client.get(BASE_URL_RESTX, headers={"X-Request-Timeout": "x"}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        counters = metrics.snapshot()
+        self.assertEqual((counters["deadline.expired_on_arrival"], counters["deadline.exceeded"]), (1, 1))
+
+    def test_serialization_is_cut_short(self):
+        """ It should stop serializing a list once the deadline passes """
+        for name in ("One", "Two", "Three"):
+            self.client.post(BASE_URL_RESTX, json={"name": name})
+        serialize = Shopcart.serialize
+        serialized = []
+
+        def slow_serialize(shopcart):
+            serialized.append(shopcart.id)
+            time.sleep(0.1)
+            return serialize(shopcart)
+
+        with patch.object(Shopcart, "serialize", slow_serialize):
+            resp = self.client.get(BASE_URL_RESTX, headers={"X-Request-Timeout": "0.05"})
+        self.assertEqual(resp.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+        self.assertEqual(len(serialized), 1)
+        self.assertEqual(metrics.snapshot()["deadline.exceeded"], 1)
+
+    def test_statements_after_the_deadline(self):
+        """ It should not run a statement once the deadline has passed """
+        with app.test_request_context():
+            g.deadline = time.monotonic() - 1
+            with self.assertRaises(DeadlineExceeded):
+                db.session.execute(select(Shopcart.id)).all()
+            db.session.rollback()
+            g.deadline = time.monotonic() + 5
+            self.assertEqual(db.session.execute(select(Shopcart.id)).all(), [])
+            g.deadline = time.monotonic() - 1
+            with deadline.suspended():
+                self.assertEqual(db.session.execute(select(Shopcart.id)).all(), [])
+            self.assertRaises(DeadlineExceeded, deadline.check)
+
+    def test_idempotency_key_released_past_the_deadline(self):
+        """ It should release the Idempotency-Key of a request cut short, so its retry runs """
+        deserialize = Shopcart.deserialize
+
+        def slow_deserialize(shopcart, data):
+            time.sleep(0.1)
+            deserialize(shopcart, data)
+
+        headers = {"Idempotency-Key": "k1"}
+        with patch.object(Shopcart, "deserialize", slow_deserialize):
+            resp = self.client.post(BASE_URL_RESTX, json={"name": "Late"}, headers=dict(headers, **{
+                "X-Request-Timeout": "0.05"
+            }))
+        self.assertEqual(resp.status_code, status.HTTP_504_GATEWAY_TIMEOUT)
+        self.assertEqual(db.session.query(Shopcart).count(), 0)
+        resp = self.client.post(BASE_URL_RESTX, json={"name": "Late"}, headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+    def test_idempotent_post_committed_past_the_deadline(self):
+        """ It should answer a request that committed past its deadline, and replay that answer to its retry """
+        create = Shopcart.create
+
+        def slow_create(shopcart):
+            create(shopcart)
+            time.sleep(0.1)
+
+        headers = {"Idempotency-Key": "k1"}
+        with patch.object(Shopcart, "create", slow_create):
+            first = self.client.post(BASE_URL_RESTX, json={"name": "Late"}, headers=dict(headers, **{
+                "X-Request-Timeout": "0.05"
+            }))
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        retry = self.client.post(BASE_URL_RESTX, json={"name": "Late"}, headers=headers)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.get_json(), first.get_json())
+        self.assertEqual(db.session.query(Shopcart).count(), 1)
+
+    def test_cancelled_statement(self):
+        """ It should report a statement cancelled by its statement_timeout as a 504 """
+        cancelled = SimpleNamespace(original_exception=SimpleNamespace(pgcode="57014"))
+        with app.test_request_context():
+            g.deadline = None
+            self.assertIsNone(deadline._statement_timed_out(cancelled))  # pylint: disable=protected-access
+            g.deadline = time.monotonic()
+            self.assertIsInstance(deadline._statement_timed_out(cancelled),  # pylint: disable=protected-access
+                                  DeadlineExceeded)
@@ -0,0 +1,111 @@
+"""
+Test cases for the shopcart expiry
+"""
+import time
+from datetime import timedelta
+from unittest.mock import patch
+
+from sqlalchemy import update
+
+from service import app
+from service.common import change_feed, expiry, metrics, status
+from service.common.cli_commands import sweep_expired
+from service.common.expiry import ExpirySweeper, init_expiry
+from service.models import db, Item, ItemStat, Shopcart, utcnow
+from . import BASE_URL_RESTX
+from .base import ServiceTestCase
+
+HOUR = 3600
+
+
+class TestExpiry(ServiceTestCase):
+    """ Shopcart expiry Tests """
+
+    def _cart(self, name, hours_ago, items=0):
+        """ A shopcart with items, last changed some hours ago """
+        shopcart_id = self.client.post(BASE_URL_RESTX, json={"name": name}).get_json()["id"]
+        for _ in range(items):
+            self.client.post(f"{BASE_URL_RESTX}/{shopcart_id}/items", json={
+                "shopcart_id": shopcart_id, "name": "Air Pods", "quantity": 1, "price": 129.0
+            })
+        db.session.execute(update(Shopcart).where(Shopcart.id == shopcart_id).values(
+            updated_at=utcnow() - timedelta(hours=hours_ago)
+        ))
+        db.session.commit()
+        return shopcart_id
+
+    def test_timestamps(self):
+        """ It should time the creation and the last change of a shopcart """
+        shopcart = self.client.post(BASE_URL_RESTX, json={"name": "Timed"}).get_json()
+        self.assertEqual(shopcart["created_at"], shopcart["updated_at"])
+        self.client.post(f"{BASE_URL_RESTX}/{shopcart['id']}/items", json={
+            "shopcart_id": shopcart["id"], "name": "Air Pods", "quantity": 1, "price": 129.0
+        })
+        resp = self.client.get(f"{BASE_URL_RESTX}/{shopcart['id']}")
+        self.assertEqual(resp.get_json()["created_at"], shopcart["created_at"])
+        self.assertGreater(resp.get_json()["updated_at"], shopcart["updated_at"])
+
+    def test_sweep_expired_shopcarts(self):
+        """ It should delete the expired shopcarts and their items in chunks """
+        ancient = self._cart("Ancient", hours_ago=3, items=2)
+        abandoned = self._cart("Abandoned", hours_ago=1)
+        kept = self._cart("Kept", hours_ago=1, items=1)
+        fresh = self._cart("Fresh", hours_ago=0)
+        subscription = change_feed.broker.subscribe()
+        try:
+            sweeper = ExpirySweeper(app, ttl=2 * HOUR, empty_ttl=HOUR / 2, chunk_size=1)
+            self.assertEqual(sweeper.sweep(), 2)
+        finally:
+            change_feed.broker.unsubscribe(subscription)
+
+        self.assertEqual(sorted(shopcart.id for shopcart in Shopcart.get_all()), [kept, fresh])
+        self.assertEqual({item.shopcart_id for item in Item.get_all()}, {kept})
+        self.assertEqual([(stat.name, stat.cart_count) for stat in ItemStat.top(10)], [("Air Pods", 1)])
+        events = [subscription.events.get_nowait() for _ in range(subscription.events.qsize())]
+        self.assertEqual([(event["action"], event["id"]) for event in events],
+                         [("expired", ancient), ("expired", abandoned)])
+        counters = metrics.snapshot()
+        self.assertEqual((counters["expiry.deleted"], counters["expiry.chunks"]), (2, 2))
+        self.assertEqual(self.client.get(f"{BASE_URL_RESTX}/{ancient}").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_sweeper_thread(self):
+        """ It should sweep from a background thread once configured, back off after a failure, until stopped """
+        self.assertIsNone(init_expiry(app))
+        self._cart("Ancient", hours_ago=3)
+        sweep_expired_shopcarts = Shopcart.sweep_expired
+        calls = []
+
+        def flaky_sweep(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise OSError("database went away")
+            return sweep_expired_shopcarts(*args)
+
+        config = {"SHOPCART_SWEEP_SECONDS": 0.01, "SHOPCART_TTL_SECONDS": 2 * HOUR}
+        with patch.dict(app.config, config), patch.object(expiry, "FAILURE_BACKOFF_SECONDS", 0.01), \
+                patch.object(Shopcart, "sweep_expired", flaky_sweep):
+            sweeper = init_expiry(app)
+            for _ in range(500):
+                if metrics.snapshot().get("expiry.deleted"):
+                    break
+                time.sleep(0.01)
+            sweeper.stop()
+        self.assertFalse(sweeper.is_alive())
+        counters = metrics.snapshot()
+        self.assertEqual((counters["expiry.failed"], counters["expiry.deleted"]), (1, 1))
+        self.assertEqual(Shopcart.get_all(), [])
+
+    def test_no_policy(self):
+        """ It should keep every shopcart without a time to live """
+        self._cart("Ancient", hours_ago=10000)
+        self.assertEqual(Shopcart.sweep_expired(ttl=0), 0)
+        self.assertEqual(len(Shopcart.get_all()), 1)
+
+    def test_sweep_expired_command(self):
+        """ It should sweep the expired shopcarts from the CLI """
+        self._cart("Ancient", hours_ago=3)
+        runner = app.test_cli_runner()
+        self.assertNotEqual(runner.invoke(sweep_expired, ["--ttl", "0"]).exit_code, 0)
+        result = runner.invoke(sweep_expired, ["--ttl", str(2 * HOUR)])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Deleted 1 expired shopcarts", result.output)
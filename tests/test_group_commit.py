@@ -0,0 +1,138 @@
+"""
+Test cases for group commit
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from unittest.mock import MagicMock, Mock
+
+from flask import Flask, g
+
+from service import app
+from service.common import deadline, group_commit, metrics, status
+from service.common.deadline import DeadlineExceeded
+from service.common.group_commit import FlushFailed, GroupCommitter, postgresql_flush, sqlite_flush
+from service.models import db, Shopcart
+from . import BASE_URL_RESTX
+from .base import ServiceTestCase
+
+
+class TestGroupCommitter(TestCase):
+    """ GroupCommitter Tests """
+
+    def test_concurrent_commits_share_a_flush(self):
+        """ It should make the commits waiting together durable with one flush """
+        flushes = []
+        committer = GroupCommitter(lambda: flushes.append(threading.get_ident()), delay=5, max_batch=4)
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(lambda _: committer.wait_durable(), range(4)))
+        self.assertEqual(len(flushes), 1)
+        # a lone commit is flushed once the delay is over
+        GroupCommitter(lambda: flushes.append(None), delay=0, max_batch=4).wait_durable()
+        self.assertEqual(len(flushes), 2)
+
+    def test_failed_flush(self):
+        """ It should fail every commit of a group whose flush failed """
+        def broken_flush():
+            raise OSError("disk on fire")
+
+        committer = GroupCommitter(broken_flush, delay=5, max_batch=2)
+        with ThreadPoolExecutor(2) as pool:
+            futures = [pool.submit(committer.wait_durable) for _ in range(2)]
+        errors = [future.exception() for future in futures]
+        for error in errors:
+            self.assertIsInstance(error, FlushFailed)
+            self.assertIsInstance(error.__cause__, OSError)
+        self.assertIsNot(errors[0], errors[1])  # each waiter raises its own
+
+    def test_flush_past_the_deadline(self):
+        """ It should flush the group whatever the deadline of the request leading it """
+        def flush():
+            with db.engine.connect() as connection:
+                connection.exec_driver_sql("SELECT 1")
+
+        committer = GroupCommitter(flush, delay=0, max_batch=1)
+        with app.test_request_context():
+            g.deadline = time.monotonic() - 1
+            committer.wait_durable()
+            self.assertRaises(DeadlineExceeded, deadline.check)
+
+    def test_sqlite_flush(self):
+        """ It should fsync the WAL file of a SQLite database """
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "flushed.db")
+            sqlite_flush(path)()  # no WAL, nothing to flush
+            conn = sqlite3.connect(path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE t (x INTEGER)")
+            conn.commit()
+            self.assertTrue(os.path.exists(f"{path}-wal"))
+            sqlite_flush(path)()
+            conn.close()
+
+    def test_postgresql_flush(self):
+        """ It should flush the WAL of a PostgreSQL database with a transaction that has an id """
+        engine = MagicMock()
+        postgresql_flush(engine)()
+        connection = engine.connect.return_value.__enter__.return_value
+        connection.exec_driver_sql.assert_called_once_with("SELECT txid_current()")
+        connection.commit.assert_called_once_with()
+
+
+class TestGroupCommitRequests(ServiceTestCase):
+    """ Group commit of the write requests Tests """
+
+    def setUp(self):
+        super().setUp()
+        self.flushes = []
+        group_commit.committer = GroupCommitter(lambda: self.flushes.append(True), delay=0, max_batch=8)
+
+    def tearDown(self):
+        group_commit.committer = None
+        super().tearDown()
+
+    def test_writes_wait_for_their_flush(self):
+        """ It should answer a write request once a flush made its commit durable """
+        resp = self.client.post(BASE_URL_RESTX, json={"name": "Grouped"})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(self.flushes), 1)
+        self.assertEqual(self.client.get(f"{BASE_URL_RESTX}/{resp.get_json()['id']}").status_code,
+                         status.HTTP_200_OK)
+        self.assertEqual(len(self.flushes), 1)
+        counters = metrics.snapshot()
+        self.assertEqual((counters["group_commit.flushes"], counters["group_commit.writes"]), (1, 1))
+
+    def test_commit_outside_of_a_request(self):
+        """ It should wait for the flush right away when no request can wait for it """
+        Shopcart(name="Scripted").create()
+        self.assertEqual(len(self.flushes), 1)
+
+    def test_asynchronous_postgresql_commits(self):
+        """ It should let the PostgreSQL transactions commit without waiting for the WAL """
+        connection = Mock()
+        connection.dialect.name = "postgresql"
+        group_commit._commit_without_flush(None, None, connection)  # pylint: disable=protected-access
+        connection.exec_driver_sql.assert_called_once_with("SET LOCAL synchronous_commit = off")
+
+    def test_init_group_commit(self):
+        """ It should flush the WAL of a SQLite database once enabled, and stay off on in memory databases """
+        with tempfile.TemporaryDirectory() as folder:
+            for database, enabled in ((os.path.join(folder, "grouped.db"), True), (":memory:", False)):
+                grouped = Flask("grouped")
+                grouped.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{database}", GROUP_COMMIT_ENABLED=True,
+                                      GROUP_COMMIT_DELAY_MS=0, GROUP_COMMIT_MAX_BATCH=4)
+                db.init_app(grouped)
+                committer = group_commit.init_group_commit(grouped)
+                self.assertIs(group_commit.committer, committer)
+                self.assertEqual(committer is not None, enabled)
+                with grouped.app_context():
+                    with db.engine.connect() as connection:
+                        journal_mode = connection.exec_driver_sql("PRAGMA journal_mode").scalar()
+                    db.engine.dispose()
+                self.assertEqual(journal_mode, "wal" if enabled else "memory")
+                if committer is not None:
+                    committer.wait_durable()
@@ -0,0 +1,117 @@
+"""
+Test cases for Idempotency Keys
+"""
+import threading
+import time
+from unittest.mock import patch
+
+from service import app
+from service.common import status
+from service.models import db, IdempotencyKey, Shopcart
+from . import BASE_URL_RESTX
+from .base import ServiceTestCase
+
+
+class TestIdempotencyKeys(ServiceTestCase):
+    """ Idempotency-Key Tests """
+
+    def _post(self, url, body, key):
+        return self.client.post(url, json=body, headers={"Idempotency-Key": key})
+
+    def test_retried_post_is_replayed(self):
+        """ It should create a Shopcart once and replay the response on retries """
+        first = self._post(BASE_URL_RESTX, {"name": "Mobile"}, "cart-1")
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn("Idempotent-Replayed", first.headers)
+
+        retry = self._post(BASE_URL_RESTX, {"name": "Mobile"}, "cart-1")
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(retry.get_json(), first.get_json())
+        self.assertEqual(len(Shopcart.get_all()), 1)
+
+        # items are deduplicated too
+        shopcart_id = first.get_json()["id"]
+        item = {"shopcart_id": shopcart_id, "name": "Air Pods", "quantity": 1, "price": 129.0}
+        url = f"{BASE_URL_RESTX}/{shopcart_id}/items"
+        first = self._post(url, item, "item-1")
+        retry = self._post(url, item, "item-1")
+        self.assertEqual(retry.get_json(), first.get_json())
+        self.assertEqual(len(self.client.get(url).get_json()), 1)
+
+        # without a key every request executes
+        self.client.post(BASE_URL_RESTX, json={"name": "Mobile"})
+        self.assertEqual(len(Shopcart.get_all()), 2)
+
+    def test_key_reused_for_another_request(self):
+        """ It should reject a key reused with a different body """
+        self._post(BASE_URL_RESTX, {"name": "Mobile"}, "cart-1")
+        resp = self._post(BASE_URL_RESTX, {"name": "Desktop"}, "cart-1")
+        self.assertEqual(resp.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        resp = self._post(BASE_URL_RESTX, {"name": "Mobile"}, "x" * 256)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_failed_request_releases_key(self):
+        """ It should execute a retry when the first attempt failed """
+        resp = self._post(BASE_URL_RESTX, {"name": " "}, "cart-1")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIsNone(db.session.get(IdempotencyKey, "cart-1"))
+        resp = self._post(BASE_URL_RESTX, {"name": "Fixed"}, "cart-2")
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+    def test_request_failed_after_commit_keeps_key(self):
+        """ It should not execute a retry of a request that failed after committing """
+        with patch.object(Shopcart, "serialize", side_effect=RuntimeError("lost")):
+            self.assertRaises(RuntimeError, self._post, BASE_URL_RESTX, {"name": "Mobile"}, "cart-1")
+        self.assertIsNotNone(db.session.get(IdempotencyKey, "cart-1"))
+        app.config["IDEMPOTENCY_WAIT_SECONDS"] = 0.1
+        try:
+            resp = self._post(BASE_URL_RESTX, {"name": "Mobile"}, "cart-1")
+            self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        finally:
+            app.config["IDEMPOTENCY_WAIT_SECONDS"] = 5
+        self.assertEqual(len(Shopcart.get_all()), 1)
+
+    def test_request_in_progress(self):
+        """ It should answer 409 while the first request is still running """
+        app.config["IDEMPOTENCY_WAIT_SECONDS"] = 0.1
+        try:
+            resp = self._post(BASE_URL_RESTX, {"name": "Mobile"}, "cart-1")
+            record = db.session.get(IdempotencyKey, "cart-1")
+            record.status_code = None
+            record.locked_at = time.time()
+            db.session.commit()
+            resp = self._post(BASE_URL_RESTX, {"name": "Mobile"}, "cart-1")
+            self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        finally:
+            app.config["IDEMPOTENCY_WAIT_SECONDS"] = 5
+
+    def test_expired_key_executes_again(self):
+        """ It should execute the request again once the key has expired """
+        self._post(BASE_URL_RESTX, {"name": "Mobile"}, "cart-1")
+        db.session.get(IdempotencyKey, "cart-1").expires_at = time.time() - 1
+        db.session.commit()
+        resp = self._post(BASE_URL_RESTX, {"name": "Mobile"}, "cart-1")
+        self.assertNotIn("Idempotent-Replayed", resp.headers)
+        self.assertEqual(len(Shopcart.get_all()), 2)
+        self.assertEqual(IdempotencyKey.purge_expired(), 0)
+
+    def test_concurrent_duplicates(self):
+        """ It should execute concurrent duplicates once """
+        barrier = threading.Barrier(4)
+        responses = []
+
+        def post():
+            barrier.wait()
+            responses.append(app.test_client().post(
+                BASE_URL_RESTX, json={"name": "Flaky"}, headers={"Idempotency-Key": "dup"}
+            ))
+
+        threads = [threading.Thread(target=post) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual({resp.status_code for resp in responses}, {status.HTTP_201_CREATED})
+        self.assertEqual(len({resp.get_json()["id"] for resp in responses}), 1)
+        self.assertEqual(len(Shopcart.get_all()), 1)
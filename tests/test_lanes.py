@@ -0,0 +1,91 @@
+"""
+Test cases for the worker lanes
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from unittest.mock import patch
+
+from service import app
+from service.common import metrics, status
+from service.common.lanes import BULK, INTERACTIVE, LaneControl, classify
+from service.models import db, Shopcart
+from . import BASE_URL_RESTX
+from .base import ServiceTestCase
+
+
+class TestClassify(TestCase):
+    """ Request classification Tests """
+
+    def test_classify(self):
+        """ It should put the full listing and batches in the bulk lane """
+        self.assertEqual(classify("shopcart_collection", "GET", {}), BULK)
+        self.assertEqual(classify("shopcart_collection", "GET", {"limit": "10"}), INTERACTIVE)
+        self.assertEqual(classify("shopcart_collection", "GET", {"name": "Mine"}), INTERACTIVE)
+        self.assertEqual(classify("shopcart_collection", "POST", {}), INTERACTIVE)
+        self.assertEqual(classify("batch_resource", "POST", {}), BULK)
+        self.assertEqual(classify("item_collection", "POST", {}), INTERACTIVE)
+        self.assertIsNone(classify("health", "GET", {}))
+        self.assertIsNone(classify("shopcart_events_resource", "GET", {}))
+        self.assertIsNone(classify(None, "GET", {}))
+
+
+class TestLanes(ServiceTestCase):
+    """ Worker lane Tests """
+
+    def setUp(self):
+        super().setUp()
+        self.default_control = app.extensions["lanes"]
+        db.session.commit()
+
+    def tearDown(self):
+        app.extensions["lanes"] = self.default_control
+        super().tearDown()
+
+    def test_bulk_requests_do_not_block_interactive_ones(self):
+        """ It should serve interactive requests while the bulk lane is full """
+        app.extensions["lanes"] = LaneControl({"LANE_BULK_MAX_IN_FLIGHT": 1})
+        shopcart_id = self.client.post(BASE_URL_RESTX, json={"name": "Interactive"}).get_json()["id"]
+        listing, release = threading.Event(), threading.Event()
+        get_all = Shopcart.get_all
+        binds = []
+
+        def slow_get_all():
+            binds.append(db.session.get_bind())
+            listing.set()
+            release.wait(10)
+            return get_all()
+
+        def in_new_context(url):
+            with app.app_context():
+                return app.test_client().get(url)
+
+        with patch.object(Shopcart, "get_all", slow_get_all), ThreadPoolExecutor(1) as pool:
+            bulk = pool.submit(in_new_context, BASE_URL_RESTX)
+            self.assertTrue(listing.wait(10))
+            resp = self.client.get(BASE_URL_RESTX)
+            self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(resp.headers["Retry-After"], "1")
+            resp = self.client.post(f"{BASE_URL_RESTX}/{shopcart_id}/items", json={
+                "shopcart_id": shopcart_id, "name": "Air Pods", "quantity": 1, "price": 129.0
+            })
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(self.client.get(f"{BASE_URL_RESTX}/{shopcart_id}").status_code, status.HTTP_200_OK)
+            counters = self.client.get("/metrics").get_json()
+            self.assertEqual((counters["lanes.bulk.in_flight"], counters["lanes.bulk.rejected"]), (1, 1))
+            release.set()
+            self.assertEqual(bulk.result().status_code, status.HTTP_200_OK)
+
+        # the listing ran on the engine of the bulk lane, the interactive requests did not
+        self.assertEqual(binds, [db.engines[BULK]])
+        self.assertIs(db.session.get_bind(), db.engine)
+        self.assertEqual(metrics.snapshot()["lanes.bulk.in_flight"], 0)
+
+    def test_interactive_lane_limit(self):
+        """ It should reject the interactive requests past the lane limit """
+        app.extensions["lanes"] = LaneControl({"LANE_INTERACTIVE_MAX_IN_FLIGHT": 1, "LANE_BULK_MAX_IN_FLIGHT": 0})
+        self.assertEqual(self.client.get(BASE_URL_RESTX).status_code, status.HTTP_200_OK)
+        app.extensions["lanes"].lanes[INTERACTIVE].in_flight = 1
+        self.assertEqual(self.client.get(BASE_URL_RESTX).status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(self.client.get("/health").status_code, status.HTTP_200_OK)
+        self.assertEqual(metrics.snapshot()["lanes.interactive.rejected"], 1)
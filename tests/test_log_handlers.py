@@ -0,0 +1,104 @@
+"""
+Test cases for the Log Handlers
+"""
+import json
+import logging
+from unittest import TestCase
+
+from flask import Flask
+
+from service import models
+from service.common import log_handlers
+
+
+class CollectingHandler(logging.Handler):
+    """ Keeps the formatted records in memory """
+
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+class TestLogHandlers(TestCase):
+    """ Log Handlers Tests """
+
+    def setUp(self):
+        self.handler = CollectingHandler()
+        self.gunicorn_logger = logging.getLogger("test.gunicorn")
+        self.gunicorn_logger.handlers = [self.handler]
+        self.gunicorn_logger.setLevel(logging.INFO)
+        self.app = Flask("test_log_handlers")
+        self.listener = None
+
+        @self.app.route("/ping")
+        def ping():  # pylint: disable=unused-variable
+            self.app.logger.info("pong")
+            self.app.logger.warning("careful")
+            return "pong"
+
+    def _init(self, **config):
+        self.app.config.update(config)
+        self.listener = log_handlers.init_logging(self.app, "test.gunicorn")
+
+    def _records(self):
+        self.listener.stop()  # drains the queue
+        return [json.loads(line) for line in self.handler.lines]
+
+    def test_json_logs_carry_request_id(self):
+        """ It should log JSON lines tagged with the request id """
+        self._init(LOG_FORMAT="json")
+        resp = self.app.test_client().get("/ping", headers={"X-Request-ID": "abc123"})
+        self.assertEqual(resp.headers["X-Request-ID"], "abc123")
+        records = self._records()
+        self.assertEqual(records[0]["message"], "Logging handler established")
+        self.assertIsNone(records[0]["request_id"])
+        pong = [r for r in records if r["message"] == "pong"][0]
+        self.assertEqual(pong["request_id"], "abc123")
+        self.assertEqual(pong["level"], "INFO")
+
+    def test_model_logs_carry_request_id(self):
+        """ It should log the records of the models through the app logger """
+        service_logger = logging.getLogger("service")
+        saved = (service_logger.handlers, service_logger.filters, service_logger.level, service_logger.propagate)
+        self.app = Flask("service")
+
+        @self.app.route("/models")
+        def log_from_models():  # pylint: disable=unused-variable
+            models.logger.info("from the models")
+            return "logged"
+
+        try:
+            self._init(LOG_FORMAT="json")
+            self.app.test_client().get("/models", headers={"X-Request-ID": "abc123"})
+            records = [r for r in self._records() if r["message"] == "from the models"]
+        finally:
+            service_logger.handlers, service_logger.filters, service_logger.level, service_logger.propagate = saved
+        self.assertEqual(records[0]["request_id"], "abc123")
+        self.assertEqual(records[0]["module"], "test_log_handlers")
+
+    def test_request_id_generated(self):
+        """ It should generate a request id when none is sent """
+        self._init(LOG_FORMAT="json")
+        resp = self.app.test_client().get("/ping")
+        self.assertEqual(len(resp.headers["X-Request-ID"]), 32)
+        self._records()
+
+    def test_sampling_keeps_warnings(self):
+        """ It should drop unsampled info logs but keep warnings """
+        self._init(LOG_FORMAT="json", LOG_SAMPLE_RATE=0.0)
+        self.app.test_client().get("/ping")
+        messages = [r["message"] for r in self._records()]
+        self.assertNotIn("pong", messages)
+        self.assertIn("careful", messages)
+
+    def test_text_format(self):
+        """ It should support the plain text format """
+        self._init(LOG_FORMAT="text")
+        self.app.test_client().get("/ping", headers={"X-Request-ID": "abc123"})
+        self.listener.stop()
+        self.assertIn("[INFO] [test_log_handlers] [abc123] pong", "\n".join(self.handler.lines))
+        record = logging.makeLogRecord({"msg": "from gunicorn"})
+        self.assertIn("[-] from gunicorn", self.handler.format(record))
@@ -0,0 +1,35 @@
+"""
+Memory Budget Regression Test
+
+Runs the memory harness in a fresh interpreter so that the measured RSS is the
+footprint of the service alone and not of the test runner.
+"""
+import json
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+from . import DATABASE_URI
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class TestMemoryBudget(TestCase):
+    """ Memory footprint budget for the 64Mi pods """
+
+    def test_memory_budget(self):
+        """ It should serve the representative traffic mix within the memory budget """
+        env = dict(os.environ, DATABASE_URI=DATABASE_URI)
+        proc = subprocess.run(
+            [sys.executable, "-m", "tests.memory_harness", "--json", "--carts", "20", "--large-cart-items", "200"],
+            cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, timeout=300, check=False
+        )
+        self.assertIn(proc.returncode, (0, 1), proc.stderr)
+        report = json.loads(proc.stdout)
+        self.assertEqual(len(report["endpoints"]), 11)
+        for endpoint in report["endpoints"]:
+            self.assertLess(endpoint["status_code"], 300, endpoint["endpoint"])
+            self.assertTrue(endpoint["top_allocators"], endpoint["endpoint"])
+        self.assertEqual(report["violations"], [])
+        self.assertEqual(proc.returncode, 0)
@@ -0,0 +1,55 @@
+"""
+Test cases for the columns added to older databases
+"""
+import os
+import tempfile
+
+from sqlalchemy import create_engine, inspect, text
+
+from service import app
+from service.common.cli_commands import add_missing_columns
+from service.models import add_columns, NO_TIME
+from .base import ServiceTestCase
+
+# the tables as the first release created them
+FIRST_SCHEMA = (
+    "CREATE TABLE shopcart (id INTEGER PRIMARY KEY, name VARCHAR(63) NOT NULL)",
+    "CREATE TABLE item (id INTEGER PRIMARY KEY, shopcart_id INTEGER NOT NULL, name VARCHAR(128) NOT NULL, "
+    "quantity INTEGER NOT NULL, price_cents BIGINT NOT NULL)",
+)
+
+
+class TestAddColumns(ServiceTestCase):
+    """ Added column Tests """
+
+    def test_add_columns(self):
+        """ It should add the missing columns of an older database once and fill them in """
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f"sqlite:///{os.path.join(directory, 'old.db')}")
+            with engine.begin() as connection:
+                for statement in FIRST_SCHEMA:
+                    connection.execute(text(statement))
+                connection.execute(text("INSERT INTO shopcart VALUES (1, 'Old'), (2, 'Empty')"))
+                connection.execute(text("INSERT INTO item VALUES (1, 1, 'Gum', 3, 25), (2, 1, 'Tea', 1, 400)"))
+                self.assertEqual(add_columns(connection), [
+                    "shopcart.version", "shopcart.item_count", "shopcart.total_quantity", "shopcart.total_price_cents",
+                    "shopcart.created_at", "shopcart.updated_at",
+                ])
+            with engine.begin() as connection:
+                self.assertEqual(add_columns(connection), [])
+                columns = [column["name"] for column in inspect(connection).get_columns("shopcart")]
+                self.assertEqual(columns, ["id", "name", "version", "item_count", "total_quantity", "total_price_cents",
+                                           "created_at", "updated_at"])
+                rows = connection.execute(text("SELECT * FROM shopcart ORDER BY id")).all()
+                self.assertEqual([tuple(row[:6]) for row in rows], [(1, "Old", 1, 2, 4, 475), (2, "Empty", 1, 0, 0, 0)])
+                self.assertEqual(rows[0].created_at, rows[0].updated_at)
+                self.assertGreater(rows[0].updated_at, NO_TIME)
+                indexes = [index["name"] for index in inspect(connection).get_indexes("shopcart")]
+                self.assertEqual(indexes, ["ix_shopcart_updated_at"])
+            engine.dispose()
+
+    def test_add_columns_command(self):
+        """ It should leave an up to date database alone """
+        result = app.test_cli_runner().invoke(add_missing_columns)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Added 0 columns", result.output)
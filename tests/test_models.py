@@ -4,9 +4,10 @@ Test cases for Shopcart Model
 """
 import logging
 import unittest
+from unittest.mock import Mock, patch
 
 from service import app
-from service.models import Shopcart, Item, db, DataValidationError
+from service.models import Shopcart, Item, ItemStat, db, DataValidationError
 from tests.factories import ShopcartFactory, ItemFactory
 from . import DATABASE_URI
 
@@ -27,13 +28,10 @@ class TestShopcart(unittest.TestCase):
         app.logger.setLevel(logging.CRITICAL)
         Shopcart.init_db(app)
 
-    @classmethod
-    def tearDownClass(cls):
-        """ This runs once after the entire test suite """
-        db.session.close()
-
     def setUp(self):
         """ This runs before each test """
+        self.app_context = app.app_context()
+        self.app_context.push()
         db.drop_all()  # clean up the last tests
         db.create_all()  # make our sqlalchemy tables
 
@@ -41,6 +39,7 @@ class TestShopcart(unittest.TestCase):
         """ This runs after each test """
         db.session.remove()
         db.drop_all()
+        self.app_context.pop()
 
     ######################################################################
     #  T E S T   C A S E S
@@ -188,13 +187,10 @@ class TestItem(unittest.TestCase):
         app.logger.setLevel(logging.CRITICAL)
         Item.init_db(app)
 
-    @classmethod
-    def tearDownClass(cls):
-        """ This runs once after the entire test suite """
-        db.session.close()
-
     def setUp(self):
         """ This runs before each test """
+        self.app_context = app.app_context()
+        self.app_context.push()
         db.drop_all()  # clean up the last tests
         db.create_all()  # make our sqlalchemy tables
 
@@ -202,6 +198,7 @@ class TestItem(unittest.TestCase):
         """ This runs after each test """
         db.session.remove()
         db.drop_all()
+        self.app_context.pop()
 
     ######################################################################
     #  T E S T   C A S E S
@@ -245,6 +242,145 @@ class TestItem(unittest.TestCase):
         updated_item = shopcart.items[0]
         self.assertEqual(updated_item.name, item.name)
 
+    def test_patch_shopcart_item(self):
+        """ It should patch only the given columns of an item """
+        shopcart = ShopcartFactory()
+        shopcart.items.append(ItemFactory(quantity=1, price=5.0))
+        shopcart.create()
+        item_id = shopcart.items[0].id
+
+        item = Item.patch(item_id, Item.deserialize_patch({"quantity": 4}), shopcart_id=shopcart.id)
+        self.assertEqual((item.quantity, item.price), (4, 5.0))
+        self.assertEqual(Item.get_by_id(item_id).quantity, 4)
+        self.assertIsNone(Item.patch(item_id, {"quantity": 2}, shopcart_id=shopcart.id + 1))
+        self.assertEqual(Shopcart.patch(shopcart.id, {"name": "Patched"}).name, "Patched")
+        self.assertEqual(Shopcart.patch(shopcart.id, {}).name, "Patched")
+
+        self.assertRaises(DataValidationError, Item.deserialize_patch, {"quantity": "two"})
+        self.assertRaises(DataValidationError, Item.deserialize_patch, {"id": 1})
+        self.assertRaises(DataValidationError, Shopcart.deserialize_patch, None)
+
+    def test_shopcart_totals(self):
+        """ It should keep the item totals of a shopcart up to date """
+        def totals(shopcart_id):
+            shopcart = db.session.get(Shopcart, shopcart_id, populate_existing=True)
+            return shopcart.item_count, shopcart.total_quantity, shopcart.total_price
+
+        shopcart = ShopcartFactory()
+        shopcart.items.append(ItemFactory(quantity=2, price=5.0))
+        shopcart.create()
+        self.assertEqual(totals(shopcart.id), (1, 2, 10.0))
+
+        item = Item(name="Case", quantity=1, price=20.0)
+        shopcart.items.append(item)
+        item.create()
+        self.assertEqual(totals(shopcart.id), (2, 3, 30.0))
+
+        item.quantity = 3
+        item.update()
+        self.assertEqual(totals(shopcart.id), (2, 5, 70.0))
+        Item.patch(item.id, {"price": 10.0}, shopcart_id=shopcart.id)
+        self.assertEqual(totals(shopcart.id), (2, 5, 40.0))
+
+        other = ShopcartFactory()
+        other.create()
+        item.shopcart_id = other.id
+        item.update()
+        self.assertEqual(totals(shopcart.id), (1, 2, 10.0))
+        self.assertEqual(totals(other.id), (1, 3, 30.0))
+        item.delete()
+        self.assertEqual(totals(other.id), (0, 0, 0.0))
+
+        Shopcart.get_by_id(shopcart.id).clear()
+        self.assertEqual(totals(shopcart.id), (0, 0, 0.0))
+
+    def test_recompute_shopcart_totals(self):
+        """ It should find and fix the shopcarts whose totals drifted """
+        shopcart = ShopcartFactory()
+        shopcart.items.append(ItemFactory(quantity=2, price=5.0))
+        shopcart.create()
+        self.assertEqual(Shopcart.recompute_totals(), [])
+
+        shopcart.item_count = 7
+        shopcart.total_price = 1.0
+        db.session.commit()
+        self.assertEqual(Shopcart.recompute_totals(), [shopcart.id])
+        self.assertEqual(Shopcart.recompute_totals(fix=True), [shopcart.id])
+        self.assertEqual(Shopcart.recompute_totals(), [])
+        shopcart = Shopcart.get_by_id(shopcart.id)
+        self.assertEqual((shopcart.item_count, shopcart.total_price), (1, 10.0))
+
+    def test_item_stats(self):
+        """ It should keep the statistics of every item name up to date """
+        def stats():
+            db.session.expire_all()
+            return {stat.name: (stat.cart_count, stat.total_quantity, stat.total_value) for stat in ItemStat.top(10)}
+
+        first = ShopcartFactory()
+        first.items.extend([Item(name="Pen", quantity=2, price=1.0), Item(name="Pen", quantity=1, price=1.0)])
+        first.create()
+        second = ShopcartFactory()
+        second.create()
+        item = Item(name="Pen", quantity=4, price=1.5)
+        second.items.append(item)
+        item.create()
+        self.assertEqual(stats(), {"Pen": (2, 7, 9.0)})
+
+        Item.patch(item.id, {"quantity": 2}, shopcart_id=second.id)
+        item = Item.get_by_id(item.id)
+        item.name = "Ink"
+        item.update()
+        self.assertEqual(stats(), {"Pen": (1, 3, 3.0), "Ink": (1, 2, 3.0)})
+
+        item.shopcart_id = first.id
+        item.update()
+        self.assertEqual(stats(), {"Pen": (1, 3, 3.0), "Ink": (1, 2, 3.0)})
+        self.assertEqual([stat.name for stat in ItemStat.top(1)], ["Pen"])
+        Shopcart.get_by_id(first.id).clear()
+        self.assertEqual(stats(), {})
+
+        shopcart = Shopcart.get_by_id(second.id)
+        shopcart.items.append(Item(name="Ink", quantity=1, price=2.0))
+        shopcart.update()
+        item = Item.get_by_id(shopcart.items[0].id)
+        item.delete()
+        self.assertEqual(stats(), {})
+
+        db.session.query(ItemStat).delete()
+        db.session.commit()
+        shopcart = ShopcartFactory()
+        shopcart.items.append(Item(name="Cap", quantity=3, price=2.0))
+        shopcart.create()
+        self.assertEqual(ItemStat.rebuild(), 1)
+        self.assertEqual(stats(), {"Cap": (1, 3, 6.0)})
+        Shopcart.get_by_id(shopcart.id).delete()
+        self.assertEqual(stats(), {})
+
+    def test_item_stats_counted_under_the_shopcart_lock(self):
+        """ It should lock the shopcart before counting its items for the statistics """
+        calls = Mock()
+        for owner, name in ((Shopcart, "_lock"), (Shopcart, "bump_version"),
+                            (ItemStat, "_shopcart_has"), (ItemStat, "remove_shopcarts")):
+            patcher = patch.object(owner, name, side_effect=getattr(owner, name))
+            calls.attach_mock(patcher.start(), name)
+            self.addCleanup(patcher.stop)
+
+        def locked_first(write, lock, count):
+            calls.reset_mock()
+            write()
+            names = [call[0] for call in calls.mock_calls]
+            self.assertLess(names.index(lock), names.index(count))
+
+        shopcart = ShopcartFactory()
+        shopcart.create()
+        item = Item(name="Pen", quantity=1, price=1.0)
+        shopcart.items.append(item)
+        locked_first(item.create, "bump_version", "_shopcart_has")
+        shopcart.items.append(Item(name="Pen", quantity=1, price=1.0))
+        locked_first(shopcart.update, "bump_version", "_shopcart_has")
+        locked_first(shopcart.clear, "_lock", "remove_shopcarts")
+        locked_first(shopcart.delete, "_lock", "remove_shopcarts")
+
     ######################################################################
     #  TEST SERIALIZE ITEM
     ######################################################################
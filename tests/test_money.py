@@ -0,0 +1,88 @@
+"""
+Test cases for the whole cents money columns
+"""
+import os
+import tempfile
+
+from sqlalchemy import create_engine, inspect, text
+
+from service import app
+from service.common import status
+from service.common.cli_commands import migrate_money_columns
+from service.models import db, migrate_money, to_cents, ItemStat, Shopcart
+from . import BASE_URL_RESTX
+from .base import ServiceTestCase
+
+# the money columns as they were stored before they moved to cents
+FLOAT_SCHEMA = (
+    "CREATE TABLE shopcart (id INTEGER PRIMARY KEY, name VARCHAR(63), total_price FLOAT NOT NULL DEFAULT 0)",
+    "CREATE TABLE item (id INTEGER PRIMARY KEY, shopcart_id INTEGER, quantity INTEGER, price FLOAT NOT NULL)",
+    "CREATE TABLE archived_shopcart (id INTEGER PRIMARY KEY, total_price FLOAT NOT NULL)",
+    "CREATE TABLE item_stat (name VARCHAR(128) PRIMARY KEY, total_value FLOAT NOT NULL)",
+)
+
+
+class TestMoney(ServiceTestCase):
+    """ Money column Tests """
+
+    def test_to_cents(self):
+        """ It should round amounts to the cent, half up """
+        self.assertEqual(to_cents(19.99), 1999)
+        self.assertEqual(to_cents(2.675), 268)
+        self.assertEqual(to_cents(0.004), 0)
+        self.assertEqual(to_cents(-1.005), -101)
+        self.assertEqual(to_cents(3), 300)
+        self.assertRaises(ValueError, to_cents, float("nan"))
+        self.assertRaises(ValueError, to_cents, float("inf"))
+
+    def test_exact_totals(self):
+        """ It should add up prices without float drift, in the totals and in the database sums """
+        shopcart_id = self.client.post(BASE_URL_RESTX, json={"name": "Cents"}).get_json()["id"]
+        items_url = f"{BASE_URL_RESTX}/{shopcart_id}/items"
+        for name, quantity, price in (("Gum", 3, 0.1), ("Mint", 1, 0.2), ("Tea", 7, 0.1)):
+            resp = self.client.post(items_url, json={"shopcart_id": shopcart_id, "name": name, "quantity": 1, "price": price})
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(resp.get_json()["price"], price)
+            self.client.patch(f"{items_url}/{resp.get_json()['id']}", json={"quantity": quantity})
+        self.assertEqual(self.client.get(f"{BASE_URL_RESTX}/{shopcart_id}").get_json()["total_price"], 1.2)
+        self.assertEqual(db.session.get(Shopcart, shopcart_id).total_price_cents, 120)
+        self.assertEqual(Shopcart.recompute_totals(), [])
+        self.assertEqual(db.session.get(ItemStat, "Gum").total_value, 0.3)
+
+        item_id = self.client.get(items_url).get_json()[1]["id"]
+        resp = self.client.patch(f"{items_url}/{item_id}", json={"price": 0.335})
+        self.assertEqual(resp.get_json()["price"], 0.34)
+        resp = self.client.patch(f"{items_url}/{item_id}", json={"price": float("nan")})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(f"{BASE_URL_RESTX}/{shopcart_id}").get_json()["total_price"], 1.34)
+        self.assertEqual(Shopcart.recompute_totals(), [])
+        ItemStat.rebuild()
+        self.assertEqual(db.session.get(ItemStat, "Mint").total_value_cents, 34)
+
+    def test_migrate_money(self):
+        """ It should move the float money columns of an older database to cents once """
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f"sqlite:///{os.path.join(directory, 'old.db')}")
+            with engine.begin() as connection:
+                for statement in FLOAT_SCHEMA:
+                    connection.execute(text(statement))
+                connection.execute(text("INSERT INTO shopcart VALUES (1, 'Old', 40.97)"))
+                connection.execute(text("INSERT INTO item VALUES (1, 1, 3, 13.657), (2, 1, 1, 0.1)"))
+                connection.execute(text("INSERT INTO item_stat VALUES ('Old', 40.97)"))
+                moved = migrate_money(connection)
+            self.assertEqual(moved, ["shopcart.total_price", "item.price", "archived_shopcart.total_price",
+                                     "item_stat.total_value"])
+            with engine.begin() as connection:
+                self.assertEqual(migrate_money(connection), [])
+                columns = [column["name"] for column in inspect(connection).get_columns("item")]
+                self.assertEqual(columns, ["id", "shopcart_id", "quantity", "price_cents"])
+                prices = connection.execute(text("SELECT price_cents FROM item ORDER BY id")).scalars().all()
+                self.assertEqual(prices, [1366, 10])
+                self.assertEqual(connection.execute(text("SELECT total_price_cents FROM shopcart")).scalar(), 4097)
+            engine.dispose()
+
+    def test_migrate_money_command(self):
+        """ It should leave a database already in cents alone """
+        result = app.test_cli_runner().invoke(migrate_money_columns)
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Moved 0 money columns to cents", result.output)
@@ -0,0 +1,145 @@
+"""
+Test cases for the Transactional Outbox
+"""
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from unittest.mock import Mock, patch
+
+from service import app
+from service.common import metrics, sharding, status
+from service.common.cli_commands import outbox_publish
+from service.common.outbox import OutboxPublisher, make_sink
+from service.models import db, OutboxEvent
+from . import BASE_URL_RESTX
+from .base import ServiceTestCase
+
+
+class TestOutbox(ServiceTestCase):
+    """ Outbox Tests """
+
+    def setUp(self):
+        super().setUp()
+        OutboxEvent.enabled = True
+        self.folder = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.path = os.path.join(self.folder.name, "events.jsonl")
+
+    def tearDown(self):
+        OutboxEvent.enabled = False
+        self.folder.cleanup()
+        super().tearDown()
+
+    def _create_cart_with_item(self):
+        shopcart_id = self.client.post(BASE_URL_RESTX, json={"name": "Outboxed"}).get_json()["id"]
+        self.client.post(f"{BASE_URL_RESTX}/{shopcart_id}/items", json={
+            "shopcart_id": shopcart_id, "name": "Air Pods", "quantity": 1, "price": 129.0
+        })
+        return shopcart_id
+
+    def _published(self):
+        with open(self.path, encoding="utf-8") as events:
+            return [json.loads(line) for line in events]
+
+    def test_changes_are_written_to_the_outbox(self):
+        """ It should write an event row with every committed change only """
+        shopcart_id = self._create_cart_with_item()
+        resp = self.client.post("/api/batch", json={"operations": [
+            {"method": "PUT", "path": f"/shopcarts/{shopcart_id}", "body": {"name": "Renamed"}},
+            {"method": "GET", "path": "/shopcarts/0"},
+        ]})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+        messages = [event.message() for event in db.session.query(OutboxEvent).order_by(OutboxEvent.id)]
+        self.assertEqual([(m["type"], m["action"], m["version"]) for m in messages],
+                         [("shopcart", "created", 1), ("item", "created", 2)])
+        self.assertEqual(messages[1]["data"]["name"], "Air Pods")
+
+    def test_publish_in_batches(self):
+        """ It should publish the outbox to a file in batches and empty it """
+        shopcart_id = self._create_cart_with_item()
+        self.client.delete(f"{BASE_URL_RESTX}/{shopcart_id}")
+        publisher = OutboxPublisher(app, make_sink(f"file://{self.path}"), batch_size=2)
+        self.assertEqual(publisher.drain(), 3)
+
+        published = self._published()
+        self.assertEqual([event["action"] for event in published], ["created", "created", "deleted"])
+        self.assertEqual(len({event["outbox_id"] for event in published}), 3)
+        self.assertEqual(db.session.query(OutboxEvent).count(), 0)
+        counters = metrics.snapshot()
+        self.assertEqual((counters["outbox.published"], counters["outbox.batches"]), (3, 2))
+        self.assertGreater(counters["outbox.lag_seconds"], 0)
+        self.assertEqual(publisher.publish_batch(), 0)
+        self.assertEqual(metrics.snapshot()["outbox.lag_seconds"], 0)
+
+    def test_lag_of_the_shard_most_behind(self):
+        """ It should report the lag of the shard whose oldest pending event has waited the longest """
+        batches = {0: [Mock(id=1, created_at=time.time() - 60)], 1: []}
+        publisher = OutboxPublisher(app, Mock())
+        with patch.object(OutboxEvent, "next_batch", lambda size: batches[sharding.current_shard()]), \
+                patch.object(OutboxEvent, "remove"):
+            publisher.publish_batch(0)
+            publisher.publish_batch(1)
+            self.assertGreaterEqual(metrics.snapshot()["outbox.lag_seconds"], 60)
+            batches[0] = []
+            publisher.publish_batch(0)
+            self.assertEqual(metrics.snapshot()["outbox.lag_seconds"], 0)
+
+    def test_failed_publish_keeps_the_events(self):
+        """ It should keep the events the sink did not accept """
+        self._create_cart_with_item()
+        with self.assertRaises(OSError):
+            OutboxPublisher(app, Mock(send=Mock(side_effect=OSError("sink is down")))).publish_batch()
+        self.assertEqual(db.session.query(OutboxEvent).count(), 2)
+        self.assertGreaterEqual(metrics.snapshot()["outbox.lag_seconds"], 0)
+
+    def test_publisher_thread(self):
+        """ It should keep publishing from a background thread until stopped """
+        publisher = OutboxPublisher(app, make_sink(f"file://{self.path}"), poll_seconds=0.01)
+        publisher.start()
+        try:
+            self._create_cart_with_item()
+            deadline = time.monotonic() + 5
+            while not (os.path.exists(self.path) and len(self._published()) == 2) and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            publisher.stop()
+        self.assertEqual(len(self._published()), 2)
+
+    def test_socket_sink(self):
+        """ It should write the events to a local socket """
+        path = os.path.join(self.folder.name, "events.sock")
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(1)
+        received = []
+
+        def accept():
+            connection, _ = server.accept()
+            with connection, connection.makefile() as lines:
+                received.extend(json.loads(line) for line in lines)
+
+        thread = threading.Thread(target=accept)
+        thread.start()
+        sink = make_sink(f"unix://{path}")
+        sink.send([{"n": 1}, {"n": 2}])
+        sink.close()
+        thread.join()
+        server.close()
+        self.assertEqual(received, [{"n": 1}, {"n": 2}])
+
+        with self.assertRaises(OSError):
+            sink.send([{"n": 3}])
+        self.assertRaises(ValueError, make_sink, "kafka://broker:9092")
+
+    def test_cli_publish_once(self):
+        """ It should drain the outbox with flask outbox-publish --once """
+        self._create_cart_with_item()
+        runner = app.test_cli_runner()
+        result = runner.invoke(outbox_publish, ["--sink", f"file://{self.path}", "--once"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Published 2 events", result.output)
+        self.assertEqual(len(self._published()), 2)
+        self.assertNotEqual(runner.invoke(outbox_publish, ["--once"]).exit_code, 0)
@@ -0,0 +1,189 @@
+"""
+Test cases for the item table partitioning
+"""
+from unittest import TestCase, skipUnless
+from unittest.mock import Mock
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+from service import app
+from service.common import partitioning
+from service.common.cli_commands import partition_items
+from service.models import db, create_tables, Item, Shopcart
+from . import DATABASE_URI
+from .base import ServiceTestCase
+
+
+def compiled(statements):
+    """ The SQL of the statements for PostgreSQL """
+    return [" ".join(str(statement.compile(dialect=postgresql.dialect())).split()) for statement in statements]
+
+
+def recording_connection(answers: dict, rowcount: int = 0):
+    """ A connection recording the SQL it is given, answering the queries starting with a key of answers """
+    connection = Mock()
+    connection.sql = []
+
+    def execute(statement, _parameters=None):
+        sql = compiled([statement])[0]
+        connection.sql.append(sql)
+        answer = next((value for start, value in answers.items() if sql.startswith(start)), None)
+        return Mock(rowcount=rowcount, **{"scalar.return_value": answer})
+
+    connection.execute.side_effect = execute
+    return connection
+
+
+class TestPartitionStatements(TestCase):
+    """ Partitioned table DDL Tests """
+
+    def test_create_partitioned(self):
+        """ It should hash partition the item table on shopcart_id """
+        table = partitioning.partitioned_table(Item.__table__, 4)
+        sql = compiled(partitioning.partition_statements(table))
+        self.assertEqual(len(sql), 1 + 4 + len(Item.__table__.indexes))
+        self.assertIn("id SERIAL NOT NULL", sql[0])
+        self.assertIn("CONSTRAINT item_pkey PRIMARY KEY (id, shopcart_id)", sql[0])
+        self.assertIn("FOREIGN KEY(shopcart_id) REFERENCES shopcart (id) ON DELETE CASCADE", sql[0])
+        self.assertTrue(sql[0].endswith("PARTITION BY HASH (shopcart_id)"))
+        self.assertEqual(sql[1], "CREATE TABLE item_p0 PARTITION OF item FOR VALUES WITH (MODULUS 4, REMAINDER 0)")
+        self.assertEqual(sql[4], "CREATE TABLE item_p3 PARTITION OF item FOR VALUES WITH (MODULUS 4, REMAINDER 3)")
+        self.assertIn("CREATE INDEX ix_item_shopcart_id ON item (shopcart_id) INCLUDE (quantity, price_cents)", sql)
+        # the model table is left alone
+        self.assertEqual([column.name for column in Item.__table__.primary_key], ["id"])
+
+    def test_staged_partitions(self):
+        """ It should name the partitions of a staged table after the table it replaces """
+        table = partitioning.partitioned_table(Item.__table__, 2, name="item_partitioned")
+        table.info["partition_name"] = "item"
+        sql = compiled(partitioning.partition_statements(table))
+        self.assertTrue(sql[0].startswith("CREATE TABLE item_partitioned ("))
+        self.assertEqual(sql[1], "CREATE TABLE item_p0 PARTITION OF item_partitioned "
+                                 "FOR VALUES WITH (MODULUS 2, REMAINDER 0)")
+        self.assertEqual(sql[3], "CREATE INDEX ix_item_partitioned_shopcart_id ON item_partitioned (shopcart_id) "
+                                 "INCLUDE (quantity, price_cents)")
+        self.assertEqual([index.name for index in Item.__table__.indexes], ["ix_item_shopcart_id"])  # left alone
+
+    def test_create_partitioned_statements(self):
+        """ It should run the statements of the partitioned table and its partitions """
+        connection = recording_connection({})
+        partitioning.create_partitioned(connection, Item.__table__, 2)
+        self.assertEqual(len(connection.sql), 1 + 2 + len(Item.__table__.indexes))
+        self.assertTrue(connection.sql[0].startswith("CREATE TABLE item ("))
+
+    def test_migrate_statements(self):
+        """ It should move the rows to a staged partitioned table and give it the names of the old one """
+        connection = recording_connection({
+            "SELECT relkind": "r", "SELECT pg_get_serial_sequence": "item_id_seq"
+        }, rowcount=7)
+        self.assertEqual(partitioning.migrate_to_partitioned(connection, Item.__table__, 2), 7)
+        sql = connection.sql
+        self.assertEqual(sql[1], "LOCK TABLE item IN EXCLUSIVE MODE")
+        self.assertTrue(sql[3].startswith("CREATE TABLE item_partitioned ("))
+        self.assertEqual(sql[4], "CREATE TABLE item_p0 PARTITION OF item_partitioned "
+                                 "FOR VALUES WITH (MODULUS 2, REMAINDER 0)")
+        self.assertIn("ALTER TABLE item_partitioned ALTER COLUMN id SET DEFAULT nextval('item_id_seq')", sql)
+        self.assertIn("ALTER SEQUENCE item_id_seq OWNED BY item_partitioned.id", sql)
+        self.assertIn("INSERT INTO item_partitioned (id, shopcart_id, name, quantity, price_cents) "
+                      "SELECT id, shopcart_id, name, quantity, price_cents FROM item", sql)
+        self.assertEqual(sql[-5:], [
+            "DROP TABLE item",
+            "ALTER TABLE item_partitioned RENAME TO item",
+            "ALTER TABLE item RENAME CONSTRAINT item_partitioned_pkey TO item_pkey",
+            "ALTER TABLE item RENAME CONSTRAINT item_partitioned_shopcart_id_fkey TO item_shopcart_id_fkey",
+            "ALTER INDEX ix_item_partitioned_shopcart_id RENAME TO ix_item_shopcart_id",
+        ])
+
+    def test_migrate_partitioned_table(self):
+        """ It should not partition a table twice """
+        connection = recording_connection({"SELECT relkind": "p"})
+        self.assertRaises(ValueError, partitioning.migrate_to_partitioned, connection, Item.__table__, 2)
+        self.assertEqual(len(connection.sql), 1)
+
+
+@skipUnless(DATABASE_URI.startswith("postgresql"), "partitioning needs PostgreSQL")
+class TestPartitioning(ServiceTestCase):
+    """ Partitioned item table Tests on PostgreSQL """
+
+    def setUp(self):
+        super().setUp()
+        db.drop_all()
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        super().tearDown()
+
+    def _is_partitioned(self):
+        """ True when the item table is partitioned """
+        with db.engine.connect() as connection:
+            return partitioning.is_partitioned(connection, "item")
+
+    @staticmethod
+    def _items(shopcart_id):
+        """ The items of a shopcart """
+        return Item.query.filter_by(shopcart_id=shopcart_id).all()
+
+    def _cart_with_items(self, name, count):
+        """ A shopcart with items """
+        shopcart = Shopcart(name=name)
+        shopcart.create()
+        for number in range(count):
+            Item(shopcart_id=shopcart.id, name=f"Item {number}", quantity=1, price=1.0).create()
+        return shopcart.id
+
+    def test_create_partitioned_table(self):
+        """ It should create a partitioned item table the models work with """
+        create_tables(4)
+        self.assertTrue(self._is_partitioned())
+        shopcart_id = self._cart_with_items("Partitioned", 3)
+        items = self._items(shopcart_id)
+        self.assertEqual(len(items), 3)
+        items[0].delete()
+        self.assertEqual(len(self._items(shopcart_id)), 2)
+        with db.engine.connect() as connection:
+            partitions = connection.execute(text(
+                "SELECT count(*) FROM pg_inherits WHERE inhparent = 'item'::regclass"
+            )).scalar()
+        self.assertEqual(partitions, 4)
+
+    def test_migrate_to_partitioned(self):
+        """ It should move the items of a plain item table to partitions """
+        create_tables(0)
+        first = self._cart_with_items("First", 2)
+        second = self._cart_with_items("Second", 3)
+        db.session.remove()
+
+        runner = app.test_cli_runner()
+        result = runner.invoke(partition_items, ["--partitions", "3"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Moved 5 items", result.output)
+        self.assertTrue(self._is_partitioned())
+        self.assertEqual(len(self._items(first)), 2)
+        self.assertEqual(len(self._items(second)), 3)
+        # new items take the next ids of the sequence
+        before = max(item.id for item in Item.get_all())
+        item = Item(shopcart_id=first, name="Late", quantity=1, price=1.0)
+        item.create()
+        self.assertGreater(item.id, before)
+        self.assertNotEqual(runner.invoke(partition_items, ["--partitions", "3"]).exit_code, 0)
+
+
+class TestPartitionCommand(TestCase):
+    """ partition-items command Tests """
+
+    @skipUnless(not DATABASE_URI.startswith("postgresql"), "checks the refusal on other databases")
+    def test_refuses_other_databases(self):
+        """ It should only partition PostgreSQL tables """
+        runner = app.test_cli_runner()
+        result = runner.invoke(partition_items, ["--partitions", "4"])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("Only PostgreSQL", result.output)
+
+    def test_needs_partitions(self):
+        """ It should ask for the number of partitions """
+        result = app.test_cli_runner().invoke(partition_items, [])
+        self.assertNotEqual(result.exit_code, 0)
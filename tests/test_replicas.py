@@ -0,0 +1,106 @@
+"""
+Test cases for the read replica routing
+"""
+import os
+import tempfile
+from unittest.mock import patch
+
+from sqlalchemy import create_engine, insert
+
+from service import app, routes
+from service.common import metrics, status
+from service.common.replicas import ReplicaRouter
+from service.models import db, Item, Shopcart
+from . import BASE_URL_RESTX
+from .base import ServiceTestCase
+
+REPLICAS = ("replica_a", "replica_b")
+
+
+class TestReplicas(ServiceTestCase):
+    """ Read replica routing Tests against two SQLite replica files """
+
+    def setUp(self):
+        super().setUp()
+        self.default_router = app.extensions["replicas"]
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        for name in REPLICAS:
+            engine = create_engine(f"sqlite:///{os.path.join(self.directory.name, name)}.db")
+            db.metadata.create_all(engine)
+            db.engines[name] = engine
+        app.extensions["replicas"] = ReplicaRouter(REPLICAS, read_your_writes=60)
+
+    def tearDown(self):
+        app.extensions["replicas"] = self.default_router
+        db.session.remove()
+        for name in REPLICAS:
+            db.engines.pop(name).dispose()
+        self.directory.cleanup()
+        super().tearDown()
+
+    def _replicate(self, name, shopcart_id, shopcart_name):
+        """ A shopcart with one item on a replica only """
+        with db.engines[name].begin() as connection:
+            connection.execute(insert(Shopcart.__table__).values(id=shopcart_id, name=shopcart_name))
+            connection.execute(insert(Item.__table__).values(
+                id=shopcart_id, shopcart_id=shopcart_id, name=f"{shopcart_name} item", quantity=1, price_cents=100
+            ))
+
+    def test_reads_go_to_the_replicas_in_turn(self):
+        """ It should read the shopcarts and items from each replica in turn """
+        for name in REPLICAS:
+            self._replicate(name, 7, name)
+        names = [self.client.get(f"{BASE_URL_RESTX}/7").get_json()["name"] for _ in range(4)]
+        self.assertEqual(names, ["replica_a", "replica_b", "replica_a", "replica_b"])
+        items = self.client.get(f"{BASE_URL_RESTX}/7/items").get_json()
+        self.assertEqual([item["name"] for item in items], ["replica_a item"])
+        item = self.client.get(f"{BASE_URL_RESTX}/7/items/7").get_json()
+        self.assertEqual(item["name"], "replica_b item")
+        listing = self.client.get(BASE_URL_RESTX).get_json()
+        self.assertEqual([shopcart["name"] for shopcart in listing], ["replica_a"])
+        self.assertEqual(metrics.snapshot()["replicas.reads"], 7)
+        # the primary was never read
+        self.assertIsNone(db.session.get(Shopcart, 7))
+
+    def test_writes_go_to_the_primary(self):
+        """ It should write to the primary and read it back for the writer """
+        resp = self.client.post(BASE_URL_RESTX, json={"name": "Written"}, headers={"X-Client-Id": "writer"})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        shopcart_id = resp.get_json()["id"]
+        self.assertEqual(Shopcart.get_by_id(shopcart_id).name, "Written")
+
+        # the writer reads its write, through its session cookie or its client token
+        self.assertEqual(self.client.get(f"{BASE_URL_RESTX}/{shopcart_id}").status_code, status.HTTP_200_OK)
+        other = app.test_client()
+        resp = other.get(f"{BASE_URL_RESTX}/{shopcart_id}", headers={"X-Client-Id": "writer"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(metrics.snapshot()["replicas.primary_reads"], 2)
+
+        # other clients read a replica the write has not reached
+        resp = other.get(f"{BASE_URL_RESTX}/{shopcart_id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_writer_reads_are_not_coalesced(self):
+        """ It should not hand the writer a read of the primary that may have started before its write """
+        shopcart_id = self.client.post(BASE_URL_RESTX, json={"name": "Written"}).get_json()["id"]
+        self._replicate("replica_a", shopcart_id, "Replicated")
+        with patch.object(routes.shopcart_reads, "do", side_effect=lambda key, function: function()) as shared:
+            self.assertEqual(self.client.get(f"{BASE_URL_RESTX}/{shopcart_id}").get_json()["name"], "Written")
+            shared.assert_not_called()
+            self.assertEqual(app.test_client().get(f"{BASE_URL_RESTX}/{shopcart_id}").get_json()["name"], "Replicated")
+            shared.assert_called_once()
+
+    def test_window_passes(self):
+        """ It should send the reads of a writer back to the replicas once its window has passed """
+        app.extensions["replicas"] = ReplicaRouter(REPLICAS, read_your_writes=0)
+        shopcart_id = self.client.post(BASE_URL_RESTX, json={"name": "Written"}).get_json()["id"]
+        resp = self.client.get(f"{BASE_URL_RESTX}/{shopcart_id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_no_replicas(self):
+        """ It should read the primary without replicas """
+        app.extensions["replicas"] = ReplicaRouter([])
+        shopcart_id = self.client.post(BASE_URL_RESTX, json={"name": "Primary"}).get_json()["id"]
+        self.assertEqual(self.client.get(f"{BASE_URL_RESTX}/{shopcart_id}").status_code, status.HTTP_200_OK)
+        self.assertNotIn("Set-Cookie", self.client.post(BASE_URL_RESTX, json={"name": "Other"}).headers)
+        self.assertNotIn("replicas.reads", metrics.snapshot())
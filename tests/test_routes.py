@@ -11,9 +11,9 @@ from unittest.mock import patch
 
 from service import app
 from service.common import status  # HTTP Status Codes
-from service.models import db, init_db, Shopcart
+from service.models import db, init_db, Item, ItemStat, Shopcart
 from tests.factories import ShopcartFactory, ItemFactory
-from . import DATABASE_URI, BASE_URL_RESTX, DEFAULT_CONTENT_TYPE
+from . import DATABASE_URI, BASE_URL_RESTX, DEFAULT_CONTENT_TYPE, MERGE_PATCH_CONTENT_TYPE
 
 
 class BaseTestCase(TestCase):
@@ -29,13 +29,10 @@ class BaseTestCase(TestCase):
         app.logger.setLevel(logging.CRITICAL)
         init_db(app)
 
-    @classmethod
-    def tearDownClass(cls):
-        """ Run once after the entire test suite """
-        db.session.close()
-
     def setUp(self):
         """Run before each test"""
+        self.app_context = app.app_context()
+        self.app_context.push()
         self.client = app.test_client()
         db.session.query(Shopcart).delete()  # clean up the last tests
         db.session.commit()
@@ -43,6 +40,7 @@ class BaseTestCase(TestCase):
     def tearDown(self):
         """ Run after each test """
         db.session.remove()
+        self.app_context.pop()
 
     ######################################################################
     #  H E L P E R   M E T H O D S
@@ -144,6 +142,65 @@ class TestShopcartsService(BaseTestCase):
         self.assertEqual(len(data), 1)
         self.assertEqual(data[0]['name'], shopcart_a.name)
 
+    def test_list_shopcarts_pages(self):
+        """ [HTTP_200_OK] GET /shopcarts?limit=&after= """
+        shopcarts = self._create_an_empty_shopcart(5)
+        ids = []
+        resp = self.client.get(f"{self.base_url_restx}?limit=2")
+        while True:
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            page = resp.get_json()
+            self.assertLessEqual(len(page), 2)
+            ids += [shopcart["id"] for shopcart in page]
+            cursor = resp.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+            resp = self.client.get(f"{self.base_url_restx}?limit=2&after={cursor}")
+        self.assertEqual(ids, sorted(shopcart.id for shopcart in shopcarts))
+
+        # pages of a name
+        name = shopcarts[0].name
+        resp = self.client.get(f"{self.base_url_restx}?limit=100&name={name}")
+        self.assertTrue(all(shopcart["name"] == name for shopcart in resp.get_json()))
+        self.assertNotIn("X-Next-Cursor", resp.headers)
+
+        # the page size is capped
+        app.config["PAGE_SIZE_MAX"] = 3
+        try:
+            self.assertEqual(len(self.client.get(f"{self.base_url_restx}?limit=100").get_json()), 3)
+        finally:
+            app.config["PAGE_SIZE_MAX"] = 250
+
+        for query in ("limit=0", "limit=two", "limit=2&after=first"):
+            resp = self.client.get(f"{self.base_url_restx}?{query}")
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_top_items(self):
+        """ [HTTP_200_OK] GET /analytics/top-items?limit= """
+        db.session.query(Item).delete()
+        db.session.query(ItemStat).delete()
+        db.session.commit()
+        for names in (["Pen", "Ink"], ["Pen"], ["Pen", "Cap"]):
+            shopcart_id = self._create_an_empty_shopcart(1)[0].id
+            for name in names:
+                item = {"shopcart_id": shopcart_id, "name": name, "quantity": 1, "price": 2.5}
+                item_id = self.client.post(f"{self.base_url_restx}/{shopcart_id}/items", json=item).get_json()["id"]
+        self.client.put(f"{self.base_url_restx}/{shopcart_id}/items/{item_id}", json=dict(item, quantity=2))
+        resp = self.client.get("/api/analytics/top-items?limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), [
+            {"name": "Pen", "cart_count": 3, "total_quantity": 3, "total_value": 7.5},
+            {"name": "Cap", "cart_count": 1, "total_quantity": 2, "total_value": 5.0},
+        ])
+        self.assertEqual(len(self.client.get("/api/analytics/top-items").get_json()), 3)
+
+        for query in ("limit=0", "limit=many"):
+            resp = self.client.get(f"/api/analytics/top-items?{query}")
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, query)
+        with patch.object(ItemStat, "enabled", False):
+            resp = self.client.get("/api/analytics/top-items")
+            self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
     def test_create_shopcarts(self):
         """ [HTTP_201_CREATED] POST /shopcarts """
         shopcart = ShopcartFactory()
@@ -404,10 +461,9 @@ class TestShopcartsService(BaseTestCase):
 
         # add an item with missing field in request body
         item = ItemFactory(shopcart_id=shopcart.id)
-        item.price = None
         res = self.client.post(
             f"{self.base_url_restx}/{shopcart.id}/items",
-            json=item.serialize(),
+            json=dict(item.serialize(), price=None),
             content_type=DEFAULT_CONTENT_TYPE,
         )
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -454,9 +510,8 @@ class TestShopcartsService(BaseTestCase):
 
         # add an item with invalid price
         item = ItemFactory(shopcart_id=shopcart.id)
-        item.price = "Z"
         resp = self.client.post(f"{self.base_url_restx}/{shopcart.id}/items",
-                                json=item.serialize(),
+                                json=dict(item.serialize(), price="Z"),
                                 content_type=DEFAULT_CONTENT_TYPE)
         self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
 
@@ -730,6 +785,100 @@ class TestShopcartsService(BaseTestCase):
             )
             self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_patch_shopcarts(self):
+        """ [HTTP_200_OK] PATCH /shopcarts/{shopcart_id} """
+        shopcart = self._create_a_shopcart_with_items(2)
+        items = self.client.get(f"{self.base_url_restx}/{shopcart.id}").get_json()["items"]
+        res = self.client.patch(
+            f"{self.base_url_restx}/{shopcart.id}",
+            json={"name": "Patched"},
+            content_type=MERGE_PATCH_CONTENT_TYPE,
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        data = res.get_json()
+        self.assertEqual(data["name"], "Patched")
+        self.assertEqual(data["items"], items)
+
+        # an empty patch changes nothing
+        res = self.client.patch(f"{self.base_url_restx}/{shopcart.id}", json={})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.get_json()["name"], "Patched")
+
+    def test_patch_shopcarts_errors(self):
+        """ [HTTP_400/404/415] PATCH /shopcarts/{shopcart_id} """
+        shopcart = self._create_an_empty_shopcart(1)[0]
+        for body in ({"name": ""}, {"name": 42}, {"id": 7}, ["name"]):
+            res = self.client.patch(f"{self.base_url_restx}/{shopcart.id}", json=body)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, body)
+
+        res = self.client.patch(f"{self.base_url_restx}/{shopcart.id + 10000}", json={"name": "Ghost"})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        res = self.client.patch(f"{self.base_url_restx}/-1", json={"name": "Ghost"})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+        res = self.client.patch(
+            f"{self.base_url_restx}/{shopcart.id}", data='{"name": "Patched"}', content_type="text/plain"
+        )
+        self.assertEqual(res.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_patch_items(self):
+        """ [HTTP_200_OK] PATCH /shopcarts/{shopcart_id}/items/{item_id} """
+        shopcart = self._create_an_empty_shopcart(1)[0]
+        res = self.client.post(
+            f"{self.base_url_restx}/{shopcart.id}/items",
+            json=ItemFactory(quantity=1, price=10.0).serialize(),
+            content_type=DEFAULT_CONTENT_TYPE,
+        )
+        data = res.get_json()
+
+        res = self.client.patch(
+            f'{self.base_url_restx}/{shopcart.id}/items/{data["id"]}',
+            json={"quantity": 3},
+            content_type=MERGE_PATCH_CONTENT_TYPE,
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        patched = res.get_json()
+        self.assertEqual(patched["quantity"], 3)
+        self.assertEqual(patched["name"], data["name"])
+        self.assertEqual(patched["price"], 10.0)
+
+        res = self.client.patch(
+            f'{self.base_url_restx}/{shopcart.id}/items/{data["id"]}',
+            json={"name": "Renamed", "price": 12.5},
+            content_type=MERGE_PATCH_CONTENT_TYPE,
+        )
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        res = self.client.get(f'{self.base_url_restx}/{shopcart.id}/items/{data["id"]}')
+        self.assertEqual(
+            (res.get_json()["name"], res.get_json()["quantity"], res.get_json()["price"]), ("Renamed", 3, 12.5)
+        )
+
+    def test_patch_items_errors(self):
+        """ [HTTP_400/404/415] PATCH /shopcarts/{shopcart_id}/items/{item_id} """
+        shopcart = self._create_an_empty_shopcart(1)[0]
+        res = self.client.post(
+            f"{self.base_url_restx}/{shopcart.id}/items",
+            json=ItemFactory().serialize(),
+            content_type=DEFAULT_CONTENT_TYPE,
+        )
+        item_url = f'{self.base_url_restx}/{shopcart.id}/items/{res.get_json()["id"]}'
+        for body in ({"quantity": 0}, {"quantity": "many"}, {"quantity": 1.5}, {"quantity": True},
+                     {"price": -1}, {"price": None}, {"name": ""}, {"shopcart_id": 1}):
+            res = self.client.patch(item_url, json=body, content_type=MERGE_PATCH_CONTENT_TYPE)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, body)
+
+        other = self._create_an_empty_shopcart(1)[0]
+        res = self.client.patch(
+            item_url.replace(f"/{shopcart.id}/", f"/{other.id}/"), json={"quantity": 2},
+            content_type=MERGE_PATCH_CONTENT_TYPE,
+        )
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        res = self.client.patch(f"{self.base_url_restx}/{shopcart.id}/items/-1", json={"quantity": 2})
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+        res = self.client.patch(item_url, data='{"quantity": 2}', content_type="text/plain")
+        self.assertEqual(res.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
     def test_delete_items(self):
         """ [HTTP_204_NO_CONTENT] DELETE /shopcarts/{shopcart_id}/items/{item_id} """
         shopcart = self._create_an_empty_shopcart(1)[0]
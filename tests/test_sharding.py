@@ -0,0 +1,201 @@
+"""
+Test cases for the shopcart sharding
+"""
+import os
+import tempfile
+from datetime import timedelta
+
+from sqlalchemy import create_engine, select, update
+
+from service import app
+from service.common import sharding, status
+from service.common.cli_commands import rebalance_shards
+from service.common.expiry import ExpirySweeper
+from service.common.sharding import ShardRouter
+from service.models import db, create_tables, ArchivedShopcart, IdBlock, Item, ItemStat, Shopcart, utcnow
+from . import BASE_URL_RESTX
+from .base import ServiceTestCase
+
+SHARDS = 3
+HOUR = 3600
+
+
+class TestSharding(ServiceTestCase):
+    """ Sharding Tests against two SQLite shard files next to the test database """
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        for shard in range(1, SHARDS):
+            db.engines[sharding.shard_key(shard)] = create_engine(
+                f"sqlite:///{os.path.join(self.directory.name, f'shard_{shard}.db')}"
+            )
+        for model in (ArchivedShopcart, Item, Shopcart, ItemStat, IdBlock):
+            db.session.query(model).delete()
+        db.session.commit()
+        self._shard(SHARDS)
+        create_tables()
+
+    def tearDown(self):
+        sharding.router = ShardRouter()
+        db.session.remove()
+        for shard in range(1, SHARDS):
+            db.engines.pop(sharding.shard_key(shard)).dispose()
+        self.directory.cleanup()
+        super().tearDown()
+
+    @staticmethod
+    def _shard(count):
+        """ Spread the shopcarts over count shards """
+        sharding.router = ShardRouter(count, block_size=4)
+
+    @staticmethod
+    def _ids(shard, model):
+        """ The ids of the rows of a model stored on a shard """
+        with db.engines[sharding.shard_key(shard)].connect() as connection:
+            return set(connection.execute(select(model.id)).scalars())
+
+    def _create(self, count, items=1):
+        """ Shopcarts with items, created through the API """
+        shopcart_ids = []
+        for number in range(count):
+            shopcart_id = self.client.post(BASE_URL_RESTX, json={"name": f"Cart {number}"}).get_json()["id"]
+            for name in ("Air Pods", "Case")[:items]:
+                self.client.post(f"{BASE_URL_RESTX}/{shopcart_id}/items", json={
+                    "shopcart_id": shopcart_id, "name": name, "quantity": 1, "price": 9.0
+                })
+            shopcart_ids.append(shopcart_id)
+        return shopcart_ids
+
+    def test_shopcarts_live_on_their_shard(self):
+        """ It should store every shopcart and its items on the shard of its id """
+        shopcart_ids = self._create(6, items=2)
+        self.assertEqual(len(set(shopcart_ids)), 6)
+        for shard in range(SHARDS):
+            on_shard = self._ids(shard, Shopcart)
+            self.assertEqual(on_shard, {shopcart_id for shopcart_id in shopcart_ids if shopcart_id % SHARDS == shard})
+        item_ids = [self._ids(shard, Item) for shard in range(SHARDS)]
+        self.assertEqual(sum(len(ids) for ids in item_ids), 12)
+        self.assertEqual(len(set().union(*item_ids)), 12)  # item ids are unique across the shards
+
+        for shopcart_id in shopcart_ids:
+            resp = self.client.get(f"{BASE_URL_RESTX}/{shopcart_id}")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.get_json()["item_count"], 2)
+            item = resp.get_json()["items"][0]
+            resp = self.client.put(f"{BASE_URL_RESTX}/{shopcart_id}/items/{item['id']}", json=dict(item, quantity=3))
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.client.delete(f"{BASE_URL_RESTX}/{shopcart_ids[0]}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(f"{BASE_URL_RESTX}/{shopcart_ids[0]}").status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_item_created_in_path_shopcart(self):
+        """ It should create an item on the shard of the shopcart of the path, whatever the body names """
+        shopcart_ids = self._create(2, items=0)
+        first, second = shopcart_ids[0], shopcart_ids[1]
+        resp = self.client.post(f"{BASE_URL_RESTX}/{first}/items", json={
+            "shopcart_id": second, "name": "Stray", "quantity": 1, "price": 1.0
+        })
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(resp.get_json()["shopcart_id"], first)
+        self.assertIn(resp.get_json()["id"], self._ids(first % SHARDS, Item))
+        self.assertEqual(self.client.get(f"{BASE_URL_RESTX}/{first}").get_json()["item_count"], 1)
+        self.assertEqual(self.client.get(f"{BASE_URL_RESTX}/{second}").get_json()["item_count"], 0)
+
+    def test_item_moved_within_its_shard(self):
+        """ It should move an item to a shopcart of its shard and refuse to move it to another shard """
+        self._shard(2)
+        shopcart_ids = self._create(3)
+        first, other, same = shopcart_ids[0], shopcart_ids[1], shopcart_ids[2]
+        self.assertNotEqual(first % 2, other % 2)
+        self.assertEqual(first % 2, same % 2)
+        item = self.client.get(f"{BASE_URL_RESTX}/{first}/items").get_json()[0]
+        url = f"{BASE_URL_RESTX}/{first}/items/{item['id']}"
+
+        resp = self.client.put(url, json=dict(item, shopcart_id=other))
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        db.session.rollback()  # the requests share the session of the test
+        self.assertEqual(self.client.get(url).get_json()["shopcart_id"], first)
+        self.assertEqual(self.client.get(f"{BASE_URL_RESTX}/{other}").get_json()["item_count"], 1)
+
+        resp = self.client.put(url, json=dict(item, shopcart_id=same))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(f"{BASE_URL_RESTX}/{first}").get_json()["item_count"], 0)
+        self.assertEqual(self.client.get(f"{BASE_URL_RESTX}/{same}").get_json()["item_count"], 2)
+
+    def test_items_added_by_put(self):
+        """ It should give the items a shopcart PUT adds ids unique across the shards """
+        shopcart_ids = self._create(SHARDS, items=0)
+        for shopcart_id in shopcart_ids:
+            resp = self.client.put(f"{BASE_URL_RESTX}/{shopcart_id}", json={"name": "Put", "items": [
+                {"shopcart_id": shopcart_id, "name": name, "quantity": 1, "price": 2.0} for name in ("Pen", "Ink")
+            ]})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            resp = self.client.post(f"{BASE_URL_RESTX}/{shopcart_id}/items", json={
+                "shopcart_id": shopcart_id, "name": "Pad", "quantity": 1, "price": 3.0
+            })
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        item_ids = [self._ids(shard, Item) for shard in range(SHARDS)]
+        self.assertEqual([len(ids) for ids in item_ids], [3] * SHARDS)
+        self.assertEqual(len(set().union(*item_ids)), 3 * SHARDS)
+
+    def test_scatter_gather(self):
+        """ It should list, look up and rank the shopcarts of every shard """
+        shopcart_ids = self._create(5)
+        listing = self.client.get(BASE_URL_RESTX).get_json()
+        self.assertEqual([shopcart["id"] for shopcart in listing], sorted(shopcart_ids))
+        named = self.client.get(BASE_URL_RESTX, query_string={"name": "Cart 3"}).get_json()
+        self.assertEqual([shopcart["id"] for shopcart in named], [shopcart_ids[3]])
+
+        resp = self.client.get(BASE_URL_RESTX, query_string={"limit": 3})
+        first = [shopcart["id"] for shopcart in resp.get_json()]
+        resp = self.client.get(BASE_URL_RESTX, query_string={"limit": 3, "after": resp.headers["X-Next-Cursor"]})
+        self.assertNotIn("X-Next-Cursor", resp.headers)
+        self.assertEqual(first + [shopcart["id"] for shopcart in resp.get_json()], sorted(shopcart_ids))
+
+        top = self.client.get("/api/analytics/top-items").get_json()
+        self.assertEqual([(stat["name"], stat["cart_count"]) for stat in top], [("Air Pods", 5)])
+
+    def test_sweeps_every_shard(self):
+        """ It should expire the shopcarts of every shard """
+        shopcart_ids = self._create(4)
+        for shard in range(SHARDS):
+            with sharding.on_shard(shard):
+                db.session.execute(update(Shopcart).values(updated_at=utcnow() - timedelta(hours=3)))
+                db.session.commit()
+        self.assertEqual(ExpirySweeper(app, ttl=2 * HOUR, chunk_size=1).sweep(), len(shopcart_ids))
+        self.assertEqual(self.client.get(BASE_URL_RESTX).get_json(), [])
+
+    def test_rebalance(self):
+        """ It should move the shopcarts to their shard once shards are added """
+        self._shard(1)
+        shopcart_ids = self._create(5, items=2)
+        archived = shopcart_ids[1]
+        db.session.execute(update(Shopcart).where(Shopcart.id == archived).values(
+            updated_at=utcnow() - timedelta(days=100)
+        ))
+        db.session.commit()
+        self.assertEqual(Shopcart.archive_stale(age=90 * 86400), 1)
+
+        self._shard(SHARDS)
+        misplaced = [shopcart_id for shopcart_id in shopcart_ids if shopcart_id % SHARDS]
+        resp = self.client.get(f"{BASE_URL_RESTX}/{misplaced[-1]}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)  # not on its shard yet
+        runner = app.test_cli_runner()
+        result = runner.invoke(rebalance_shards, ["--batch-size", "2"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn(f"Moved {len(misplaced)} shopcarts", result.output)
+        self.assertIn("Moved 0 shopcarts", runner.invoke(rebalance_shards).output)
+
+        for shard in range(SHARDS):
+            expected = {shopcart_id for shopcart_id in shopcart_ids if shopcart_id % SHARDS == shard}
+            self.assertEqual(self._ids(shard, Shopcart) | self._ids(shard, ArchivedShopcart), expected)
+        for shopcart_id in shopcart_ids:
+            resp = self.client.get(f"{BASE_URL_RESTX}/{shopcart_id}")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(resp.get_json()["items"]), 2)
+        top = {stat["name"]: stat["cart_count"] for stat in self.client.get("/api/analytics/top-items").get_json()}
+        self.assertEqual(top, {"Air Pods": 4, "Case": 4})
+
+        # new shopcarts take ids none of the moved ones has
+        self.assertNotIn(self._create(1)[0], shopcart_ids)
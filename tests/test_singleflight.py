@@ -0,0 +1,105 @@
+"""
+Test cases for Single Flight request coalescing
+"""
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from service import app, routes
+from service.common import metrics, status
+from service.common.singleflight import Group
+from . import BASE_URL_RESTX
+from .base import ServiceTestCase
+
+CONCURRENCY = 5
+
+
+def run_concurrently(function):
+    """ Call function from CONCURRENCY threads released together """
+    barrier = threading.Barrier(CONCURRENCY)
+    results = [None] * CONCURRENCY
+
+    def worker(index):
+        barrier.wait()
+        results[index] = function()
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(CONCURRENCY)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class TestGroup(TestCase):
+    """ Group Tests """
+
+    def setUp(self):
+        metrics.reset()
+
+    def test_concurrent_calls_are_coalesced(self):
+        """ It should run one call for concurrent callers of the same key """
+        group = Group("test")
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return {"answer": 42}
+
+        results = run_concurrently(lambda: group.do("key", slow))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{"answer": 42}] * CONCURRENCY)
+        counters = metrics.snapshot()
+        self.assertEqual(counters["singleflight.test.executed"], 1)
+        self.assertEqual(counters["singleflight.test.collapsed"], CONCURRENCY - 1)
+
+        # the key is released once the call is over
+        self.assertEqual(group.do("key", lambda: "fresh"), "fresh")
+
+    def test_errors_are_shared(self):
+        """ It should raise the error of the call in every waiter """
+        group = Group("test")
+
+        def failing():
+            time.sleep(0.2)
+            raise ValueError("boom")
+
+        def call():
+            try:
+                return group.do("key", failing)
+            except ValueError as error:
+                return str(error)
+
+        self.assertEqual(run_concurrently(call), ["boom"] * CONCURRENCY)
+
+    def test_disabled(self):
+        """ It should run every call when disabled """
+        group = Group("test")
+        group.enabled = False
+        calls = []
+        run_concurrently(lambda: group.do("key", lambda: calls.append(1)))
+        self.assertEqual(len(calls), CONCURRENCY)
+
+
+class TestCoalescedRoutes(ServiceTestCase):
+    """ Coalesced cart reads Tests """
+
+    def test_concurrent_cart_reads(self):
+        """ It should serve concurrent reads of a cart with one load """
+        resp = app.test_client().post(BASE_URL_RESTX, json={"name": "Flash Sale"})
+        shopcart_id = resp.get_json()["id"]
+        original = routes.load_shopcart
+
+        def slow_load(shopcart_id):
+            time.sleep(0.2)
+            return original(shopcart_id)
+
+        with patch("service.routes.load_shopcart", side_effect=slow_load) as load:
+            responses = run_concurrently(lambda: app.test_client().get(f"{BASE_URL_RESTX}/{shopcart_id}"))
+        self.assertEqual(load.call_count, 1)
+        for resp in responses:
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.get_json()["name"], "Flash Sale")
+        self.assertEqual(metrics.snapshot()["singleflight.shopcart_reads.collapsed"], CONCURRENCY - 1)
@@ -0,0 +1,72 @@
+"""
+Test cases for the database snapshot export and import
+"""
+import gzip
+import os
+import tempfile
+from unittest.mock import patch
+
+from service import app
+from service.common import snapshot
+from service.common.cli_commands import db_export, db_import
+from service.models import db, Item, ItemStat, Shopcart
+from . import BASE_URL_RESTX
+from .base import ServiceTestCase
+
+
+class TestSnapshot(ServiceTestCase):
+    """ Snapshot export and import Tests """
+
+    def setUp(self):
+        super().setUp()
+        self.runner = app.test_cli_runner()
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        self.directory.cleanup()
+        super().tearDown()
+
+    def _rows(self):
+        """ Every shopcart and item as stored """
+        db.session.expire_all()
+        return ([shopcart.serialize() for shopcart in Shopcart.get_all()],
+                sorted((item.serialize() for item in Item.get_all()), key=lambda item: item["id"]))
+
+    def test_export_and_import(self):
+        """ It should export the shopcarts and items and import them back over the tables """
+        for name in ("First", "Second, with \"quotes\""):
+            shopcart_id = self.client.post(BASE_URL_RESTX, json={"name": name}).get_json()["id"]
+            for number in range(3):
+                self.client.post(f"{BASE_URL_RESTX}/{shopcart_id}/items", json={
+                    "shopcart_id": shopcart_id, "name": f"Item {number}", "quantity": 1, "price": 1.25
+                })
+        exported = self._rows()
+
+        with patch.object(snapshot, "REPORT_SECONDS", 0):
+            result = self.runner.invoke(db_export, ["--path", self.directory.name, "--chunk-size", "2"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("item: 6 rows", result.output)
+        self.assertIn("Exported 8 rows (2 shopcart, 6 item)", result.output)
+        with gzip.open(snapshot.snapshot_path(self.directory.name, "item"), "rt") as stream:
+            self.assertEqual(stream.readline().strip(), "id,shopcart_id,name,quantity,price_cents")
+            self.assertEqual(len(stream.readlines()), 6)
+
+        self.client.delete(f"{BASE_URL_RESTX}/{exported[0][0]['id']}")
+        result = self.runner.invoke(db_import, ["--path", self.directory.name])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("The item table is not empty", result.output)
+
+        result = self.runner.invoke(db_import, ["--path", self.directory.name, "--replace", "--chunk-size", "4"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("Imported 8 rows (2 shopcart, 6 item)", result.output)
+        self.assertEqual(self._rows(), exported)
+        stat = db.session.get(ItemStat, "Item 0")
+        self.assertEqual((stat.cart_count, stat.total_quantity, stat.total_value), (2, 2, 2.5))
+
+    def test_import_missing_snapshot(self):
+        """ It should not import a directory without snapshot files """
+        result = self.runner.invoke(db_import, ["--path", os.path.join(self.directory.name, "missing")])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn("No shopcart table in the snapshot", result.output)
@@ -0,0 +1,43 @@
+"""
+Test cases for the compiled statement cache metrics
+"""
+
+from sqlalchemy import select
+
+from service.common import metrics
+from service.models import db, Shopcart
+from . import BASE_URL_RESTX
+from .base import ServiceTestCase
+
+
+class TestStatementCache(ServiceTestCase):
+    """ Statement cache metrics Tests """
+
+    def test_hits_and_misses(self):
+        """ It should count a miss the first time a statement is compiled and hits afterwards """
+        statement = select(Shopcart.id).where(Shopcart.name.startswith("Cached"), Shopcart.version > 99)
+        for name in ("Cached", "Cached again"):
+            db.session.execute(statement.where(Shopcart.name != name)).all()
+        counters = metrics.snapshot()
+        self.assertEqual((counters["db.statement_cache.miss"], counters["db.statement_cache.hit"]), (1, 1))
+        self.assertEqual(counters["db.statement_cache.hit_ratio"], 0.5)
+
+    def test_read_paths_are_cached(self):
+        """ It should serve repeated cart and item reads from compiled statements """
+        shopcart_id = self.client.post(BASE_URL_RESTX, json={"name": "Cached"}).get_json()["id"]
+        item = self.client.post(f"{BASE_URL_RESTX}/{shopcart_id}/items", json={
+            "shopcart_id": shopcart_id, "name": "Air Pods", "quantity": 1, "price": 129.0
+        }).get_json()
+        urls = [f"{BASE_URL_RESTX}/{shopcart_id}", f"{BASE_URL_RESTX}/{shopcart_id}/items",
+                f"{BASE_URL_RESTX}/{shopcart_id}/items/{item['id']}", f"{BASE_URL_RESTX}?name=Cached"]
+        for url in urls:
+            self.client.get(url)
+        metrics.reset()
+        db.session.expire_all()  # read from the database again, as a new request would
+        for url in urls:
+            self.client.get(url)
+            db.session.expire_all()
+        counters = self.client.get("/metrics").get_json()
+        self.assertGreater(counters["db.statement_cache.hit"], 0)
+        self.assertNotIn("db.statement_cache.miss", counters)
+        self.assertEqual(counters["db.statement_cache.hit_ratio"], 1.0)
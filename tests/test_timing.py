@@ -0,0 +1,56 @@
+"""
+Test cases for the Server-Timing instrumentation
+"""
+from unittest import TestCase
+
+from service import app
+from service.common import status
+from service.common.timing import RequestTimings, SPANS
+from . import BASE_URL_RESTX
+from .base import ServiceTestCase
+
+
+class TestRequestTimings(TestCase):
+    """ RequestTimings Tests """
+
+    def test_spans_are_exclusive(self):
+        """ It should only attribute nested time to the innermost span """
+        timings = RequestTimings()
+        timings.start("serialize")
+        timings.start("db")
+        timings.stop()
+        timings.stop()
+        timings.stop()  # unbalanced stops are ignored
+        self.assertGreater(timings.durations["serialize"], 0)
+        self.assertGreater(timings.durations["db"], 0)
+        header = timings.header()
+        for name in SPANS + ("total",):
+            self.assertIn(f"{name};dur=", header)
+
+
+class TestServerTiming(ServiceTestCase):
+    """ Server-Timing header Tests """
+
+    def tearDown(self):
+        app.config["SERVER_TIMING_ENABLED"] = False
+        super().tearDown()
+
+    def test_server_timing_header(self):
+        """ It should break the request down into spans when enabled """
+        resp = self.client.post(BASE_URL_RESTX, json={"name": "Timed"})
+        self.assertNotIn("Server-Timing", resp.headers)
+
+        app.config["SERVER_TIMING_ENABLED"] = True
+        shopcart_id = resp.get_json()["id"]
+        resp = self.client.get(f"{BASE_URL_RESTX}/{shopcart_id}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        spans = dict(
+            entry.split(";dur=") for entry in resp.headers["Server-Timing"].split(", ")
+        )
+        self.assertEqual(set(spans), set(SPANS) | {"total"})
+        for name in ("db", "hydrate", "serialize", "marshal", "encode"):
+            self.assertGreater(float(spans[name]), 0, name)
+        self.assertGreaterEqual(float(spans["total"]), sum(float(spans[name]) for name in SPANS))
+
+        resp = self.client.get(f"{BASE_URL_RESTX}?name=Timed")
+        self.assertGreater(float(resp.headers["Server-Timing"].split("hydrate;dur=")[1].split(",")[0]), 0)
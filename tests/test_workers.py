@@ -0,0 +1,119 @@
+"""
+Concurrent Worker Tests
+
+Serves the app with gunicorn and gunicorn.conf.py in a separate process and
+sends it concurrent requests, as the threaded and gevent workers do in the
+pods.
+"""
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from unittest import TestCase, skipUnless
+
+from flask import has_app_context
+
+from service import app
+from service.models import init_db
+from . import DATABASE_URI, BASE_URL_RESTX
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONCURRENCY = 16
+
+
+def free_port() -> int:
+    """ A port nothing listens on """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def call(url, method="GET", body=None):
+    """ The status and JSON body of a request """
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        content = response.read()
+        return response.status, json.loads(content) if content else None
+
+
+@contextmanager
+def gunicorn(worker_class):
+    """ Serve the app with the configured gunicorn and yield its base URL """
+    port = free_port()
+    env = dict(os.environ, DATABASE_URI=DATABASE_URI, GUNICORN_WORKER_CLASS=worker_class,
+               WEB_CONCURRENCY="1", GUNICORN_THREADS="8", LOG_FORMAT="text")
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+         "--log-level", "warning", "service:app"],
+        cwd=PROJECT_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                call(f"{base_url}/health")
+                break
+            except OSError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+        yield base_url
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+class TestWorkers(TestCase):
+    """ gthread and gevent worker Tests """
+
+    def test_init_db_leaves_no_app_context(self):
+        """ It should not leave an app context pushed for the requests of the thread to share """
+        contexts = []
+        thread = threading.Thread(target=lambda: (init_db(app), contexts.append(has_app_context())))
+        thread.start()
+        thread.join()
+        self.assertEqual(contexts, [False])
+
+    def _concurrent_requests(self, base_url):
+        url = f"{base_url}{BASE_URL_RESTX}"
+        with ThreadPoolExecutor(CONCURRENCY) as pool:
+            names = [f"Worker cart {n}" for n in range(CONCURRENCY)]
+            created = list(pool.map(lambda name: call(url, "POST", {"name": name}), names))
+            self.assertEqual([status for status, _ in created], [201] * CONCURRENCY)
+            carts = [body for _, body in created]
+            # every request reads through its own session
+            read = list(pool.map(lambda cart: call(f"{url}/{cart['id']}")[1]["name"], carts))
+            self.assertEqual(read, names)
+
+            shopcart_id = carts[0]["id"]
+            items = [{"shopcart_id": shopcart_id, "name": f"Item {n}", "quantity": 1, "price": 1.0}
+                     for n in range(CONCURRENCY)]
+            statuses = list(pool.map(lambda item: call(f"{url}/{shopcart_id}/items", "POST", item)[0], items))
+            self.assertEqual(statuses, [201] * CONCURRENCY)
+            list(pool.map(lambda cart: call(f"{url}/{cart['id']}", "DELETE"), carts[1:]))
+
+        _, shopcart = call(f"{url}/{shopcart_id}")
+        self.assertEqual((shopcart["item_count"], shopcart["version"]), (CONCURRENCY, CONCURRENCY + 1))
+        self.assertLessEqual({item["name"] for item in items}, {item["name"] for item in shopcart["items"]})
+        call(f"{url}/{shopcart_id}", "DELETE")
+
+    def test_gthread_workers(self):
+        """ It should serve concurrent requests from the threads of a gthread worker """
+        with gunicorn("gthread") as base_url:
+            self._concurrent_requests(base_url)
+
+    @skipUnless(importlib.util.find_spec("gevent") and importlib.util.find_spec("psycogreen"),
+                "gevent and psycogreen are not installed")
+    def test_gevent_workers(self):
+        """ It should serve concurrent requests from the greenlets of a gevent worker """
+        with gunicorn("gevent") as base_url:
+            self._concurrent_requests(base_url)
@@ -0,0 +1,107 @@
+"""
+Write Throughput Benchmark
+
+Boots the service once with a commit per request and once with group commit,
+each in its own interpreter against the configured database, and measures
+how many item adds per second concurrent threads get through, each thread
+adding items to its own cart through the Flask test client in a fresh app
+context like a request of a gthread worker.
+
+Usage:
+  python -m tests.write_benchmark
+  python -m tests.write_benchmark --threads 16 --writes 100 --json
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_THREADS = int(os.getenv("BENCHMARK_THREADS", "8"))
+DEFAULT_WRITES = int(os.getenv("BENCHMARK_WRITES", "50"))
+
+BASE_URL = "/api/shopcarts"
+MODES = {"per_request_commit": "false", "group_commit": "true"}
+
+
+def measure(threads: int, writes: int) -> dict:
+    """ Boot the service in this interpreter and time concurrent item adds """
+    # pylint: disable=import-outside-toplevel
+    from service import app
+    from service.common import metrics
+    from service.models import db, Shopcart
+
+    app.config["TESTING"] = True
+    app.logger.setLevel(logging.CRITICAL)
+    client = app.test_client()
+    shopcart_ids = [client.post(BASE_URL, json={"name": f"Writer {n}"}).get_json()["id"] for n in range(threads)]
+    start = threading.Barrier(threads)
+
+    def add_items(shopcart_id):
+        start.wait()
+        statuses = []
+        for number in range(writes):
+            with app.app_context():
+                resp = app.test_client().post(f"{BASE_URL}/{shopcart_id}/items", json={
+                    "shopcart_id": shopcart_id, "name": f"Item {number}", "quantity": 1, "price": 1.0
+                })
+                statuses.append(resp.status_code)
+        return statuses
+
+    metrics.reset()
+    try:
+        started = time.monotonic()
+        with ThreadPoolExecutor(threads) as pool:
+            statuses = [code for codes in pool.map(add_items, shopcart_ids) for code in codes]
+        elapsed = time.monotonic() - started
+    finally:
+        with app.app_context():
+            db.session.query(Shopcart).filter(Shopcart.id.in_(shopcart_ids)).delete()
+            db.session.commit()
+    counters = metrics.snapshot()
+    return {
+        "writes_per_second": round(statuses.count(201) / elapsed, 1),
+        "failed_writes": len(statuses) - statuses.count(201),
+        "flushes": counters.get("group_commit.flushes", 0),
+    }
+
+
+def main(argv=None) -> int:
+    """ Time the writes with and without group commit """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS)
+    parser.add_argument("--writes", type=int, default=DEFAULT_WRITES, help="item adds per thread")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.measure:
+        print(json.dumps(measure(args.threads, args.writes)))
+        return 0
+
+    report = {"threads": args.threads, "writes_per_thread": args.writes}
+    for mode, enabled in MODES.items():
+        output = subprocess.run(
+            [sys.executable, "-m", "tests.write_benchmark", "--measure",
+             "--threads", str(args.threads), "--writes", str(args.writes)],
+            env=dict(os.environ, GROUP_COMMIT_ENABLED=enabled, LOG_FORMAT="text"),
+            check=True, capture_output=True, text=True,
+        ).stdout
+        report[mode] = json.loads(output.strip().splitlines()[-1])
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for mode in MODES:
+            result = report[mode]
+            print(f"{mode:<20} {result['writes_per_second']:>9} writes/s "
+                  f"({result['failed_writes']} failed, {result['flushes']} flushes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())